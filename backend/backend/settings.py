@@ -60,6 +60,8 @@ MIDDLEWARE = [
     'django.contrib.auth.middleware.AuthenticationMiddleware',
     'django.contrib.messages.middleware.MessageMiddleware',
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
+    'users.timing.ServerTimingMiddleware',
+    'users.tracing.RequestTraceMiddleware',
 ]
 
 ROOT_URLCONF = 'backend.urls'
@@ -175,4 +177,152 @@ MEDIA_ROOT = BASE_DIR / 'media'
 # Add these to your settings.py
 MODEL_PATH_LIGHT = BASE_DIR / 'ad_models' / 'ad_detection_cnn_model.keras'  # Your original model
 MODEL_PATH_DARK = BASE_DIR / 'ad_models' / 'deployable_skin_model_final.pkl'    # Your new hybrid model
-# MODEL_PATH = BASE_DIR / 'ad_models' / 'ad_detection_cnn_model.keras'
\ No newline at end of file
+# MODEL_PATH = BASE_DIR / 'ad_models' / 'ad_detection_cnn_model.keras'
+# Dark model inference: score preprocessed arrays in memory. Set to True to force the legacy
+# path that re-encodes each image as a temp JPEG for predict_single_image (compatibility only).
+ADSCAN_DARK_TEMPFILE_FALLBACK = False
+
+# Model loading: 'lazy' loads each model on first prediction; 'eager' loads and verifies both
+# models when a server process starts: WSGI/ASGI workers and runserver (see users/apps.py).
+# Other management commands, including the outbox/PDF workers, never load them.
+ADSCAN_MODEL_LOADING = os.getenv('ADSCAN_MODEL_LOADING', 'lazy')
+
+# Inference service: 'inline' runs predictions in the request thread, 'pool' uses a per-process
+# micro-batching queue + model-owning process pool, 'socket' talks to `manage.py run_inference_server`.
+# Only 'socket' shares one copy of the models between web workers: with 'pool' every gunicorn
+# worker spawns its own pool, so run a single web worker with it.
+ADSCAN_INFERENCE_BACKEND = os.getenv('ADSCAN_INFERENCE_BACKEND', 'inline')
+ADSCAN_INFERENCE_WORKERS = int(os.getenv('ADSCAN_INFERENCE_WORKERS', '1'))
+ADSCAN_INFERENCE_MAX_BATCH_SIZE = int(os.getenv('ADSCAN_INFERENCE_MAX_BATCH_SIZE', '16'))  # images per forward pass
+ADSCAN_INFERENCE_MAX_WAIT_MS = int(os.getenv('ADSCAN_INFERENCE_MAX_WAIT_MS', '10'))  # wait to fill a batch
+ADSCAN_INFERENCE_QUEUE_SIZE = int(os.getenv('ADSCAN_INFERENCE_QUEUE_SIZE', '256'))
+ADSCAN_INFERENCE_SOCKET = os.getenv('ADSCAN_INFERENCE_SOCKET', '/tmp/adscan-inference.sock')
+
+# Prediction cache (content hash + model identity -> raw model output). LocMemCache is LRU and
+# capped by MAX_ENTRIES but per process; set ADSCAN_PREDICTION_CACHE_REDIS_URL to share it between
+# workers (configure Redis with maxmemory-policy allkeys-lru for the same eviction behaviour).
+ADSCAN_PREDICTION_CACHE_ENABLED = os.getenv('ADSCAN_PREDICTION_CACHE_ENABLED', '1') == '1'
+ADSCAN_PREDICTION_CACHE_ALIAS = 'adscan_predictions'
+ADSCAN_PREDICTION_CACHE_TIMEOUT = 7 * 24 * 3600
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+    },
+    ADSCAN_PREDICTION_CACHE_ALIAS: (
+        {
+            'BACKEND': 'django.core.cache.backends.redis.RedisCache',
+            'LOCATION': os.getenv('ADSCAN_PREDICTION_CACHE_REDIS_URL'),
+        } if os.getenv('ADSCAN_PREDICTION_CACHE_REDIS_URL') else {
+            'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+            'LOCATION': 'adscan-predictions',
+            'OPTIONS': {'MAX_ENTRIES': int(os.getenv('ADSCAN_PREDICTION_CACHE_MAX_ENTRIES', '10000'))},
+        }
+    ),
+}
+
+# PDF reports are rendered off the request path: 'thread' uses an in-process pool of
+# ADSCAN_PDF_WORKERS threads, 'queue' leaves jobs for `manage.py process_pdf_jobs --loop`.
+ADSCAN_PDF_BACKEND = os.getenv('ADSCAN_PDF_BACKEND', 'thread')
+ADSCAN_PDF_WORKERS = int(os.getenv('ADSCAN_PDF_WORKERS', '2'))
+
+# Upload thumbnails (adscan_images/thumbs/) used by the PDF report and history previews.
+ADSCAN_THUMBNAIL_SIZE = 256  # longest side, px
+ADSCAN_THUMBNAIL_FORMAT = 'JPEG'  # or 'WEBP'
+ADSCAN_THUMBNAIL_QUALITY = 85
+
+# Light model runtime: 'keras' (MODEL_PATH_LIGHT), 'tflite' (MODEL_PATH_LIGHT_TFLITE, created with
+# `manage.py export_light_tflite` and checked with `manage.py tflite_parity`) or 'onnx' (see below).
+ADSCAN_LIGHT_RUNTIME = os.getenv('ADSCAN_LIGHT_RUNTIME', 'keras')
+MODEL_PATH_LIGHT_TFLITE = BASE_DIR / 'ad_models' / 'ad_detection_cnn_model.tflite'
+ADSCAN_TFLITE_NUM_THREADS = int(os.getenv('ADSCAN_TFLITE_NUM_THREADS', '0')) or None  # None = TFLite default
+
+# Dark model runtime: 'joblib' (MODEL_PATH_DARK) or 'onnx'. Either setting may also be the dotted
+# path of a custom loader (see users/model_registry.py). ONNX files come from `manage.py export_onnx`
+# and are checked with `manage.py onnx_parity`.
+ADSCAN_DARK_RUNTIME = os.getenv('ADSCAN_DARK_RUNTIME', 'joblib')
+MODEL_PATH_LIGHT_ONNX = BASE_DIR / 'ad_models' / 'ad_detection_cnn_model.onnx'
+MODEL_PATH_DARK_ONNX = BASE_DIR / 'ad_models' / 'deployable_skin_model_features.onnx'
+MODEL_PATH_DARK_CLASSIFIER = BASE_DIR / 'ad_models' / 'deployable_skin_model_classifier.pkl'
+ADSCAN_ONNX_INTRA_OP_THREADS = int(os.getenv('ADSCAN_ONNX_INTRA_OP_THREADS', '0')) or None  # None = onnxruntime default
+ADSCAN_ONNX_INTER_OP_THREADS = int(os.getenv('ADSCAN_ONNX_INTER_OP_THREADS', '0')) or None
+
+# Keras models are called through traced tf.functions with fixed batch buckets instead of
+# Model.predict (see CompiledKerasModel; compare with `manage.py benchmark_inference`).
+# The TFLite light runtime pads to the same buckets.
+ADSCAN_COMPILED_PREDICT = os.getenv('ADSCAN_COMPILED_PREDICT', '1') == '1'
+ADSCAN_BATCH_BUCKETS = (1, 4, 8, 16)  # keep the largest >= ADSCAN_INFERENCE_MAX_BATCH_SIZE
+
+# Preprocessing (users/preprocessing.py): threads used to decode the images of one batch, and
+# JPEG draft decoding (faster, but not bit-identical to the notebook pipeline; off by default).
+ADSCAN_PREPROCESS_WORKERS = int(os.getenv('ADSCAN_PREPROCESS_WORKERS', '4'))
+ADSCAN_PREPROCESS_DRAFT = os.getenv('ADSCAN_PREPROCESS_DRAFT', '0') == '1'
+
+# Per-stage timing (users/timing.py): spans feed the Server-Timing header, one JSON log line
+# per request on the 'users.timing' logger and the Prometheus histograms served at /metrics.
+ADSCAN_TIMING_ENABLED = os.getenv('ADSCAN_TIMING_ENABLED', '1') == '1'
+ADSCAN_SERVER_TIMING_HEADER = os.getenv('ADSCAN_SERVER_TIMING_HEADER', '1') == '1'
+ADSCAN_TIMING_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)  # seconds
+# Access to /metrics: with ADSCAN_METRICS_TOKEN set, scrapers must send 'Authorization: Bearer <token>'.
+# Without a token it is open only when DEBUG is on; otherwise it answers requests from
+# ADSCAN_METRICS_ALLOWED_IPS (REMOTE_ADDR, so behind a proxy set a token instead) and staff sessions.
+ADSCAN_METRICS_TOKEN = os.getenv('ADSCAN_METRICS_TOKEN')
+ADSCAN_METRICS_ALLOWED_IPS = tuple(
+    ip.strip() for ip in os.getenv('ADSCAN_METRICS_ALLOWED_IPS', '127.0.0.1,::1').split(',') if ip.strip())
+
+# Verbose inference traces (users/tracing.py) are logged at INFO on 'users.trace' only for
+# sampled requests or ones sending 'X-AdScan-Debug: 1'; otherwise they cost no formatting.
+ADSCAN_TRACE_SAMPLE_RATE = float(os.getenv('ADSCAN_TRACE_SAMPLE_RATE', '0'))  # e.g. 0.01 = 1% of requests
+ADSCAN_TRACE_ALLOW_HEADER = os.getenv('ADSCAN_TRACE_ALLOW_HEADER', '1' if DEBUG else '0') == '1'
+
+LOGGING = {
+    'version': 1,
+    'disable_existing_loggers': False,
+    'formatters': {
+        'plain': {'format': '%(asctime)s %(levelname)s %(name)s %(message)s'},
+    },
+    'handlers': {
+        'console': {'class': 'logging.StreamHandler', 'formatter': 'plain'},
+    },
+    'loggers': {
+        # ADSCAN_LOG_LEVEL=DEBUG also emits every inference trace (users.trace)
+        'users': {'handlers': ['console'], 'level': os.getenv('ADSCAN_LOG_LEVEL', 'INFO'), 'propagate': False},
+    },
+}
+
+# Scan uploads are streamed into memory by users.uploads.AdScanUploadHandler (size and
+# JPEG/PNG signature checks, SHA-256 on the fly); this caps what one request may buffer.
+ADSCAN_MAX_UPLOAD_REQUEST_BYTES = int(os.getenv('ADSCAN_MAX_UPLOAD_REQUEST_BYTES', str(64 * 1024 * 1024)))
+
+# Decode guards (users/preprocessing.py): images whose decoded size, after any JPEG draft
+# downscale, exceeds ADSCAN_MAX_IMAGE_PIXELS are rejected from the header alone; JPEGs above
+# ADSCAN_PREPROCESS_DRAFT_ABOVE_PIXELS are always draft-decoded; the images one scan request
+# decodes at the same time may hold at most ADSCAN_MAX_REQUEST_DECODE_BYTES (estimated at 4
+# bytes per pixel); further decodes wait for running ones to finish.
+ADSCAN_MAX_IMAGE_PIXELS = int(os.getenv('ADSCAN_MAX_IMAGE_PIXELS', '40000000'))
+ADSCAN_PREPROCESS_DRAFT_ABOVE_PIXELS = int(os.getenv('ADSCAN_PREPROCESS_DRAFT_ABOVE_PIXELS', '16000000'))
+ADSCAN_MAX_REQUEST_DECODE_BYTES = int(os.getenv('ADSCAN_MAX_REQUEST_DECODE_BYTES', str(512 * 1024 * 1024)))
+
+# Test-time augmentation (users/tta.py): 'off', 'auto' (only images whose first-pass probability
+# is within ADSCAN_TTA_BAND of the decision threshold) or 'always'; uploads may pass `tta`.
+ADSCAN_TTA_MODE = os.getenv('ADSCAN_TTA_MODE', 'off')
+ADSCAN_TTA_VIEWS = int(os.getenv('ADSCAN_TTA_VIEWS', '6'))  # views per image, max 8
+ADSCAN_TTA_BAND = float(os.getenv('ADSCAN_TTA_BAND', '0.1'))
+
+# Async scan endpoints (users/async_views.py, serve with uvicorn backend.asgi:application):
+# validation, saving and inference run on ADSCAN_ASYNC_INFERENCE_WORKERS threads with at most
+# ADSCAN_ASYNC_INFERENCE_QUEUE jobs waiting; beyond that they answer 503 + Retry-After.
+ADSCAN_ASYNC_INFERENCE_WORKERS = int(os.getenv('ADSCAN_ASYNC_INFERENCE_WORKERS', str(os.cpu_count() or 2)))
+ADSCAN_ASYNC_INFERENCE_QUEUE = int(os.getenv('ADSCAN_ASYNC_INFERENCE_QUEUE', '32'))
+ADSCAN_ASYNC_RETRY_AFTER = int(os.getenv('ADSCAN_ASYNC_RETRY_AFTER', '5'))  # seconds
+
+# Mail outbox (users/mail_outbox.py): 2FA and password-reset emails are queued as OutboxEmail
+# rows and sent over one persistent SMTP connection by a per-process thread ('thread') or by
+# `manage.py send_outbox` ('queue'). Failures retry with exponential backoff.
+ADSCAN_MAIL_BACKEND = os.getenv('ADSCAN_MAIL_BACKEND', 'thread')
+ADSCAN_MAIL_BATCH_SIZE = int(os.getenv('ADSCAN_MAIL_BATCH_SIZE', '50'))
+ADSCAN_MAIL_MAX_ATTEMPTS = int(os.getenv('ADSCAN_MAIL_MAX_ATTEMPTS', '5'))
+ADSCAN_MAIL_RETRY_BASE_SECONDS = int(os.getenv('ADSCAN_MAIL_RETRY_BASE_SECONDS', '5'))
+ADSCAN_MAIL_RETRY_MAX_SECONDS = int(os.getenv('ADSCAN_MAIL_RETRY_MAX_SECONDS', '900'))
+ADSCAN_MAIL_POLL_SECONDS = float(os.getenv('ADSCAN_MAIL_POLL_SECONDS', '5'))  # retry check while idle
+ADSCAN_MAIL_IDLE_SECONDS = float(os.getenv('ADSCAN_MAIL_IDLE_SECONDS', '60'))  # close the SMTP connection after
+EMAIL_TIMEOUT = int(os.getenv('EMAIL_TIMEOUT', '10'))  # seconds; a hung SMTP server must not stall the sender
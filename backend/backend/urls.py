@@ -19,6 +19,7 @@ from django.urls import path, include
 from django.conf import settings
 from django.conf.urls.static import static
 from users.views import chat_view
+from users.timing import metrics_view
 
 urlpatterns = [
     path('admin/', admin.site.urls),
@@ -26,6 +27,8 @@ urlpatterns = [
     path('api/password_reset/', include('django_rest_passwordreset.urls', namespace='password_reset')),
     # direct mapping for frontend: /api/adscan/chat/
     path("api/adscan/chat/", chat_view, name="adscan-chat"),
+    # Prometheus scrape endpoint (per-stage latency histograms, see users/timing.py)
+    path("metrics", metrics_view, name="metrics"),
     # remove or comment out include("adscan.urls") until you add the adscan app
     # path("api/adscan/", include("adscan.urls")),
 ]
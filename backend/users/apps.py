@@ -1,4 +1,16 @@
+import os
+import sys
+
 from django.apps import AppConfig
+from django.conf import settings
+
+# manage.py commands that serve predictions and so load the models eagerly; every other
+# command (migrate, send_outbox, process_pdf_jobs, export_onnx, ...) leaves them lazy.
+# Value: the environment variable the command's autoreloader sets in the serving child.
+SERVER_COMMANDS = {
+    "runserver": "RUN_MAIN",
+    "runserver_plus": "WERKZEUG_RUN_MAIN",  # django-extensions
+}
 
 class UsersConfig(AppConfig):
     default_auto_field = "django.db.models.BigAutoField"
@@ -6,3 +18,20 @@ class UsersConfig(AppConfig):
 
     def ready(self):
         import users.signals  # Import signals only when apps are ready
+
+        if getattr(settings, "ADSCAN_MODEL_LOADING", "lazy") == "eager" and self._is_server_process():
+            # with the pool/socket inference backends the models live in the inference workers
+            if getattr(settings, "ADSCAN_INFERENCE_BACKEND", "inline") == "inline":
+                from .model_registry import warmup_models
+                warmup_models()
+
+    @staticmethod
+    def _is_server_process():
+        """True for WSGI/ASGI workers and the serving runserver process, False for other manage.py commands."""
+        argv = sys.argv
+        if not argv or not os.path.basename(argv[0]).startswith(("manage", "django-admin")):
+            return True
+        command = argv[1] if len(argv) > 1 else ""
+        if command not in SERVER_COMMANDS:
+            return False
+        return os.environ.get(SERVER_COMMANDS[command]) == "true" or "--noreload" in argv
@@ -0,0 +1,247 @@
+"""
+Async (ASGI) variants of the scan upload, single-image scan and model health endpoints.
+
+Served by `uvicorn backend.asgi:application` (under WSGI they still work, one request per
+thread). The event loop only does the cheap parts:
+
+- the ASGI handler reads the request body from the socket without blocking; the
+  multipart body is then split by AdScanUploadHandler in a worker thread;
+- JWT validation, and the user lookup with the async ORM. Permissions follow the sync
+  views: the upload is AllowAny like AdScanImageUploadView (a request without a token is
+  handled as AnonymousUser; only a bad token is refused), the single-image scan needs a
+  user like AdScanAPIView;
+- recording the predictions with abulk_create, and the health view's DB probe.
+
+Validation, saving, thumbnails and inference (the same code as the sync views) run on
+InferenceGate, a thread pool of ADSCAN_ASYNC_INFERENCE_WORKERS threads that admits at
+most ADSCAN_ASYNC_INFERENCE_QUEUE more waiting jobs. When it is full the view answers 503
+with `Retry-After: ADSCAN_ASYNC_RETRY_AFTER` right away instead of queueing without bound,
+so one worker can hold many in-flight uploads while inference keeps the cores busy.
+"""
+import asyncio
+import contextvars
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.contrib.auth.models import AnonymousUser
+from django.core.exceptions import ObjectDoesNotExist
+from django.db import close_old_connections
+from django.http import JsonResponse
+from django.views.decorators.csrf import csrf_exempt
+from django.views.decorators.http import require_GET, require_POST
+from rest_framework.utils.encoders import JSONEncoder
+from rest_framework_simplejwt.authentication import JWTAuthentication
+from rest_framework_simplejwt.exceptions import InvalidToken, TokenError
+from rest_framework_simplejwt.settings import api_settings as jwt_settings
+
+from .models import Prediction
+from .prediction_records import arecord_predictions
+from .preprocessing import request_decode_budget
+from .serializers import AdScanSerializer
+from .timing import REQUEST_DECODED_BYTES, span
+from .uploads import AdScanUploadHandler
+from .views import _model_health, _process_upload, predict_ad_light
+
+logger = logging.getLogger(__name__)
+
+
+# ============================================================
+# Bounded inference executor
+# ============================================================
+class Overloaded(Exception):
+    """The inference gate has no free slot; answer 503."""
+
+
+class InferenceGate:
+    """
+    ThreadPoolExecutor admitting at most `workers + queue_size` jobs (running or waiting).
+    Jobs run in a copy of the caller's context, so timing spans and the decode budget
+    of the request still apply.
+    """
+
+    def __init__(self, workers, queue_size):
+        self.workers = workers
+        self.capacity = workers + queue_size
+        self.in_flight = 0
+        self.rejected = 0
+        self._lock = threading.Lock()
+        self._executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='adscan-async-inference')
+
+    def submit(self, fn, *args):
+        with self._lock:
+            if self.in_flight >= self.capacity:
+                self.rejected += 1
+                raise Overloaded()
+            self.in_flight += 1
+        try:
+            future = self._executor.submit(contextvars.copy_context().run, _run_job, fn, *args)
+        except Exception:
+            self._release()
+            raise
+        future.add_done_callback(lambda _: self._release())
+        return future
+
+    def _release(self):
+        with self._lock:
+            self.in_flight -= 1
+
+    async def run(self, fn, *args):
+        return await asyncio.wrap_future(self.submit(fn, *args))
+
+    def stats(self):
+        with self._lock:
+            return {"workers": self.workers, "capacity": self.capacity,
+                    "in_flight": self.in_flight, "rejected": self.rejected}
+
+
+def _run_job(fn, *args):
+    try:
+        return fn(*args)
+    finally:
+        close_old_connections()  # executor threads keep their own DB connections
+
+
+_gate = None
+_gate_lock = threading.Lock()
+
+
+def get_inference_gate():
+    global _gate
+    if _gate is None:
+        with _gate_lock:
+            if _gate is None:
+                _gate = InferenceGate(
+                    workers=getattr(settings, 'ADSCAN_ASYNC_INFERENCE_WORKERS', 4),
+                    queue_size=getattr(settings, 'ADSCAN_ASYNC_INFERENCE_QUEUE', 32),
+                )
+    return _gate
+
+
+# ============================================================
+# Helpers
+# ============================================================
+def _json(payload, status=200):
+    # DRF's encoder, like the sync views' Response (numpy scalars, datetimes, ReturnDicts)
+    return JsonResponse(payload, status=status, encoder=JSONEncoder, safe=False)
+
+
+def _overloaded():
+    response = _json({"error": "Inference is at capacity, please retry shortly."}, status=503)
+    response['Retry-After'] = str(getattr(settings, 'ADSCAN_ASYNC_RETRY_AFTER', 5))
+    return response
+
+
+def _unauthorized():
+    return _json({"detail": "Authentication credentials were not provided or are invalid."}, status=401)
+
+
+async def _authenticate(request):
+    """
+    The user of `Authorization: Bearer <access token>` as JWTAuthentication sees it:
+    AnonymousUser without a bearer token, None when the token is invalid or its user is
+    unknown or inactive (DRF answers 401 there, whatever the view's permissions).
+    """
+    auth = JWTAuthentication()
+    header = auth.get_header(request)
+    raw_token = auth.get_raw_token(header) if header else None
+    if raw_token is None:
+        return AnonymousUser()
+    try:
+        token = auth.get_validated_token(raw_token)
+        user = await get_user_model().objects.aget(
+            **{jwt_settings.USER_ID_FIELD: token[jwt_settings.USER_ID_CLAIM]})
+    except (InvalidToken, TokenError, KeyError, ObjectDoesNotExist):
+        return None
+    return user if user.is_active else None
+
+
+def _parse_multipart(request):
+    """Split the (already received) body with the streaming upload handler."""
+    request.upload_handlers = [AdScanUploadHandler(request)]
+    return request.POST, request.FILES
+
+
+def _with_decode_budget(view_name, fn, *args):
+    with request_decode_budget() as budget:
+        result = fn(*args)
+    if budget.peak:
+        REQUEST_DECODED_BYTES.observe(budget.peak, view_name)
+    return result
+
+
+# ============================================================
+# Views
+# ============================================================
+@csrf_exempt
+@require_POST
+async def adscan_upload_async(request):
+    """Async AdScanImageUploadView: same fields (images / image, model_type, tta), permissions and response."""
+    user = await _authenticate(request)
+    if user is None:
+        return _unauthorized()
+    with span("parse"):
+        data, files = await sync_to_async(_parse_multipart, thread_sensitive=False)(request)
+
+    model_type = data.get('model_type', 'light')
+    tta = data.get('tta')
+    images = files.getlist('images') or ([files['image']] if files.get('image') else [])
+    if not images:
+        return _json({"error": "No images uploaded. Use form field 'images' (multiple) or 'image' (single)."},
+                     status=400)
+
+    try:
+        payload, code, scored, latency_ms = await get_inference_gate().run(
+            _with_decode_budget, 'adscan_upload_async', _process_upload, user, images, model_type, tta)
+    except Overloaded:
+        return _overloaded()
+
+    with span("record"):
+        await arecord_predictions(model_type, scored, latency_ms=latency_ms)
+    return _json(payload, status=code)
+
+
+def _score_single(image):
+    serializer = AdScanSerializer(data={'image': image})
+    if not serializer.is_valid():
+        return serializer.errors, 400
+    try:
+        return predict_ad_light(serializer.validated_data['image']), 200
+    except Exception as e:
+        return {'error': str(e)}, 500
+
+
+@csrf_exempt
+@require_POST
+async def adscan_single_async(request):
+    """Async AdScanAPIView: light model on the `image` field."""
+    user = await _authenticate(request)
+    if user is None or not user.is_authenticated:
+        return _unauthorized()
+    with span("parse"):
+        _, files = await sync_to_async(_parse_multipart, thread_sensitive=False)(request)
+    try:
+        payload, code = await get_inference_gate().run(
+            _with_decode_budget, 'adscan_single_async', _score_single, files.get('image'))
+    except Overloaded:
+        return _overloaded()
+    return _json(payload, status=code)
+
+
+@require_GET
+async def model_health_async(request):
+    """Async model_health_check, plus the gate's load and the latest recorded prediction."""
+    gate = get_inference_gate()
+    try:
+        payload = await gate.run(_model_health)
+    except Overloaded:
+        return _overloaded()
+    except Exception as e:
+        return _json({"error": str(e)}, status=500)
+    payload["inference_gate"] = gate.stats()
+    payload["last_prediction_at"] = await (
+        Prediction.objects.order_by('-created_at').values_list('created_at', flat=True).afirst())
+    return _json(payload)
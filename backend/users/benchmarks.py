@@ -0,0 +1,218 @@
+"""
+Latency / throughput benchmark harness for the model paths (`manage.py run_benchmarks`).
+
+Every case feeds freshly generated synthetic uploads (JPEG/PNG at several resolutions) to
+one path at one batch size and records p50/p95/p99 latency, images/sec and memory:
+`python_peak_mb` is the tracemalloc peak of one extra, untimed run (Python and numpy
+allocations), `rss_high_water_mb` the process RSS high-water mark after the case (it
+includes native TensorFlow/ONNX memory but only ever grows, so read it in case order).
+The report is plain JSON so runs from different releases can be diffed with
+compare_reports(); the prediction cache should be disabled while measuring. A case that
+raises (e.g. the upload endpoint answering 400/500) is recorded with its `error` and
+`status` and counted in the report's `errors`; the remaining cases still run.
+"""
+import io
+import platform
+import resource
+import sys
+import time
+import tracemalloc
+
+import numpy as np
+from django.conf import settings
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.db import transaction
+from django.utils import timezone
+from PIL import Image
+
+from . import prediction_cache
+
+DEFAULT_RESOLUTIONS = ((224, 224), (1024, 768), (4032, 3024))
+DEFAULT_FORMATS = ('JPEG', 'PNG')
+DEFAULT_BATCH_SIZES = (1, 2, 4, 8, 16, 32)
+CONTENT_TYPES = {'JPEG': 'image/jpeg', 'PNG': 'image/png'}
+REPORTED_SETTINGS = (
+    'ADSCAN_INFERENCE_BACKEND', 'ADSCAN_LIGHT_RUNTIME', 'ADSCAN_DARK_RUNTIME', 'ADSCAN_COMPILED_PREDICT',
+    'ADSCAN_PREPROCESS_WORKERS', 'ADSCAN_PREPROCESS_DRAFT', 'ADSCAN_PREDICTION_CACHE_ENABLED',
+)
+
+
+# ============================================================
+# Synthetic inputs
+# ============================================================
+def synthetic_image(size, fmt='JPEG', seed=0):
+    """Encoded bytes of a skin-toned gradient with noise, so encoded sizes are realistic."""
+    width, height = size
+    rng = np.random.default_rng(seed)
+    y, x = np.mgrid[0:height, 0:width].astype('float32')
+    base = np.array([200.0, 150.0, 120.0], dtype='float32') * (0.7 + 0.3 * (x / max(width - 1, 1)))[..., None]
+    base += 20 * np.sin(y / 37.0)[..., None]
+    pixels = np.clip(base + rng.normal(0, 12, size=(height, width, 3)), 0, 255).astype(np.uint8)
+    buf = io.BytesIO()
+    Image.fromarray(pixels, 'RGB').save(buf, fmt, **({'quality': 90} if fmt == 'JPEG' else {}))
+    return buf.getvalue()
+
+
+def synthetic_uploads(data, fmt, count):
+    """`count` fresh upload objects holding the same encoded image."""
+    ext = 'jpg' if fmt == 'JPEG' else fmt.lower()
+    return [SimpleUploadedFile(f"bench_{i}.{ext}", data, content_type=CONTENT_TYPES[fmt]) for i in range(count)]
+
+
+# ============================================================
+# Model paths
+# ============================================================
+class UploadFailed(RuntimeError):
+    """The upload endpoint answered something other than 201."""
+
+    def __init__(self, status_code, data):
+        super().__init__(f"upload returned {status_code}: {data}")
+        self.status_code = status_code
+
+
+def _upload_endpoint(model_type):
+    """POST the batch to AdScanImageUploadView in-process (needs a saved user, see run_benchmarks)."""
+    from django.contrib.auth.models import User
+    from rest_framework.test import APIRequestFactory, force_authenticate
+    from .views import AdScanImageUploadView
+
+    factory = APIRequestFactory()
+    view = AdScanImageUploadView.as_view()
+    user = []
+
+    def run(files):
+        if not user:
+            user.append(User.objects.get(username='adscan-benchmark'))
+        request = factory.post('/api/adscan/upload/', {'images': files, 'model_type': model_type}, format='multipart')
+        force_authenticate(request, user=user[0])
+        with transaction.atomic():  # savepoint: a failed upload must not break the caller's transaction
+            response = view(request)
+        if response.status_code != 201:
+            raise UploadFailed(response.status_code, response.data)
+        return response
+
+    return run
+
+
+def model_paths():
+    """name -> callable(list of uploads). Imported lazily: views pulls in the whole app."""
+    from . import views
+    from .preprocessing import preprocess_batch
+
+    return {
+        'preprocess': lambda files: preprocess_batch(files),
+        'light': views.predict_ad_light_batch,
+        'light_single': lambda files: [views.predict_ad_light(f) for f in files],
+        'dark': views.predict_ad_dark_batch,
+        'dark_fixed': lambda files: [views.predict_ad_dark_fixed(f) for f in files],
+        'both': views.predict_ad_both_batch,
+        'upload': _upload_endpoint('light'),
+        'upload_dark': _upload_endpoint('dark'),
+    }
+
+
+# ============================================================
+# Measurement
+# ============================================================
+def rss_high_water_mb():
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak / (1024 * 1024) if sys.platform == 'darwin' else peak / 1024  # bytes on macOS, KiB on Linux
+
+
+def summarize(samples, batch_size):
+    ms = np.asarray(samples, dtype='float64') * 1000
+    p50 = float(np.percentile(ms, 50))
+    return {
+        'p50_ms': p50,
+        'p95_ms': float(np.percentile(ms, 95)),
+        'p99_ms': float(np.percentile(ms, 99)),
+        'mean_ms': float(ms.mean()),
+        'per_image_p50_ms': p50 / batch_size,
+        'images_per_sec': batch_size / (p50 / 1000) if p50 else None,
+    }
+
+
+def measure(run, make_inputs, batch_size, iterations=20, warmup=2):
+    """Time `run(make_inputs())`; input construction is not timed."""
+    for _ in range(warmup):
+        run(make_inputs())
+    samples = []
+    for _ in range(iterations):
+        inputs = make_inputs()
+        started = time.perf_counter()
+        run(inputs)
+        samples.append(time.perf_counter() - started)
+
+    inputs = make_inputs()
+    tracemalloc.start()
+    try:
+        run(inputs)
+        _, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+
+    stats = summarize(samples, batch_size)
+    stats.update(iterations=iterations, python_peak_mb=peak / 1e6, rss_high_water_mb=rss_high_water_mb())
+    return stats
+
+
+def run_suite(paths, resolutions=DEFAULT_RESOLUTIONS, formats=DEFAULT_FORMATS, batch_sizes=DEFAULT_BATCH_SIZES,
+              iterations=20, warmup=2, progress=None):
+    """Run every path x format x resolution x batch size case; returns the JSON-ready report."""
+    available = model_paths()
+    unknown = [p for p in paths if p not in available]
+    if unknown:
+        raise ValueError(f"Unknown benchmark path(s): {', '.join(unknown)} (available: {', '.join(available)})")
+
+    max_upload = getattr(settings, 'ADSCAN_MAX_UPLOAD_BYTES', 5 * 1024 * 1024)
+    results = []
+    for name in paths:
+        for fmt in formats:
+            for size in resolutions:
+                data = synthetic_image(size, fmt)
+                for batch_size in batch_sizes:
+                    case = {'path': name, 'format': fmt, 'resolution': f"{size[0]}x{size[1]}",
+                            'encoded_kb': round(len(data) / 1024, 1), 'batch_size': batch_size}
+                    if name.startswith('upload') and len(data) > max_upload:
+                        case['skipped'] = "larger than ADSCAN_MAX_UPLOAD_BYTES"  # the endpoint rejects it
+                    else:
+                        try:
+                            case.update(measure(available[name], lambda: synthetic_uploads(data, fmt, batch_size),
+                                                batch_size, iterations=iterations, warmup=warmup))
+                        except Exception as e:
+                            case['error'] = f"{type(e).__name__}: {e}"
+                            case['status'] = getattr(e, 'status_code', None)
+                    results.append(case)
+                    if progress:
+                        progress(case)
+
+    return {
+        'meta': {
+            'created_at': timezone.now().isoformat(),
+            'python': platform.python_version(),
+            'platform': platform.platform(),
+            'numpy': np.__version__,
+            'settings': {name: getattr(settings, name, None) for name in REPORTED_SETTINGS},
+            'prediction_cache': prediction_cache.is_enabled(),  # False under run_benchmarks' bypass
+        },
+        'results': results,
+        'errors': sum(1 for case in results if 'error' in case),
+    }
+
+
+def _case_key(case):
+    return case['path'], case['format'], case['resolution'], case['batch_size']
+
+
+def compare_reports(current, baseline, max_regression=0.2):
+    """Cases whose p50 grew by more than `max_regression` (a fraction) against `baseline`."""
+    previous = {_case_key(c): c for c in baseline.get('results', [])}
+    regressions = []
+    for case in current.get('results', []):
+        before = previous.get(_case_key(case))
+        if not before or not before.get('p50_ms') or 'p50_ms' not in case:
+            continue
+        if case['p50_ms'] > before['p50_ms'] * (1 + max_regression):
+            regressions.append({'case': _case_key(case), 'baseline_p50_ms': before['p50_ms'],
+                                'p50_ms': case['p50_ms'], 'ratio': case['p50_ms'] / before['p50_ms']})
+    return regressions
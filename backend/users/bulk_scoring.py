@@ -0,0 +1,331 @@
+"""
+Offline bulk scoring (used by `manage.py score_images`).
+
+Items come from a directory tree or from the AdScanImage table, in a stable order (path or
+id), so a run can resume after the last checkpointed key. A loader thread reads and
+decodes batches with preprocessing.preprocess_batch (itself spread over the preprocessing
+thread pool) and keeps up to `prefetch` batches queued, so decoding overlaps with the
+forward passes that run on the calling thread through inference_service.run_batch.
+Rows go to a writer (CSV, a Parquet dataset or Prediction rows via bulk_create); every
+flush is followed by a checkpoint, so an interrupted run repeats at most one flush.
+"""
+import csv
+import importlib.util
+import io
+import json
+import os
+import queue
+import threading
+import time
+
+from django.conf import settings
+from django.db.models import Exists, OuterRef, Q
+
+from .inference_service import run_batch
+from .model_registry import DARK_AD_THRESHOLD, LIGHT_AD_THRESHOLD, IMAGE_EXTENSIONS, model_version
+from .models import AdScanImage, Prediction
+from .preprocessing import preprocess_batch
+
+ROW_FIELDS = ('key', 'model_type', 'model_version', 'probability', 'threshold', 'label', 'is_ad', 'error')
+
+
+# ============================================================
+# Sources: (key, loader) pairs in key order
+# ============================================================
+def iter_directory(folder, after=None, recursive=True):
+    """Image files under `folder` as (relative path, path), sorted; keys > `after` only."""
+    paths = []
+    for root, dirs, files in os.walk(folder):
+        dirs.sort()
+        for name in files:
+            if name.lower().endswith(IMAGE_EXTENSIONS):
+                paths.append(os.path.relpath(os.path.join(root, name), folder))
+        if not recursive:
+            break
+    for rel in sorted(paths):
+        if after is None or rel > after:
+            yield rel, os.path.join(folder, rel)
+
+
+def iter_adscan_images(after=None, chunk_size=500, queryset=None):
+    """AdScanImage rows as (id, image field file), by id; ids > `after` only."""
+    qs = (queryset if queryset is not None else AdScanImage.objects.all()).order_by('id').only('id', 'image')
+    last_id = int(after or 0)
+    while True:
+        chunk = list(qs.filter(id__gt=last_id)[:chunk_size])
+        if not chunk:
+            return
+        for ad_image in chunk:
+            yield ad_image.id, ad_image.image
+        last_id = chunk[-1].id
+
+
+def stale_images(queryset, model_type):
+    """
+    Narrow an AdScanImage queryset to images without a Prediction from the current version
+    of the model(s), e.g. to re-score only what a retrain or a failed upload left behind.
+    """
+    missing = Q()
+    for model in (('light', 'dark') if model_type == 'both' else (model_type,)):
+        current = Prediction.objects.filter(image=OuterRef('pk'), model_type=model,
+                                            model_version=model_version(model))
+        missing |= ~Exists(current)
+    return queryset.filter(missing)
+
+
+def _read(source):
+    """Load one item's bytes on the loader thread (paths are decoded straight from disk)."""
+    if isinstance(source, (str, os.PathLike)):
+        return source
+    with source.open('rb') as fh:
+        return io.BytesIO(fh.read())
+
+
+# ============================================================
+# Prefetching decode pipeline
+# ============================================================
+_DONE = object()
+
+
+def prefetch_batches(items, batch_size, prefetch=2, workers=None):
+    """
+    Yield (all_keys, keys, batch, failures) per `batch_size` items, decoded on a background
+    thread that stays up to `prefetch` batches ahead: `batch` holds the decoded images of
+    `keys` in order and `failures` maps every other key to its exception. `workers` is passed
+    on to preprocess_batch.
+    """
+    batches = queue.Queue(maxsize=max(prefetch, 1))
+    stop = threading.Event()
+
+    def put(item):
+        while not stop.is_set():
+            try:
+                batches.put(item, timeout=0.5)
+                return True
+            except queue.Full:
+                continue
+        return False
+
+    def load():
+        try:
+            chunk = []
+            for item in items:
+                chunk.append(item)
+                if len(chunk) == batch_size:
+                    if not put(_decode(chunk, workers)):
+                        return
+                    chunk = []
+            if chunk:
+                put(_decode(chunk, workers))
+        except Exception as e:
+            put(e)
+        finally:
+            put(_DONE)
+
+    loader = threading.Thread(target=load, name="score-images-loader", daemon=True)
+    loader.start()
+    try:
+        while True:
+            item = batches.get()
+            if item is _DONE:
+                return
+            if isinstance(item, Exception):
+                raise item
+            yield item
+    finally:
+        stop.set()
+        loader.join(timeout=5)
+
+
+def _decode(chunk, workers=None):
+    files, failures = [], {}
+    for key, source in chunk:
+        try:
+            files.append((key, _read(source)))
+        except Exception as e:
+            failures[key] = e
+    batch, decode_failures = preprocess_batch([f for _, f in files], workers=workers)
+    for index, error in decode_failures.items():
+        failures[files[index][0]] = error
+    keys = [key for i, (key, _) in enumerate(files) if i not in decode_failures]
+    return [key for key, _ in chunk], keys, batch, failures
+
+
+# ============================================================
+# Rows
+# ============================================================
+def _row(key, model_type, version, probability, threshold, is_ad):
+    return {'key': key, 'model_type': model_type, 'model_version': version,
+            'probability': probability, 'threshold': threshold,
+            'label': 'ad' if is_ad else 'not_ad', 'is_ad': is_ad, 'error': ''}
+
+
+def rows_for(model_type, key, raw, versions):
+    """One row per model for a raw score_batch output ('both' gives a light and a dark row)."""
+    if model_type == 'both':
+        return (rows_for('light', key, raw['light'], versions)
+                + rows_for('dark', key, raw['dark'], versions))
+    if model_type == 'dark':
+        prob = float(raw['probability'])
+        return [_row(key, 'dark', versions['dark'], prob, DARK_AD_THRESHOLD, prob >= DARK_AD_THRESHOLD)]
+    prob = float(raw)
+    return [_row(key, 'light', versions['light'], prob, LIGHT_AD_THRESHOLD, prob < LIGHT_AD_THRESHOLD)]
+
+
+def error_row(key, model_type, error):
+    row = dict.fromkeys(ROW_FIELDS)
+    row.update(key=key, model_type=model_type, error=f"{type(error).__name__}: {error}")
+    return row
+
+
+# ============================================================
+# Writers
+# ============================================================
+class CsvWriter:
+    """Appends to one CSV file (the header is written only for a new file)."""
+
+    def __init__(self, path):
+        new = not os.path.exists(path) or os.path.getsize(path) == 0
+        self._fh = open(path, 'a', newline='')
+        self._writer = csv.DictWriter(self._fh, fieldnames=ROW_FIELDS)
+        if new:
+            self._writer.writeheader()
+
+    def write(self, rows):
+        self._writer.writerows(rows)
+
+    def flush(self):
+        self._fh.flush()
+        os.fsync(self._fh.fileno())
+
+    def close(self):
+        self._fh.close()
+
+
+class ParquetWriter:
+    """Writes a Parquet dataset: one part-NNNNN.parquet file per flush in the `path` directory."""
+
+    def __init__(self, path):
+        if importlib.util.find_spec('pyarrow') is None:
+            raise RuntimeError("Parquet output needs pyarrow (pip install pyarrow)")
+        os.makedirs(path, exist_ok=True)
+        self.path = path
+        self._rows = []
+        self._part = len([n for n in os.listdir(path) if n.startswith('part-') and n.endswith('.parquet')])
+
+    def write(self, rows):
+        self._rows.extend(rows)
+
+    def flush(self):
+        if not self._rows:
+            return
+        import pyarrow as pa
+        import pyarrow.parquet as pq
+        table = pa.Table.from_pylist(self._rows)
+        pq.write_table(table, os.path.join(self.path, f"part-{self._part:05d}.parquet"))
+        self._part += 1
+        self._rows = []
+
+    def close(self):
+        self.flush()
+
+
+class PredictionWriter:
+    """Prediction rows (source 'batch') via bulk_create; keys must be AdScanImage ids."""
+
+    def __init__(self, batch_size=500):
+        self.batch_size = batch_size
+        self._rows = []
+
+    def write(self, rows):
+        self._rows.extend(
+            Prediction(image_id=row['key'], model_type=row['model_type'], model_version=row['model_version'],
+                       probability=row['probability'], threshold=row['threshold'], label=row['label'],
+                       is_ad=row['is_ad'], source='batch')
+            for row in rows if not row['error']
+        )
+
+    def flush(self):
+        if self._rows:
+            Prediction.objects.bulk_create(self._rows, batch_size=self.batch_size)
+            self._rows = []
+
+    def close(self):
+        self.flush()
+
+
+# ============================================================
+# Checkpoints
+# ============================================================
+def load_checkpoint(path):
+    if not path or not os.path.exists(path):
+        return {}
+    with open(path) as fh:
+        return json.load(fh)
+
+
+def save_checkpoint(path, state):
+    if not path:
+        return
+    tmp = f"{path}.tmp"
+    with open(tmp, 'w') as fh:
+        json.dump(state, fh, indent=2)
+    os.replace(tmp, path)  # atomic, so a crash never leaves half a checkpoint
+
+
+# ============================================================
+# Driver
+# ============================================================
+def score_items(items, model_type, writer, batch_size=32, prefetch=2, flush_every=10,
+                checkpoint_path=None, state=None, progress=None, workers=None):
+    """
+    Score `items` ((key, source) pairs in key order) and write rows to `writer`. `state` is the
+    checkpoint dict (resumed counters, last_key); it is updated and saved after each flush.
+    `workers` sets the decode threads (default ADSCAN_PREPROCESS_WORKERS).
+    Returns the final state with a throughput summary.
+    """
+    state = dict(state or {})
+    state.setdefault('model_type', model_type)
+    for counter in ('images', 'failed', 'seconds'):
+        state.setdefault(counter, 0)
+    versions = {m: model_version(m) for m in ('light', 'dark')}
+    started = time.perf_counter()
+    elapsed_before = state['seconds']
+    pending = 0
+
+    def checkpoint():
+        writer.flush()
+        state['seconds'] = elapsed_before + time.perf_counter() - started
+        save_checkpoint(checkpoint_path, state)
+
+    for all_keys, keys, batch, failures in prefetch_batches(items, batch_size, prefetch, workers):
+        rows = [error_row(key, model_type, error) for key, error in failures.items()]
+        if keys:
+            try:
+                outputs = run_batch(model_type, batch)
+            except Exception as e:
+                rows += [error_row(key, model_type, e) for key in keys]
+                failures.update(dict.fromkeys(keys, e))
+            else:
+                for key, raw in zip(keys, outputs):
+                    rows += rows_for(model_type, key, raw, versions)
+        writer.write(rows)
+        state['images'] += len(all_keys) - len(failures)
+        state['failed'] += len(failures)
+        state['last_key'] = all_keys[-1]
+        pending += 1
+        if pending >= flush_every:
+            checkpoint()
+            pending = 0
+        if progress:
+            progress(state, time.perf_counter() - started)
+
+    checkpoint()
+    writer.close()
+    total = state['images'] + state['failed']
+    state['images_per_sec'] = total / state['seconds'] if state['seconds'] else None
+    return state
+
+
+def default_batch_size():
+    return getattr(settings, 'ADSCAN_INFERENCE_MAX_BATCH_SIZE', 16)
@@ -0,0 +1,287 @@
+"""
+Inference service layer for the AD detection models.
+
+Every prediction goes through `run_batch(model_type, batch)`, which scores a
+preprocessed (N, 224, 224, 3) float32 batch. The backend comes from
+settings.ADSCAN_INFERENCE_BACKEND:
+
+- 'inline' (default): run the forward pass in the calling request thread.
+- 'pool':   a per-process InferenceService. Requests go into a queue, a dispatcher
+            thread coalesces concurrent requests into micro-batches (at most
+            ADSCAN_INFERENCE_MAX_BATCH_SIZE images, after up to ADSCAN_INFERENCE_MAX_WAIT_MS
+            of waiting), and a process pool that owns the models runs the forward passes.
+            The dispatcher only hands a batch to the pool when a worker is free, so
+            requests arriving while every worker is busy wait in the queue and are
+            coalesced into the next batch. Larger requests are split at the cap.
+            Every web worker process starts its own pool with its own copy of the
+            models, so use it with a single web worker (or for local experiments).
+- 'socket': send batches over a local unix socket to one shared InferenceService
+            started with `manage.py run_inference_server`. This is the only mode in
+            which several gunicorn/uvicorn workers share one copy of the models.
+"""
+import logging
+import queue
+import threading
+import time
+from concurrent.futures import Future, ProcessPoolExecutor
+from multiprocessing import get_context
+from multiprocessing.connection import Client, Listener
+
+import numpy as np
+from django.conf import settings
+
+from .model_registry import get_ad_model_dark, get_ad_model_light, predict_both
+
+logger = logging.getLogger(__name__)
+
+MODEL_TYPES = ('light', 'dark', 'both')
+
+
+def score_batch(model_type, batch):
+    """
+    One forward pass on a preprocessed batch with the locally loaded model.
+    Light returns one raw sigmoid probability per image; dark returns one
+    predict_single_image-style dict per image (see model_registry.predict_arrays);
+    both returns {"light", "dark", "shared_backbone"} per image (model_registry.predict_both).
+    """
+    if model_type == 'both':
+        return predict_both(batch)
+    if model_type == 'dark':
+        return get_ad_model_dark().predict_arrays(batch, use_hybrid=True)
+    preds = get_ad_model_light().predict(batch, verbose=0)
+    return [float(p[0]) for p in preds]
+
+
+def _init_worker():
+    """Process-pool initializer: set up Django in the spawned worker and load both models."""
+    import django
+    django.setup()
+    get_ad_model_light()
+    get_ad_model_dark()
+
+
+class InferenceService:
+    """Request queue + micro-batching dispatcher in front of a model-owning process pool."""
+
+    def __init__(self, workers=1, max_batch_size=16, max_wait_ms=10, queue_size=256):
+        self.max_batch_size = max_batch_size
+        self.max_wait = max_wait_ms / 1000.0
+        self._queue = queue.Queue(maxsize=queue_size)
+        self._slots = threading.BoundedSemaphore(workers)  # one per pool worker; released when a job ends
+        # spawn, not fork: TensorFlow must never be initialised in the parent before forking
+        self._pool = ProcessPoolExecutor(max_workers=workers, mp_context=get_context('spawn'),
+                                         initializer=_init_worker)
+        self._dispatcher = threading.Thread(target=self._dispatch_loop, name="inference-dispatcher", daemon=True)
+        self._dispatcher.start()
+
+    def submit(self, model_type, batch):
+        """Queue a batch for scoring; returns a Future resolving to its per-image outputs."""
+        if model_type not in MODEL_TYPES:
+            raise ValueError(f"Unknown model type: {model_type}")
+        batch = np.asarray(batch, dtype='float32')
+        if len(batch) <= self.max_batch_size:
+            future = Future()
+            self._queue.put((model_type, batch, future))
+            return future
+        # split at the cap so no micro-batch grows past max_batch_size
+        parts = [self.submit(model_type, batch[start:start + self.max_batch_size])
+                 for start in range(0, len(batch), self.max_batch_size)]
+        return _joined(parts)
+
+    def shutdown(self):
+        self._queue.put(None)
+        self._dispatcher.join()
+        self._pool.shutdown()
+
+    def _dispatch_loop(self):
+        carry = None  # request that did not fit the previous batch; it starts the next one
+        while True:
+            item = carry if carry is not None else self._queue.get()
+            carry = None
+            if item is None:
+                return
+            # wait for a free worker; requests keep queueing meanwhile and join this batch
+            self._slots.acquire()
+            self._slots.release()
+            pending = {}
+            count = self._add(pending, item)
+            deadline = time.monotonic() + self.max_wait
+            while count < self.max_batch_size:
+                try:
+                    # timeout 0 still takes what is already queued
+                    item = self._queue.get(timeout=max(deadline - time.monotonic(), 0))
+                except queue.Empty:
+                    break
+                if item is None:
+                    self._queue.put(None)  # finish this round, stop on the next one
+                    break
+                if count + len(item[1]) > self.max_batch_size:
+                    carry = item
+                    break
+                count += self._add(pending, item)
+            for model_type, requests in pending.items():
+                self._slots.acquire()
+                self._run(model_type, requests)
+
+    @staticmethod
+    def _add(pending, item):
+        model_type, batch, future = item
+        pending.setdefault(model_type, []).append((batch, future))
+        return len(batch)
+
+    def _run(self, model_type, requests):
+        """Submit one micro-batch to the pool; the caller holds a worker slot, released when it ends."""
+        batch = np.concatenate([b for b, _ in requests], axis=0)
+        sizes = [len(b) for b, _ in requests]
+        try:
+            pool_future = self._pool.submit(score_batch, model_type, batch)
+        except Exception as e:
+            self._slots.release()
+            for _, future in requests:
+                future.set_exception(e)
+            return
+
+        def _fan_out(done):
+            self._slots.release()
+            error = done.exception()
+            if error is not None:
+                for _, future in requests:
+                    future.set_exception(error)
+                return
+            outputs = done.result()
+            start = 0
+            for size, (_, future) in zip(sizes, requests):
+                future.set_result(outputs[start:start + size])
+                start += size
+
+        pool_future.add_done_callback(_fan_out)
+
+
+def _joined(parts):
+    """One Future resolving to the concatenated outputs of `parts`, in order (or the first error)."""
+    joined = Future()
+    remaining = [len(parts)]
+    lock = threading.Lock()
+
+    def _done(_):
+        with lock:
+            remaining[0] -= 1
+            if remaining[0]:
+                return
+        errors = [part.exception() for part in parts if part.exception() is not None]
+        if errors:
+            joined.set_exception(errors[0])
+        else:
+            joined.set_result([output for part in parts for output in part.result()])
+
+    for part in parts:
+        part.add_done_callback(_done)
+    return joined
+
+
+# ============================================================
+# Local socket transport (one shared service per box)
+# ============================================================
+def _socket_authkey():
+    return settings.SECRET_KEY.encode()
+
+
+def serve_forever(service, address):
+    """Accept local clients and feed their batches into `service` (used by run_inference_server)."""
+    listener = Listener(address, family='AF_UNIX', authkey=_socket_authkey())
+    logger.info("Inference server listening on %s", address)
+    try:
+        while True:
+            conn = listener.accept()
+            threading.Thread(target=_serve_connection, args=(service, conn), daemon=True).start()
+    finally:
+        listener.close()
+
+
+def _serve_connection(service, conn):
+    with conn:
+        while True:
+            try:
+                model_type, batch = conn.recv()
+            except (EOFError, OSError):
+                return
+            try:
+                conn.send((True, service.submit(model_type, batch).result()))
+            except Exception as e:
+                conn.send((False, f"{type(e).__name__}: {e}"))
+
+
+class InferenceClient:
+    """Blocking client for the local inference server; one connection per thread."""
+
+    def __init__(self, address):
+        self.address = address
+        self._local = threading.local()
+
+    def _connection(self):
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = Client(self.address, family='AF_UNIX', authkey=_socket_authkey())
+            self._local.conn = conn
+        return conn
+
+    def score(self, model_type, batch):
+        conn = self._connection()
+        try:
+            conn.send((model_type, np.asarray(batch, dtype='float32')))
+            ok, payload = conn.recv()
+        except (EOFError, OSError):
+            self._local.conn = None
+            raise
+        if not ok:
+            raise RuntimeError(f"Inference server error: {payload}")
+        return payload
+
+
+# ============================================================
+# Entry point used by the predict functions
+# ============================================================
+_service = None
+_client = None
+_service_lock = threading.Lock()
+
+
+def get_inference_backend():
+    return getattr(settings, 'ADSCAN_INFERENCE_BACKEND', 'inline')
+
+
+def build_service():
+    return InferenceService(
+        workers=getattr(settings, 'ADSCAN_INFERENCE_WORKERS', 1),
+        max_batch_size=getattr(settings, 'ADSCAN_INFERENCE_MAX_BATCH_SIZE', 16),
+        max_wait_ms=getattr(settings, 'ADSCAN_INFERENCE_MAX_WAIT_MS', 10),
+        queue_size=getattr(settings, 'ADSCAN_INFERENCE_QUEUE_SIZE', 256),
+    )
+
+
+def get_inference_service():
+    global _service
+    if _service is None:
+        with _service_lock:
+            if _service is None:
+                _service = build_service()
+    return _service
+
+
+def get_inference_client():
+    global _client
+    if _client is None:
+        with _service_lock:
+            if _client is None:
+                _client = InferenceClient(str(settings.ADSCAN_INFERENCE_SOCKET))
+    return _client
+
+
+def run_batch(model_type, batch):
+    """Score a preprocessed batch with the configured backend; returns per-image outputs."""
+    backend = get_inference_backend()
+    if backend == 'pool':
+        return get_inference_service().submit(model_type, batch).result()
+    if backend == 'socket':
+        return get_inference_client().score(model_type, batch)
+    return score_batch(model_type, batch)
@@ -0,0 +1,201 @@
+"""
+Outbox for transactional email (2FA codes, password resets).
+
+Views call enqueue_email(), which stores an OutboxEmail row and returns without talking to
+SMTP. Delivery depends on settings.ADSCAN_MAIL_BACKEND:
+
+- 'thread' (default): one sender thread per process, woken when the enqueueing
+                      transaction commits (and every ADSCAN_MAIL_POLL_SECONDS for retries).
+- 'queue':            rows wait until `manage.py send_outbox` drains them (from cron, or as a
+                      long-running worker with --loop).
+
+Either way the sender claims due rows in batches of ADSCAN_MAIL_BATCH_SIZE and sends them
+over one SMTP connection that stays open between batches (closed after
+ADSCAN_MAIL_IDLE_SECONDS without mail, reopened when the server drops it). A failed message
+is retried after ADSCAN_MAIL_RETRY_BASE_SECONDS * 2 ** (attempts - 1), up to
+ADSCAN_MAIL_MAX_ATTEMPTS tries; 5xx replies fail it at once. Per-message SMTP time and
+enqueue-to-outcome latency are exported on /metrics (see users/timing.py).
+"""
+import logging
+import smtplib
+import threading
+import time
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.mail import EmailMessage, get_connection
+from django.db import close_old_connections, transaction
+from django.db.models import F
+from django.utils import timezone
+
+from .models import OutboxEmail
+from .timing import MAIL_DELIVERY_SECONDS, MAIL_SEND_SECONDS
+
+logger = logging.getLogger(__name__)
+
+
+def get_mail_backend():
+    return getattr(settings, 'ADSCAN_MAIL_BACKEND', 'thread')
+
+
+def enqueue_email(subject, body, to, from_email=''):
+    """Queue one email; returns the OutboxEmail. The sender is woken once the transaction commits."""
+    email = OutboxEmail.objects.create(subject=subject, body=body, to=list(to), from_email=from_email or '')
+    if get_mail_backend() == 'thread':
+        transaction.on_commit(get_sender().wake)
+    return email
+
+
+# ============================================================
+# Delivery
+# ============================================================
+def retry_delay(attempts):
+    base = getattr(settings, 'ADSCAN_MAIL_RETRY_BASE_SECONDS', 5)
+    return min(base * 2 ** max(attempts - 1, 0), getattr(settings, 'ADSCAN_MAIL_RETRY_MAX_SECONDS', 900))
+
+
+def is_permanent(error):
+    """5xx replies and refused addresses will not succeed on a retry."""
+    if isinstance(error, (smtplib.SMTPRecipientsRefused, smtplib.SMTPSenderRefused)):
+        return True
+    return isinstance(error, smtplib.SMTPResponseException) and error.smtp_code >= 500
+
+
+def _message(email, connection):
+    return EmailMessage(email.subject, email.body, email.from_email or None, email.to, connection=connection)
+
+
+def deliver(emails, connection):
+    """
+    Send `emails` over `connection`, reopening it once per message if the server dropped it.
+    Returns [(email, exception or None)] in order; does not touch the database.
+    """
+    outcomes = []
+    for email in emails:
+        error = None
+        for attempt in range(2):
+            started = time.perf_counter()
+            try:
+                connection.open()  # no-op while the connection is up
+                connection.send_messages([_message(email, connection)])
+                error = None
+            except (smtplib.SMTPServerDisconnected, ConnectionError) as e:
+                error = e
+                connection.close()
+                if attempt == 0:
+                    continue
+            except Exception as e:
+                error = e
+            MAIL_SEND_SECONDS.observe(time.perf_counter() - started, 'error' if error else 'ok')
+            break
+        outcomes.append((email, error))
+    return outcomes
+
+
+def claim_batch(limit):
+    """Mark up to `limit` due pending emails 'sending' and return them."""
+    now = timezone.now()
+    with transaction.atomic():
+        emails = list(OutboxEmail.objects.select_for_update(skip_locked=True)
+                      .filter(status='pending', next_attempt_at__lte=now).order_by('id')[:limit])
+        OutboxEmail.objects.filter(id__in=[e.id for e in emails]).update(
+            status='sending', claimed_at=now, attempts=F('attempts') + 1)
+    for email in emails:
+        email.attempts += 1
+    return emails
+
+
+def record_outcomes(outcomes):
+    """Store delivery results: sent, back to pending with a delay, or failed for good."""
+    now = timezone.now()
+    max_attempts = getattr(settings, 'ADSCAN_MAIL_MAX_ATTEMPTS', 5)
+    sent_ids = [email.id for email, error in outcomes if error is None]
+    OutboxEmail.objects.filter(id__in=sent_ids).update(status='sent', sent_at=now, error='')
+    counts = {'sent': len(sent_ids), 'retry': 0, 'failed': 0}
+    for email, error in outcomes:
+        if error is None:
+            MAIL_DELIVERY_SECONDS.observe((now - email.created_at).total_seconds(), 'sent')
+            continue
+        message = f"{type(error).__name__}: {error}"
+        if is_permanent(error) or email.attempts >= max_attempts:
+            counts['failed'] += 1
+            MAIL_DELIVERY_SECONDS.observe((now - email.created_at).total_seconds(), 'failed')
+            logger.error("Email %s to %s failed after %d attempt(s): %s", email.id, email.to, email.attempts, message)
+            OutboxEmail.objects.filter(id=email.id).update(status='failed', error=message)
+        else:
+            counts['retry'] += 1
+            logger.warning("Email %s attempt %d failed, retrying: %s", email.id, email.attempts, message)
+            OutboxEmail.objects.filter(id=email.id).update(
+                status='pending', error=message, next_attempt_at=now + timedelta(seconds=retry_delay(email.attempts)))
+    return counts
+
+
+def drain(connection, limit=None):
+    """Send every due email in batches over `connection`; returns {'sent', 'retry', 'failed'}."""
+    limit = limit or getattr(settings, 'ADSCAN_MAIL_BATCH_SIZE', 50)
+    totals = {'sent': 0, 'retry': 0, 'failed': 0}
+    while True:
+        emails = claim_batch(limit)
+        if not emails:
+            return totals
+        for key, count in record_outcomes(deliver(emails, connection)).items():
+            totals[key] += count
+
+
+def requeue_stale(older_than):
+    """Put emails left 'sending' by a dead sender back to pending; returns the count."""
+    return OutboxEmail.objects.filter(status='sending', claimed_at__lt=older_than).update(status='pending')
+
+
+# ============================================================
+# Sender thread
+# ============================================================
+class MailSender:
+    """Background thread that drains the outbox over one long-lived SMTP connection."""
+
+    def __init__(self):
+        self._wake = threading.Event()
+        self._thread = None
+        self._lock = threading.Lock()
+        self.connection = None
+
+    def wake(self):
+        with self._lock:
+            if self._thread is None or not self._thread.is_alive():
+                self._thread = threading.Thread(target=self._loop, name="mail-outbox", daemon=True)
+                self._thread.start()
+        self._wake.set()
+
+    def _loop(self):
+        idle_since = time.monotonic()
+        while True:
+            self._wake.wait(timeout=getattr(settings, 'ADSCAN_MAIL_POLL_SECONDS', 5))
+            self._wake.clear()
+            close_old_connections()
+            try:
+                if self.connection is None:
+                    self.connection = get_connection()
+                totals = drain(self.connection)
+                if any(totals.values()):
+                    idle_since = time.monotonic()
+            except Exception:
+                logger.exception("Mail outbox pass failed")
+            finally:
+                close_old_connections()
+            if self.connection is not None and \
+                    time.monotonic() - idle_since > getattr(settings, 'ADSCAN_MAIL_IDLE_SECONDS', 60):
+                self.connection.close()
+                self.connection = None
+
+
+_sender = None
+_sender_lock = threading.Lock()
+
+
+def get_sender():
+    global _sender
+    if _sender is None:
+        with _sender_lock:
+            if _sender is None:
+                _sender = MailSender()
+    return _sender
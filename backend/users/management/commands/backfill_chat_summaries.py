@@ -0,0 +1,46 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from users.models import Chat
+
+
+class Command(BaseCommand):
+    help = (
+        "Populate the Chat scan summary columns (model_used, risk_estimate, images_count, "
+        "recommendations_count) from messages, in primary-key chunks. Rows that were already "
+        "summarized are skipped, so an interrupted run resumes where it stopped."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--chunk-size", type=int, default=1000, help="Chats per UPDATE batch.")
+        parser.add_argument("--after-id", type=int, default=0, help="Start after this Chat id.")
+        parser.add_argument("--all", action="store_true",
+                            help="Recompute every row, not only rows without a summary.")
+        parser.add_argument("--sleep", type=float, default=0.0,
+                            help="Seconds to pause between chunks to limit database load.")
+
+    def handle(self, *args, **options):
+        chunk_size = options["chunk_size"]
+        last_id = options["after_id"]
+        qs = Chat.objects.order_by("id").only("id", "messages")
+        if not options["all"]:
+            qs = qs.filter(summary_updated_at__isnull=True)
+
+        remaining = qs.filter(id__gt=last_id).count()
+        self.stdout.write(f"{remaining} chats to summarize.")
+        done = 0
+        while True:
+            chunk = list(qs.filter(id__gt=last_id)[:chunk_size])
+            if not chunk:
+                break
+            for chat in chunk:
+                chat.apply_scan_summary()
+            Chat.objects.bulk_update(chunk, Chat.SCAN_SUMMARY_FIELDS)
+            last_id = chunk[-1].id
+            done += len(chunk)
+            self.stdout.write(f"  {done}/{remaining} (last id {last_id})")
+            if options["sleep"]:
+                time.sleep(options["sleep"])
+
+        self.stdout.write(self.style.SUCCESS(f"Summarized {done} chats."))
@@ -0,0 +1,57 @@
+import statistics
+import time
+
+import numpy as np
+from django.core.management.base import BaseCommand, CommandError
+
+from users.model_registry import CompiledKerasModel, load_dark_joblib, load_light_keras
+
+
+class Command(BaseCommand):
+    help = (
+        "Measure per-image inference latency of Model.predict against the compiled tf.function "
+        "path (CompiledKerasModel) for the light model and the dark feature_extractor."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--models", default="light,dark", help="Comma-separated: light, dark.")
+        parser.add_argument("--batch-sizes", default="1,4,8,16", help="Comma-separated batch sizes to time.")
+        parser.add_argument("--iterations", type=int, default=30, help="Timed calls per batch size.")
+        parser.add_argument("--warmup", type=int, default=3, help="Untimed calls per batch size (tracing, caches).")
+
+    def handle(self, *args, **options):
+        models = [m.strip() for m in options["models"].split(",") if m.strip()]
+        batch_sizes = [int(b) for b in options["batch_sizes"].split(",") if b.strip()]
+        targets = []
+        for name in models:
+            if name == "light":
+                targets.append(("light", load_light_keras()))
+            elif name == "dark":
+                deployable = load_dark_joblib()
+                if not hasattr(deployable, "feature_extractor"):
+                    raise CommandError("The dark model has no feature_extractor to benchmark.")
+                targets.append(("dark feature_extractor", deployable.feature_extractor))
+            else:
+                raise CommandError(f"Unknown model: {name}")
+
+        rng = np.random.default_rng(0)
+        for name, model in targets:
+            compiled = CompiledKerasModel(model)
+            self.stdout.write(self.style.MIGRATE_HEADING(name))
+            self.stdout.write(f"{'batch':>5}  {'predict() ms/img':>17}  {'compiled ms/img':>16}  {'speedup':>7}")
+            for size in batch_sizes:
+                batch = rng.random((size, 224, 224, 3), dtype=np.float32)
+                before = self._per_image_ms(lambda: model.predict(batch, verbose=0), size, options)
+                after = self._per_image_ms(lambda: compiled.predict(batch), size, options)
+                self.stdout.write(f"{size:>5}  {before:>17.2f}  {after:>16.2f}  {before / after:>6.1f}x")
+
+    @staticmethod
+    def _per_image_ms(call, batch_size, options):
+        for _ in range(options["warmup"]):
+            call()
+        timings = []
+        for _ in range(options["iterations"]):
+            started = time.perf_counter()
+            call()
+            timings.append(time.perf_counter() - started)
+        return statistics.median(timings) / batch_size * 1000
@@ -0,0 +1,48 @@
+import os
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+from users.model_registry import list_image_files
+from users.tflite_light import convert_light_model
+
+
+class Command(BaseCommand):
+    help = (
+        "Convert MODEL_PATH_LIGHT to a TFLite model for ADSCAN_LIGHT_RUNTIME='tflite'. "
+        "int8 quantization is calibrated on a folder of representative skin images."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--quantization", choices=["none", "dynamic", "int8"], default="dynamic",
+                            help="dynamic: int8 weights only; int8: weights and activations (needs --calibration-dir).")
+        parser.add_argument("--output", default=str(getattr(settings, "MODEL_PATH_LIGHT_TFLITE", "")),
+                            help="Where to write the .tflite file (default MODEL_PATH_LIGHT_TFLITE).")
+        parser.add_argument("--calibration-dir", help="Folder of images used to calibrate int8 activations.")
+        parser.add_argument("--calibration-samples", type=int, default=200,
+                            help="Maximum number of calibration images.")
+
+    def handle(self, *args, **options):
+        output = options["output"]
+        if not output:
+            raise CommandError("No --output given and MODEL_PATH_LIGHT_TFLITE is not configured.")
+        calibration = []
+        if options["quantization"] == "int8":
+            if not options["calibration_dir"]:
+                raise CommandError("--quantization int8 needs --calibration-dir.")
+            calibration = list_image_files(options["calibration_dir"], limit=options["calibration_samples"])
+            if not calibration:
+                raise CommandError(f"No images found in {options['calibration_dir']}.")
+            self.stdout.write(f"Calibrating on {len(calibration)} images.")
+
+        source = settings.MODEL_PATH_LIGHT
+        self.stdout.write(f"Converting {source} ({options['quantization']})...")
+        content = convert_light_model(source, options["quantization"], calibration)
+        with open(output, "wb") as fh:
+            fh.write(content)
+
+        original = os.path.getsize(source)
+        self.stdout.write(self.style.SUCCESS(
+            f"Wrote {output}: {len(content) / 1e6:.1f} MB (Keras model {original / 1e6:.1f} MB). "
+            f"Run `manage.py tflite_parity --images <held-out folder>` before switching ADSCAN_LIGHT_RUNTIME."
+        ))
@@ -0,0 +1,41 @@
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+from users.model_registry import load_dark_joblib, load_light_keras
+from users.onnx_models import export_dark_classifier, export_keras_model
+
+
+class Command(BaseCommand):
+    help = (
+        "Export the detection models for the ONNX Runtime backend: the light Keras model and "
+        "the dark feature_extractor to ONNX, and the dark classifier to a standalone pickle."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--models", default="light,dark", help="Comma-separated: light, dark.")
+        parser.add_argument("--opset", type=int, default=13)
+
+    def handle(self, *args, **options):
+        models = {m.strip() for m in options["models"].split(",") if m.strip()}
+        unknown = models - {"light", "dark"}
+        if unknown:
+            raise CommandError(f"Unknown model(s): {', '.join(sorted(unknown))}")
+
+        if "light" in models:
+            output = settings.MODEL_PATH_LIGHT_ONNX
+            self.stdout.write(f"Exporting {settings.MODEL_PATH_LIGHT} -> {output}")
+            export_keras_model(load_light_keras(), output, opset=options["opset"])
+
+        if "dark" in models:
+            deployable = load_dark_joblib()
+            if not (hasattr(deployable, "feature_extractor") and hasattr(deployable, "classifier")):
+                raise CommandError("The dark model has no feature_extractor/classifier pair to export.")
+            self.stdout.write(f"Exporting {settings.MODEL_PATH_DARK} feature_extractor -> {settings.MODEL_PATH_DARK_ONNX}")
+            export_keras_model(deployable.feature_extractor, settings.MODEL_PATH_DARK_ONNX, opset=options["opset"])
+            self.stdout.write(f"Saving classifier -> {settings.MODEL_PATH_DARK_CLASSIFIER}")
+            export_dark_classifier(deployable, settings.MODEL_PATH_DARK_CLASSIFIER)
+
+        self.stdout.write(self.style.SUCCESS(
+            "Export done. Run `manage.py onnx_parity --images <held-out folder>` before switching "
+            "ADSCAN_LIGHT_RUNTIME / ADSCAN_DARK_RUNTIME to 'onnx'."
+        ))
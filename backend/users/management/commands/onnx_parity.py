@@ -0,0 +1,75 @@
+import time
+
+import numpy as np
+from django.core.management.base import BaseCommand, CommandError
+
+from users.model_registry import (
+    DARK_AD_THRESHOLD, LIGHT_AD_THRESHOLD, _dark_hybrid_probabilities, list_image_files,
+    load_dark_joblib, load_light_keras,
+)
+from users.preprocessing import load_image_array
+from users.onnx_models import load_dark_onnx, load_light_onnx
+
+
+class Command(BaseCommand):
+    help = (
+        "Check that the ONNX Runtime models match the Keras/joblib originals on a held-out image "
+        "folder: probability differences, label agreement and latency. Fails outside the tolerance."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--images", required=True, help="Folder of held-out images (searched recursively).")
+        parser.add_argument("--models", default="light,dark", help="Comma-separated: light, dark.")
+        parser.add_argument("--limit", type=int, default=None, help="Maximum number of images.")
+        parser.add_argument("--batch-size", type=int, default=16)
+        parser.add_argument("--tolerance", type=float, default=1e-3,
+                            help="Maximum allowed absolute probability difference.")
+
+    def handle(self, *args, **options):
+        paths = list_image_files(options["images"], limit=options["limit"])
+        if not paths:
+            raise CommandError(f"No images found in {options['images']}.")
+        models = {m.strip() for m in options["models"].split(",") if m.strip()}
+
+        pairs = []
+        if "light" in models:
+            reference, candidate = load_light_keras(), load_light_onnx()
+            pairs.append(("light", LIGHT_AD_THRESHOLD,
+                          lambda b: np.ravel(reference.predict(b, verbose=0)),
+                          lambda b: np.ravel(candidate.predict(b))))
+        if "dark" in models:
+            reference_dark, candidate_dark = load_dark_joblib(), load_dark_onnx()
+            pairs.append(("dark", DARK_AD_THRESHOLD,
+                          lambda b: _dark_hybrid_probabilities(reference_dark, b),
+                          lambda b: _dark_hybrid_probabilities(candidate_dark, b)))
+
+        failed = False
+        for name, threshold, run_reference, run_candidate in pairs:
+            ref_probs, onnx_probs = [], []
+            ref_time = onnx_time = 0.0
+            size = options["batch_size"]
+            for start in range(0, len(paths), size):
+                batch = np.stack([load_image_array(p) for p in paths[start:start + size]], axis=0)
+                t = time.perf_counter()
+                ref_probs.extend(run_reference(batch))
+                ref_time += time.perf_counter() - t
+                t = time.perf_counter()
+                onnx_probs.extend(run_candidate(batch))
+                onnx_time += time.perf_counter() - t
+
+            ref_probs = np.asarray(ref_probs, dtype="float64")
+            onnx_probs = np.asarray(onnx_probs, dtype="float64")
+            diff = np.abs(ref_probs - onnx_probs)
+            agreement = float(np.mean((ref_probs >= threshold) == (onnx_probs >= threshold)))
+            n = len(paths)
+            self.stdout.write(f"[{name}] images {n}: abs diff mean {diff.mean():.6f}, max {diff.max():.6f}; "
+                              f"label agreement {agreement:.2%}; "
+                              f"per image {ref_time / n * 1000:.2f} ms -> {onnx_time / n * 1000:.2f} ms")
+            if diff.max() > options["tolerance"]:
+                failed = True
+                self.stdout.write(self.style.ERROR(f"[{name}] max diff above {options['tolerance']} "
+                                                   f"({paths[int(diff.argmax())]})"))
+
+        if failed:
+            raise CommandError("ONNX models are outside the parity tolerance.")
+        self.stdout.write(self.style.SUCCESS("ONNX models within tolerance."))
@@ -0,0 +1,53 @@
+import time
+from datetime import timedelta
+
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+
+from users.models import PdfReportJob
+from users.pdf_reports import requeue_stale_jobs, retry_failed_jobs, run_job
+
+
+class Command(BaseCommand):
+    help = (
+        "Render queued PDF reports (PdfReportJob rows in 'pending'). Use with "
+        "ADSCAN_PDF_BACKEND='queue', or to pick up jobs orphaned by a restart of the "
+        "in-process thread workers."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--limit", type=int, default=100, help="Jobs to claim per pass.")
+        parser.add_argument("--loop", action="store_true", help="Keep polling instead of exiting when the queue is empty.")
+        parser.add_argument("--interval", type=float, default=2.0, help="Seconds between polls with --loop.")
+        parser.add_argument("--stale-minutes", type=int, default=10,
+                            help="Requeue jobs that have been 'running' for longer than this.")
+        parser.add_argument("--retry-failed", type=int, default=0, metavar="MAX_ATTEMPTS",
+                            help="Requeue failed jobs tried fewer than MAX_ATTEMPTS times.")
+
+    def handle(self, *args, **options):
+        while True:
+            requeued = requeue_stale_jobs(timezone.now() - timedelta(minutes=options["stale_minutes"]))
+            if options["retry_failed"]:
+                requeued += retry_failed_jobs(options["retry_failed"])
+            if requeued:
+                self.stdout.write(f"Requeued {requeued} job(s).")
+
+            job_ids = list(PdfReportJob.objects.filter(status="pending")
+                           .order_by("id").values_list("id", flat=True)[:options["limit"]])
+            done = failed = 0
+            for job_id in job_ids:
+                started = time.monotonic()
+                ok = run_job(job_id)
+                if ok:
+                    done += 1
+                    self.stdout.write(f"  job {job_id}: ready ({time.monotonic() - started:.2f}s)")
+                elif PdfReportJob.objects.filter(id=job_id, status="failed").exists():
+                    failed += 1
+                    self.stdout.write(self.style.WARNING(f"  job {job_id}: failed"))
+            if job_ids:
+                self.stdout.write(self.style.SUCCESS(f"Rendered {done} PDF(s), {failed} failed."))
+
+            if not options["loop"]:
+                break
+            if not job_ids:
+                time.sleep(options["interval"])
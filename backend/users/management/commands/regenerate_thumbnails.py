@@ -0,0 +1,41 @@
+from django.core.management.base import BaseCommand
+from django.db.models import Q
+
+from users.models import AdScanImage
+from users.thumbnails import attach_thumbnail
+
+
+class Command(BaseCommand):
+    help = (
+        "Render AdScanImage thumbnails (adscan_images/thumbs/). By default only images "
+        "without a thumbnail are processed; use --all after changing the size or format."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--all", action="store_true", help="Regenerate every thumbnail.")
+        parser.add_argument("--chunk-size", type=int, default=500, help="Images loaded per query.")
+
+    def handle(self, *args, **options):
+        qs = AdScanImage.objects.order_by("id").only("id", "image", "thumbnail")
+        if not options["all"]:
+            qs = qs.filter(Q(thumbnail__isnull=True) | Q(thumbnail=""))
+
+        total = qs.count()
+        self.stdout.write(f"{total} images to process.")
+        done = failed = 0
+        last_id = 0
+        while True:
+            chunk = list(qs.filter(id__gt=last_id)[:options["chunk_size"]])
+            if not chunk:
+                break
+            for ad_image in chunk:
+                try:
+                    attach_thumbnail(ad_image)
+                    done += 1
+                except Exception as e:
+                    failed += 1
+                    self.stdout.write(self.style.WARNING(f"  image {ad_image.id}: {type(e).__name__}: {e}"))
+            last_id = chunk[-1].id
+            self.stdout.write(f"  {done + failed}/{total} (last id {last_id})")
+
+        self.stdout.write(self.style.SUCCESS(f"Generated {done} thumbnails, {failed} failed."))
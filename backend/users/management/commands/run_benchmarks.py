@@ -0,0 +1,103 @@
+import json
+
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+
+from users import prediction_cache
+from users.benchmarks import DEFAULT_BATCH_SIZES, DEFAULT_FORMATS, DEFAULT_RESOLUTIONS, compare_reports, run_suite
+from users.models import AdScanImage
+
+
+def _csv(value, cast=str):
+    return [cast(v.strip()) for v in value.split(",") if v.strip()]
+
+
+def _resolution(value):
+    width, height = value.lower().split("x")
+    return int(width), int(height)
+
+
+def _delete_uploaded_files(user):
+    """Remove the images and thumbnails the upload cases stored; their rows are rolled back."""
+    for ad_image in AdScanImage.objects.filter(user=user):
+        for field in (ad_image.image, ad_image.thumbnail):
+            if field:
+                field.delete(save=False)
+
+
+class Command(BaseCommand):
+    help = (
+        "Benchmark the preprocessing, model and upload-endpoint paths on synthetic JPEG/PNG uploads: "
+        "p50/p95/p99 latency, images/sec per batch size and memory high-water mark, as JSON. "
+        "The prediction cache is bypassed; endpoint rows are rolled back and their files deleted."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--paths", default="preprocess,light,light_single,dark,dark_fixed,upload",
+                            help="Comma-separated: preprocess, light, light_single, dark, dark_fixed, both, upload, upload_dark.")
+        parser.add_argument("--resolutions", default=",".join(f"{w}x{h}" for w, h in DEFAULT_RESOLUTIONS))
+        parser.add_argument("--formats", default=",".join(DEFAULT_FORMATS))
+        parser.add_argument("--batch-sizes", default=",".join(str(b) for b in DEFAULT_BATCH_SIZES))
+        parser.add_argument("--iterations", type=int, default=20)
+        parser.add_argument("--warmup", type=int, default=2)
+        parser.add_argument("--output", help="Write the JSON report here instead of stdout.")
+        parser.add_argument("--baseline", help="Previous JSON report to compare p50 latencies against.")
+        parser.add_argument("--max-regression", type=float, default=0.2,
+                            help="Allowed p50 slowdown against --baseline, as a fraction.")
+        parser.add_argument("--fail-on-regression", action="store_true")
+
+    def handle(self, *args, **options):
+        log = self.stderr if not options["output"] else self.stdout
+
+        def progress(case):
+            if case.get("skipped"):
+                log.write(f"{case['path']:>12} {case['format']:>4} {case['resolution']:>9} x{case['batch_size']:<3} "
+                          f"skipped: {case['skipped']}")
+                return
+            if case.get("error"):
+                log.write(self.style.ERROR(f"{case['path']:>12} {case['format']:>4} {case['resolution']:>9} "
+                                           f"x{case['batch_size']:<3} failed: {case['error']}"))
+                return
+            log.write(f"{case['path']:>12} {case['format']:>4} {case['resolution']:>9} x{case['batch_size']:<3} "
+                      f"p50 {case['p50_ms']:9.2f} ms  p99 {case['p99_ms']:9.2f} ms  "
+                      f"{case['images_per_sec'] or 0:8.1f} img/s  rss {case['rss_high_water_mb']:.0f} MB")
+
+        with prediction_cache.bypassed():
+            with transaction.atomic():
+                user = User.objects.create_user("adscan-benchmark", "benchmark@example.invalid")
+                try:
+                    report = run_suite(
+                        _csv(options["paths"]),
+                        resolutions=_csv(options["resolutions"], _resolution),
+                        formats=[f.upper() for f in _csv(options["formats"])],
+                        batch_sizes=_csv(options["batch_sizes"], int),
+                        iterations=options["iterations"],
+                        warmup=options["warmup"],
+                        progress=progress,
+                    )
+                except ValueError as e:
+                    raise CommandError(str(e))
+                finally:
+                    _delete_uploaded_files(user)
+                    transaction.set_rollback(True)
+
+        if options["baseline"]:
+            with open(options["baseline"]) as fh:
+                report["regressions"] = compare_reports(report, json.load(fh), options["max_regression"])
+            for r in report["regressions"]:
+                log.write(self.style.WARNING(f"regression {r['case']}: {r['baseline_p50_ms']:.2f} -> {r['p50_ms']:.2f} ms "
+                                             f"({r['ratio']:.2f}x)"))
+
+        payload = json.dumps(report, indent=2, default=str)
+        if options["output"]:
+            with open(options["output"], "w") as fh:
+                fh.write(payload)
+            self.stdout.write(self.style.SUCCESS(f"Wrote {len(report['results'])} cases to {options['output']}"))
+        else:
+            self.stdout.write(payload)
+        if report["errors"]:
+            log.write(self.style.WARNING(f"{report['errors']} case(s) failed; see their 'error' in the report."))
+
+        if options["fail_on_regression"] and report.get("regressions"):
+            raise CommandError(f"{len(report['regressions'])} case(s) regressed beyond {options['max_regression']:.0%}.")
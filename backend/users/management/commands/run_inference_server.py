@@ -0,0 +1,33 @@
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from users.inference_service import build_service, serve_forever
+
+
+class Command(BaseCommand):
+    help = (
+        "Run the shared inference server: a model-owning process pool behind a micro-batching "
+        "queue, reachable over a local unix socket (ADSCAN_INFERENCE_BACKEND='socket')."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--socket", default=str(settings.ADSCAN_INFERENCE_SOCKET),
+                            help="Unix socket path to listen on.")
+
+    def handle(self, *args, **options):
+        import os
+
+        address = options["socket"]
+        if os.path.exists(address):
+            os.unlink(address)  # stale socket from a previous run
+        service = build_service()
+        self.stdout.write(self.style.SUCCESS(
+            f"Inference server on {address} (workers={settings.ADSCAN_INFERENCE_WORKERS}, "
+            f"max_batch={settings.ADSCAN_INFERENCE_MAX_BATCH_SIZE}, max_wait={settings.ADSCAN_INFERENCE_MAX_WAIT_MS}ms)"
+        ))
+        try:
+            serve_forever(service, address)
+        except KeyboardInterrupt:
+            pass
+        finally:
+            service.shutdown()
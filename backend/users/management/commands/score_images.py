@@ -0,0 +1,103 @@
+import os
+
+from django.core.management.base import BaseCommand, CommandError
+
+from users.bulk_scoring import (
+    CsvWriter, ParquetWriter, PredictionWriter, default_batch_size, iter_adscan_images, iter_directory,
+    load_checkpoint, score_items, stale_images,
+)
+from users.inference_service import MODEL_TYPES
+
+
+class Command(BaseCommand):
+    help = (
+        "Score an image directory or the AdScanImage table offline with batched inference. "
+        "Results go to CSV, a Parquet dataset or Prediction rows (--output db). Runs checkpoint "
+        "after every flush; rerun the same command to resume, or pass --restart."
+    )
+
+    def add_arguments(self, parser):
+        source = parser.add_mutually_exclusive_group(required=True)
+        source.add_argument("--dir", help="Score the image files under this directory (recursively).")
+        source.add_argument("--adscan-images", action="store_true", help="Score the stored AdScanImage uploads.")
+        parser.add_argument("--model", choices=MODEL_TYPES, default="light")
+        parser.add_argument("--output", required=True,
+                            help="A .csv file, a directory for a Parquet dataset, or 'db' (with --adscan-images).")
+        parser.add_argument("--format", choices=("csv", "parquet", "db"),
+                            help="Output format; guessed from --output by default.")
+        parser.add_argument("--batch-size", type=int, default=None,
+                            help="Images per forward pass (default ADSCAN_INFERENCE_MAX_BATCH_SIZE).")
+        parser.add_argument("--prefetch", type=int, default=2, help="Decoded batches kept ready ahead of inference.")
+        parser.add_argument("--workers", type=int, default=None,
+                            help="Decode threads (default ADSCAN_PREPROCESS_WORKERS).")
+        parser.add_argument("--flush-every", type=int, default=10, help="Batches between flushes and checkpoints.")
+        parser.add_argument("--checkpoint", help="Checkpoint file (default: derived from --output).")
+        parser.add_argument("--restart", action="store_true", help="Ignore an existing checkpoint.")
+        parser.add_argument("--user", type=int, help="Only this user's AdScanImages.")
+        parser.add_argument("--since-id", type=int, default=0, help="Only AdScanImages with a larger id.")
+        parser.add_argument("--only-stale", action="store_true",
+                            help="Only AdScanImages without a Prediction from the current model version.")
+
+    def handle(self, *args, **options):
+        fmt = options["format"] or self._guess_format(options["output"])
+        if fmt == "db" and not options["adscan_images"]:
+            raise CommandError("--output db needs --adscan-images (rows reference AdScanImage ids).")
+
+        checkpoint = options["checkpoint"] or (
+            "score_images.db.checkpoint.json" if fmt == "db" else f"{options['output'].rstrip(os.sep)}.checkpoint.json"
+        )
+        state = {} if options["restart"] else load_checkpoint(checkpoint)
+        source = options["dir"] or "adscan_images"
+        if state and (state.get("source") != source or state.get("model_type") != options["model"]):
+            raise CommandError(f"{checkpoint} belongs to another run ({state.get('source')}, "
+                               f"{state.get('model_type')}); pass --restart or another --checkpoint.")
+        if state:
+            self.stdout.write(f"Resuming after {state.get('last_key')} ({state.get('images', 0)} images done).")
+        state["source"] = source
+
+        if options["dir"]:
+            if not os.path.isdir(options["dir"]):
+                raise CommandError(f"Not a directory: {options['dir']}")
+            items = iter_directory(options["dir"], after=state.get("last_key"))
+        else:
+            from users.models import AdScanImage
+            qs = AdScanImage.objects.filter(id__gt=options["since_id"])
+            if options["user"]:
+                qs = qs.filter(user_id=options["user"])
+            if options["only_stale"]:
+                qs = stale_images(qs, options["model"])
+            items = iter_adscan_images(after=state.get("last_key"), queryset=qs)
+
+        try:
+            writer = {"csv": CsvWriter, "parquet": ParquetWriter}[fmt](options["output"]) if fmt != "db" else PredictionWriter()
+        except RuntimeError as e:
+            raise CommandError(str(e))
+
+        def progress(state, elapsed):
+            if (state["images"] + state["failed"]) % 500 < (options["batch_size"] or default_batch_size()):
+                self.stdout.write(f"  {state['images']} scored, {state['failed']} failed, last {state['last_key']}")
+
+        state = score_items(
+            items, options["model"], writer,
+            batch_size=options["batch_size"] or default_batch_size(),
+            prefetch=options["prefetch"],
+            flush_every=options["flush_every"],
+            checkpoint_path=checkpoint,
+            state=state,
+            progress=progress,
+            workers=options["workers"],
+        )
+
+        rate = f"{state['images_per_sec']:.1f} images/s" if state.get("images_per_sec") else "n/a"
+        self.stdout.write(self.style.SUCCESS(
+            f"Scored {state['images']} images with the {options['model']} model, {state['failed']} failed, "
+            f"in {state['seconds']:.1f}s ({rate}). Checkpoint: {checkpoint}"
+        ))
+
+    @staticmethod
+    def _guess_format(output):
+        if output == "db":
+            return "db"
+        if output.endswith(".csv"):
+            return "csv"
+        return "parquet"
@@ -0,0 +1,46 @@
+import time
+from datetime import timedelta
+
+from django.core.mail import get_connection
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+
+from users.mail_outbox import drain, requeue_stale
+
+
+class Command(BaseCommand):
+    help = (
+        "Send queued emails (OutboxEmail rows due in 'pending') over one SMTP connection. Use with "
+        "ADSCAN_MAIL_BACKEND='queue', or to pick up mail left behind by a restarted process."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--batch-size", type=int, default=None, help="Emails to claim per batch.")
+        parser.add_argument("--loop", action="store_true", help="Keep polling instead of exiting when the outbox is empty.")
+        parser.add_argument("--interval", type=float, default=2.0, help="Seconds between polls with --loop.")
+        parser.add_argument("--stale-minutes", type=int, default=10,
+                            help="Requeue emails that have been 'sending' for longer than this.")
+
+    def handle(self, *args, **options):
+        connection = get_connection()  # kept open across batches and polls
+        try:
+            while True:
+                requeued = requeue_stale(timezone.now() - timedelta(minutes=options["stale_minutes"]))
+                if requeued:
+                    self.stdout.write(f"Requeued {requeued} email(s).")
+
+                started = time.monotonic()
+                totals = drain(connection, limit=options["batch_size"])
+                if any(totals.values()):
+                    style = self.style.WARNING if totals["failed"] else self.style.SUCCESS
+                    self.stdout.write(style(
+                        f"Sent {totals['sent']}, {totals['retry']} to retry, {totals['failed']} failed "
+                        f"({time.monotonic() - started:.2f}s)."
+                    ))
+
+                if not options["loop"]:
+                    break
+                if not any(totals.values()):
+                    time.sleep(options["interval"])
+        finally:
+            connection.close()
@@ -0,0 +1,62 @@
+import time
+
+import numpy as np
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+from users.model_registry import LIGHT_AD_THRESHOLD, list_image_files, load_light_keras
+from users.preprocessing import load_image_array
+from users.tflite_light import TFLiteLightModel
+
+
+class Command(BaseCommand):
+    help = (
+        "Compare the TFLite light model against the Keras model on a held-out image folder: "
+        "probability differences, AD/not-AD agreement at the decision threshold and latency."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--images", required=True, help="Folder of held-out images (searched recursively).")
+        parser.add_argument("--model", default=str(getattr(settings, "MODEL_PATH_LIGHT_TFLITE", "")),
+                            help="TFLite file to check (default MODEL_PATH_LIGHT_TFLITE).")
+        parser.add_argument("--limit", type=int, default=None, help="Maximum number of images.")
+        parser.add_argument("--batch-size", type=int, default=16)
+        parser.add_argument("--min-agreement", type=float, default=0.99,
+                            help="Fail if fewer than this fraction of labels agree.")
+        parser.add_argument("--max-abs-diff", type=float, default=0.05,
+                            help="Fail if any probability differs by more than this.")
+
+    def handle(self, *args, **options):
+        paths = list_image_files(options["images"], limit=options["limit"])
+        if not paths:
+            raise CommandError(f"No images found in {options['images']}.")
+
+        keras_model = load_light_keras()
+        tflite_model = TFLiteLightModel(options["model"], num_threads=getattr(settings, "ADSCAN_TFLITE_NUM_THREADS", None))
+
+        keras_probs, tflite_probs = [], []
+        keras_time = tflite_time = 0.0
+        size = options["batch_size"]
+        for start in range(0, len(paths), size):
+            batch = np.stack([load_image_array(p) for p in paths[start:start + size]], axis=0)
+            t = time.perf_counter()
+            keras_probs.extend(np.ravel(keras_model.predict(batch, verbose=0)))
+            keras_time += time.perf_counter() - t
+            t = time.perf_counter()
+            tflite_probs.extend(np.ravel(tflite_model.predict(batch)))
+            tflite_time += time.perf_counter() - t
+
+        keras_probs = np.asarray(keras_probs, dtype="float64")
+        tflite_probs = np.asarray(tflite_probs, dtype="float64")
+        diff = np.abs(keras_probs - tflite_probs)
+        agreement = float(np.mean((keras_probs < LIGHT_AD_THRESHOLD) == (tflite_probs < LIGHT_AD_THRESHOLD)))
+
+        n = len(paths)
+        self.stdout.write(f"Images: {n}")
+        self.stdout.write(f"Abs diff: mean {diff.mean():.5f}, max {diff.max():.5f} ({paths[int(diff.argmax())]})")
+        self.stdout.write(f"Label agreement at {LIGHT_AD_THRESHOLD}: {agreement:.2%}")
+        self.stdout.write(f"Latency per image: keras {keras_time / n * 1000:.2f} ms, tflite {tflite_time / n * 1000:.2f} ms")
+
+        if agreement < options["min_agreement"] or diff.max() > options["max_abs_diff"]:
+            raise CommandError("TFLite model is outside the parity tolerance.")
+        self.stdout.write(self.style.SUCCESS("TFLite model within tolerance."))
@@ -0,0 +1,14 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from users.model_registry import model_version, warmup_models
+
+
+class Command(BaseCommand):
+    help = "Load the light and dark skin models and run a test prediction (use as a pre-start check)."
+
+    def handle(self, *args, **options):
+        if not warmup_models():
+            raise CommandError("Model verification failed.")
+        for model_type in ("light", "dark"):
+            self.stdout.write(f"{model_type}: {model_version(model_type)}")
+        self.stdout.write(self.style.SUCCESS("Models loaded and verified."))
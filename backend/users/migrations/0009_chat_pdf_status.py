@@ -0,0 +1,41 @@
+# Generated by Django 5.2.18 on 2026-10-18 13:27
+
+import django.core.serializers.json
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+def mark_existing_reports_ready(apps, schema_editor):
+    Chat = apps.get_model('users', 'Chat')
+    Chat.objects.exclude(pdf_report__isnull=True).exclude(pdf_report='').update(pdf_status='ready')
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('users', '0008_chat_user_created_index'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='chat',
+            name='pdf_status',
+            field=models.CharField(choices=[('none', 'No report'), ('pending', 'Pending'), ('ready', 'Ready'), ('failed', 'Failed')], default='none', max_length=10),
+        ),
+        migrations.CreateModel(
+            name='PdfReportJob',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('payload', models.JSONField(default=dict, encoder=django.core.serializers.json.DjangoJSONEncoder)),
+                ('filename', models.CharField(max_length=255)),
+                ('status', models.CharField(choices=[('pending', 'Pending'), ('running', 'Running'), ('done', 'Done'), ('failed', 'Failed')], db_index=True, default='pending', max_length=10)),
+                ('attempts', models.PositiveSmallIntegerField(default=0)),
+                ('error', models.TextField(blank=True)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('started_at', models.DateTimeField(blank=True, null=True)),
+                ('finished_at', models.DateTimeField(blank=True, null=True)),
+                ('chat', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='pdf_jobs', to='users.chat')),
+            ],
+        ),
+        migrations.RunPython(mark_existing_reports_ready, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 5.2.18 on 2026-10-18 13:28
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('users', '0009_chat_pdf_status'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='adscanimage',
+            name='thumbnail',
+            field=models.ImageField(blank=True, null=True, upload_to='adscan_images/thumbs/'),
+        ),
+    ]
@@ -0,0 +1,29 @@
+# Generated by Django 5.2.18 on 2026-10-18 13:49
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('users', '0010_adscanimage_thumbnail'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='Prediction',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('model_type', models.CharField(max_length=10)),
+                ('model_version', models.CharField(max_length=255)),
+                ('probability', models.FloatField()),
+                ('threshold', models.FloatField()),
+                ('label', models.CharField(max_length=10)),
+                ('is_ad', models.BooleanField()),
+                ('source', models.CharField(choices=[('upload', 'Upload'), ('batch', 'Batch re-score')], default='upload', max_length=10)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('image', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='predictions', to='users.adscanimage')),
+            ],
+        ),
+    ]
@@ -0,0 +1,26 @@
+# Generated by Django 5.2.18 on 2026-10-18 13:52
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('users', '0011_prediction'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='prediction',
+            name='latency_ms',
+            field=models.FloatField(blank=True, null=True),
+        ),
+        migrations.AddIndex(
+            model_name='prediction',
+            index=models.Index(fields=['image', 'model_type', '-created_at'], name='prediction_image_model_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='prediction',
+            index=models.Index(fields=['model_type', 'created_at'], name='prediction_model_created_idx'),
+        ),
+    ]
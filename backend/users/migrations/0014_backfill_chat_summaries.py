@@ -0,0 +1,36 @@
+from django.db import migrations
+from django.utils import timezone
+
+from users.models import summarize_scan_messages
+
+CHUNK_SIZE = 1000
+
+
+def backfill_chat_summaries(apps, schema_editor):
+    """Fill the scan summary columns added in 0007 for chats saved before them (as backfill_chat_summaries)."""
+    Chat = apps.get_model('users', 'Chat')
+    qs = Chat.objects.filter(summary_updated_at__isnull=True).order_by('id').only('id', 'messages')
+    last_id = 0
+    while True:
+        chunk = list(qs.filter(id__gt=last_id)[:CHUNK_SIZE])
+        if not chunk:
+            return
+        now = timezone.now()
+        for chat in chunk:
+            for field, value in summarize_scan_messages(chat.messages).items():
+                setattr(chat, field, value)
+            chat.summary_updated_at = now
+        Chat.objects.bulk_update(chunk, ['model_used', 'risk_estimate', 'images_count',
+                                         'recommendations_count', 'summary_updated_at'])
+        last_id = chunk[-1].id
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('users', '0013_outboxemail'),
+    ]
+
+    operations = [
+        migrations.RunPython(backfill_chat_summaries, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,459 @@
+"""
+Model registry for the AD detection models.
+
+Loads the light-skin Keras model and the dark-skin deployable (joblib) model on first
+use, behind a lock, with TensorFlow imported lazily so that `manage.py` commands,
+migrations and URL resolution do not pay TensorFlow startup. Set
+settings.ADSCAN_MODEL_LOADING = 'eager' to load and verify both models when a server
+process starts (see UsersConfig.ready), or run `manage.py warmup_models`.
+
+The runtime behind each loader is pluggable (settings.ADSCAN_LIGHT_RUNTIME /
+ADSCAN_DARK_RUNTIME): a name from LIGHT_RUNTIMES / DARK_RUNTIMES, or the dotted path of
+a custom loader. A light loader returns an object with Keras-style
+`predict(batch, verbose=0)` -> (N, 1) probabilities; a dark loader returns an object with
+`feature_extractor.predict(batch, verbose=0)`, an sklearn-style `classifier` and
+optionally `optimal_threshold` (or a legacy `predict_single_image`). The array entry
+points (`predict_arrays` / `predict_array`) are attached to the dark model here.
+"""
+import logging
+import os
+import threading
+
+import numpy as np
+from django.conf import settings
+from django.utils.module_loading import import_string
+
+from .preprocessing import load_image_array
+
+logger = logging.getLogger(__name__)
+
+# Decision thresholds from the Colab evaluation: the light model flags AD when its output is
+# BELOW its threshold, the dark deployable model when its probability is at or above it.
+LIGHT_AD_THRESHOLD = 0.31
+DARK_AD_THRESHOLD = 0.3
+
+# ============================================================
+# Shared preprocessing (matches the Colab notebook; see users/preprocessing.py)
+# ============================================================
+IMAGE_EXTENSIONS = ('.jpg', '.jpeg', '.png', '.bmp', '.webp')
+
+def list_image_files(folder, limit=None):
+    """Image paths under `folder` (recursive, sorted) for calibration and parity checks."""
+    paths = []
+    for root, _, names in os.walk(folder):
+        paths.extend(os.path.join(root, n) for n in names if n.lower().endswith(IMAGE_EXTENSIONS))
+    paths.sort()
+    return paths[:limit] if limit else paths
+
+def _dark_raw_result(prob, prediction, model_used, threshold_used):
+    """Result dict in the format of the deployable model's predict_single_image."""
+    return {
+        'prediction': prediction,
+        'probability': float(prob),
+        'confidence': 'High' if abs(prob - 0.5) > 0.3 else 'Medium',
+        'model_used': model_used,
+        'threshold_used': threshold_used,
+        'success': True
+    }
+
+def _dark_classify(model, features):
+    """Run the deployable model's classifier on feature_extractor output."""
+    features_flat = features.reshape(features.shape[0], -1)
+    if hasattr(model.classifier, 'predict_proba'):
+        return [float(p[1]) for p in model.classifier.predict_proba(features_flat)]
+    return [float(p) for p in np.ravel(model.classifier.predict(features_flat))]
+
+def _dark_hybrid_probabilities(model, batch):
+    """Run the deployable model's feature_extractor + classifier on a preprocessed batch."""
+    return _dark_classify(model, model.feature_extractor.predict(batch, verbose=0))
+
+def _dark_hybrid_results(model, probabilities):
+    """predict_single_image-style dicts for hybrid (feature_extractor + classifier) probabilities."""
+    optimal_threshold = getattr(model, 'optimal_threshold', 0.5)
+    return [
+        _dark_raw_result(prob, "AD" if prob > optimal_threshold else "Not AD", "Hybrid",
+                         getattr(model, 'optimal_threshold', 0.3))
+        for prob in probabilities
+    ]
+
+# ============================================================
+# Compiled inference (tf.function per batch bucket instead of Model.predict)
+# ============================================================
+class CompiledKerasModel:
+    """
+    Calls a Keras model through traced tf.functions with fixed (bucket, 224, 224, 3) input
+    signatures. Model.predict builds a data adapter and runs callbacks on every call, which
+    dominates batch-of-1 latency. Batches are zero-padded up to the next bucket and larger
+    batches are split into chunks of the largest one, so at most len(buckets) graphs are
+    traced. Everything except predict() is delegated to the wrapped model.
+    """
+
+    def __init__(self, model, buckets=(1, 4, 8, 16)):
+        import tensorflow as tf  # type: ignore
+
+        self.model = model
+        self.buckets = tuple(sorted(buckets))
+        self._functions = {
+            size: tf.function(lambda x: model(x, training=False),
+                              input_signature=[tf.TensorSpec((size, 224, 224, 3), tf.float32)])
+            for size in self.buckets
+        }
+
+    def __getattr__(self, name):
+        return getattr(self.model, name)
+
+    def predict(self, batch, verbose=0):
+        batch = np.asarray(batch, dtype='float32')
+        if batch.ndim == 3:
+            batch = np.expand_dims(batch, axis=0)
+        largest = self.buckets[-1]
+        outputs = []
+        for start in range(0, len(batch), largest):
+            chunk = batch[start:start + largest]
+            n = len(chunk)
+            size = next(b for b in self.buckets if b >= n)
+            if size > n:
+                chunk = np.concatenate([chunk, np.zeros((size - n,) + chunk.shape[1:], dtype='float32')])
+            outputs.append(np.asarray(self._functions[size](chunk))[:n])
+        return np.concatenate(outputs, axis=0)
+
+    def warmup(self):
+        """Trace every bucket now rather than on the first request of that size."""
+        for size in self.buckets:
+            self._functions[size](np.zeros((size, 224, 224, 3), dtype='float32'))
+
+def compile_for_inference(model):
+    """Wrap a Keras model in CompiledKerasModel when settings.ADSCAN_COMPILED_PREDICT is on."""
+    if not getattr(settings, 'ADSCAN_COMPILED_PREDICT', True) or isinstance(model, CompiledKerasModel):
+        return model
+    if not (callable(model) and hasattr(model, 'layers')):  # not a Keras model (e.g. ONNX/TFLite wrapper)
+        return model
+    return CompiledKerasModel(model, buckets=getattr(settings, 'ADSCAN_BATCH_BUCKETS', (1, 4, 8, 16)))
+
+# ============================================================
+# Model loaders for BOTH models (light and dark skin)
+# ============================================================
+_ad_model_light = None
+_ad_model_dark = None
+_load_lock = threading.Lock()
+
+LIGHT_RUNTIMES = {
+    'keras': 'users.model_registry.load_light_keras',
+    'tflite': 'users.tflite_light.load_light_tflite',
+    'onnx': 'users.onnx_models.load_light_onnx',
+}
+DARK_RUNTIMES = {
+    'joblib': 'users.model_registry.load_dark_joblib',
+    'onnx': 'users.onnx_models.load_dark_onnx',
+}
+# files each runtime serves, for the prediction cache identity and model_version
+_RUNTIME_PATH_SETTINGS = {
+    ('light', 'keras'): ('MODEL_PATH_LIGHT',),
+    ('light', 'tflite'): ('MODEL_PATH_LIGHT_TFLITE',),
+    ('light', 'onnx'): ('MODEL_PATH_LIGHT_ONNX',),
+    ('dark', 'joblib'): ('MODEL_PATH_DARK',),
+    # the ONNX feature extractor plus the pickled classifier and optimal_threshold
+    ('dark', 'onnx'): ('MODEL_PATH_DARK_ONNX', 'MODEL_PATH_DARK_CLASSIFIER'),
+}
+
+def get_light_runtime():
+    return getattr(settings, 'ADSCAN_LIGHT_RUNTIME', 'keras')
+
+def get_dark_runtime():
+    return getattr(settings, 'ADSCAN_DARK_RUNTIME', 'joblib')
+
+def _runtime_loader(runtimes, name):
+    return import_string(runtimes.get(name, name))
+
+def model_runtime(model_type):
+    return get_dark_runtime() if model_type == 'dark' else get_light_runtime()
+
+def model_paths(model_type):
+    """Paths of every file the served model is loaded from (depends on ADSCAN_*_RUNTIME)."""
+    model = 'dark' if model_type == 'dark' else 'light'
+    default = ('MODEL_PATH_DARK',) if model == 'dark' else ('MODEL_PATH_LIGHT',)
+    return [getattr(settings, setting, None)
+            for setting in _RUNTIME_PATH_SETTINGS.get((model, model_runtime(model)), default)]
+
+def light_model_path():
+    """Path of the light model file actually served (depends on ADSCAN_LIGHT_RUNTIME)."""
+    return model_paths('light')[0]
+
+def dark_model_path():
+    """Path of the main dark model file actually served (depends on ADSCAN_DARK_RUNTIME)."""
+    return model_paths('dark')[0]
+
+def file_mtime(path):
+    try:
+        return int(os.path.getmtime(path)) if path else 0
+    except OSError:
+        return 0
+
+def model_version(model_type):
+    """
+    '<runtime>:<file name>@<mtime>' of the served model ('+'-joined when it spans several
+    files, e.g. the dark ONNX extractor and its classifier); changes when a file is replaced.
+    """
+    files = '+'.join(f"{os.path.basename(str(path or ''))}@{file_mtime(path)}" for path in model_paths(model_type))
+    return f"{model_runtime(model_type)}:{files}"
+
+def load_light_keras():
+    model_path = getattr(settings, 'MODEL_PATH_LIGHT', None)
+    if not model_path:
+        raise RuntimeError("MODEL_PATH_LIGHT not configured in settings.")
+    from tensorflow.keras.models import load_model  # type: ignore  # lazy: TF startup is slow
+    return load_model(str(model_path))
+
+def get_ad_model_light():
+    global _ad_model_light
+    if _ad_model_light is None:
+        with _load_lock:
+            if _ad_model_light is None:
+                model = _runtime_loader(LIGHT_RUNTIMES, get_light_runtime())()
+                if get_light_runtime() == 'keras':
+                    model = compile_for_inference(model)
+                _ad_model_light = model
+                logger.info("Light skin model loaded (%s)", get_light_runtime())
+    return _ad_model_light
+
+def get_ad_model_dark():
+    global _ad_model_dark
+    if _ad_model_dark is None:
+        with _load_lock:
+            if _ad_model_dark is None:
+                _ad_model_dark = _load_ad_model_dark()
+    return _ad_model_dark
+
+def load_dark_joblib():
+    model_path = getattr(settings, 'MODEL_PATH_DARK', None)
+    if not model_path:
+        raise RuntimeError("MODEL_PATH_DARK not configured in settings.")
+
+    # Load the deployable model (joblib serialized; unpickling pulls in TensorFlow)
+    import joblib
+    return joblib.load(str(model_path))
+
+def _load_ad_model_dark():
+    _ad_model_dark = _runtime_loader(DARK_RUNTIMES, get_dark_runtime())()
+    logger.info("Dark skin model (deployable) loaded (%s)", get_dark_runtime())
+    if get_dark_runtime() == 'joblib' and hasattr(_ad_model_dark, 'feature_extractor'):
+        try:
+            _ad_model_dark.feature_extractor = compile_for_inference(_ad_model_dark.feature_extractor)
+        except Exception as e:
+            logger.warning("Could not compile the dark feature_extractor, using Model.predict: %s", e)
+    
+    # CRITICAL FIX: Inject in-memory entry points plus a robust predict_single_image wrapper
+    if hasattr(_ad_model_dark, 'predict_single_image') or hasattr(_ad_model_dark, 'feature_extractor'):
+        model = _ad_model_dark
+        original_predict = getattr(_ad_model_dark, 'predict_single_image', None)
+
+        def predict_arrays(batch, use_hybrid=True):
+            """
+            Array-input entry point: score a preprocessed float32 batch of shape
+            (N, 224, 224, 3) (or a single (224, 224, 3) image) without touching disk.
+            Returns one predict_single_image-style dict per image.
+            """
+            batch = np.asarray(batch, dtype='float32')
+            if batch.ndim == 3:
+                batch = np.expand_dims(batch, axis=0)
+
+            # Hybrid path if model exposes feature_extractor + classifier
+            if use_hybrid and hasattr(model, 'feature_extractor') and hasattr(model, 'classifier'):
+                return _dark_hybrid_results(model, _dark_hybrid_probabilities(model, batch))
+
+            # Original model path
+            if hasattr(model, 'original_model'):
+                preds = model.original_model.predict(batch, verbose=0)
+                return [
+                    _dark_raw_result(float(np.ravel(p)[0]), "AD" if float(np.ravel(p)[0]) > 0.5 else "Not AD", "Original",
+                                     getattr(model, 'optimal_threshold', 0.3 if use_hybrid else 0.5))
+                    for p in preds
+                ]
+
+            raise AttributeError("Deployable model has neither feature_extractor/classifier nor original_model")
+
+        def predict_array(img_array, use_hybrid=True):
+            """Array-input entry point for one preprocessed (224, 224, 3) float32 image."""
+            return predict_arrays(np.expand_dims(np.asarray(img_array, dtype='float32'), axis=0), use_hybrid=use_hybrid)[0]
+
+        def fixed_predict_single_image(image_path, use_hybrid=True):
+            try:
+                # Preprocess exactly like Colab / app expectations, then score in memory
+                img_array = load_image_array(image_path)
+                try:
+                    return predict_array(img_array, use_hybrid=use_hybrid)
+                except Exception:
+                    pass
+
+                # fallback: call original_predict and interpret dict / numeric results
+                try:
+                    raw = original_predict(image_path, use_hybrid=use_hybrid)
+                    if isinstance(raw, dict):
+                        prob = float(raw.get('probability', raw.get('prob', 0.5)))
+                        prediction = raw.get('prediction', 'Error')
+                        model_used = raw.get('model_used', 'Original')
+                    elif hasattr(raw, '__float__'):
+                        prob = float(raw)
+                        prediction = "AD" if prob > 0.5 else "Not AD"
+                        model_used = "Original"
+                    else:
+                        prob = 0.5
+                        prediction = "Error"
+                        model_used = "Original"
+                except Exception:
+                    prob = 0.5
+                    prediction = "Error"
+                    model_used = "Error"
+
+                return _dark_raw_result(prob, prediction, model_used,
+                                        getattr(model, 'optimal_threshold', (0.3 if use_hybrid else 0.5)))
+
+            except Exception as e:
+                return {
+                    'prediction': 'Error',
+                    'probability': 0.5,
+                    'confidence': 'Unknown',
+                    'model_used': 'Error',
+                    'error': str(e),
+                    'success': False
+                }
+
+        # Attach the array entry points and replace the path-based method with our fixed version
+        try:
+            _ad_model_dark.predict_arrays = predict_arrays
+            _ad_model_dark.predict_array = predict_array
+            if original_predict is not None:
+                _ad_model_dark.predict_single_image = fixed_predict_single_image
+            logger.debug("Added in-memory predict_array/predict_arrays and fixed predict_single_image")
+        except Exception as e_set:
+            logger.warning("Failed to replace predict_single_image: %s", e_set)
+        
+    return _ad_model_dark
+
+# ============================================================
+# Shared-backbone ensemble (both models in one call)
+# ============================================================
+_shared_light_head = None
+_shared_backbone_checked = False
+
+def _weights_equal(a, b):
+    wa, wb = a.get_weights(), b.get_weights()
+    return len(wa) == len(wb) and all(x.shape == y.shape and np.array_equal(x, y) for x, y in zip(wa, wb))
+
+def _find_shared_light_head(light_model, dark_model):
+    """
+    The light model is Sequential([MobileNetV2, GlobalAveragePooling2D, Dropout, Dense]).
+    If the dark model's feature_extractor holds exactly the light backbone's weights, the
+    light head layers can run on its output; returns those layers, or None. The light
+    backbone's last 20 layers were fine-tuned, so this only holds for matching exports.
+    """
+    extractor = getattr(dark_model, 'feature_extractor', None)
+    layers = list(getattr(light_model, 'layers', None) or [])
+    if extractor is None or not hasattr(dark_model, 'classifier') or len(layers) < 2:
+        return None
+    try:
+        if not _weights_equal(layers[0], extractor):
+            return None
+    except Exception:
+        return None
+    return layers[1:]
+
+def get_shared_light_head():
+    """Light head layers usable on dark feature_extractor output (decided once), or None."""
+    global _shared_light_head, _shared_backbone_checked
+    if not _shared_backbone_checked:
+        light_model, dark_model = get_ad_model_light(), get_ad_model_dark()
+        with _load_lock:
+            if not _shared_backbone_checked:
+                _shared_light_head = _find_shared_light_head(light_model, dark_model)
+                _shared_backbone_checked = True
+                logger.info("Shared backbone for light+dark: %s", 'yes' if _shared_light_head else 'no')
+    return _shared_light_head
+
+def _apply_light_head(head, features):
+    """Run the light head on backbone features; pooled (N, C) features skip the pooling layer."""
+    x = features
+    if x.ndim == 2:
+        pooling = [i for i, layer in enumerate(head) if 'Pooling' in type(layer).__name__]
+        head = head[pooling[0] + 1:] if pooling else head
+    for layer in head:
+        x = layer(x, training=False)
+    return [float(p) for p in np.ravel(np.asarray(x))]
+
+def predict_both(batch):
+    """
+    Light and dark results for a preprocessed (N, 224, 224, 3) batch in one call.
+    When the backbones match (see get_shared_light_head) the features are computed once
+    and fanned out to both heads; otherwise each model runs on the same tensor.
+    Returns one {"light": prob, "dark": dict, "shared_backbone": bool} per image.
+    """
+    global _shared_light_head
+    batch = np.asarray(batch, dtype='float32')
+    light_model, dark_model = get_ad_model_light(), get_ad_model_dark()
+    head = get_shared_light_head()
+    if head is not None:
+        try:
+            features = dark_model.feature_extractor.predict(batch, verbose=0)
+            light_probs = _apply_light_head(head, features)
+            dark_results = _dark_hybrid_results(dark_model, _dark_classify(dark_model, features))
+            return [{"light": lp, "dark": dr, "shared_backbone": True}
+                    for lp, dr in zip(light_probs, dark_results)]
+        except Exception as e:
+            logger.warning("Shared-backbone pass failed, running both models separately: %s", e)
+            _shared_light_head = None
+    light_probs = [float(p[0]) for p in light_model.predict(batch, verbose=0)]
+    dark_results = dark_model.predict_arrays(batch, use_hybrid=True)
+    return [{"light": lp, "dark": dr, "shared_backbone": False}
+            for lp, dr in zip(light_probs, dark_results)]
+
+# ============================================================
+# MODEL VERIFICATION FUNCTION
+# ============================================================
+def verify_models():
+    """Verify that models are loaded correctly and working"""
+    try:
+        # Check if files exist
+        light_path = getattr(settings, 'MODEL_PATH_LIGHT', None)
+        dark_path = getattr(settings, 'MODEL_PATH_DARK', None)
+
+        logger.info("Light model path: %s (exists: %s)", light_path, bool(light_path and os.path.exists(light_path)))
+        logger.info("Dark model path: %s (exists: %s)", dark_path, bool(dark_path and os.path.exists(dark_path)))
+
+        # Check which dark model we're using
+        if dark_path and 'deployable' in str(dark_path):
+            logger.info("Dark model is the deployable model")
+        elif dark_path and 'hybrid' in str(dark_path):
+            logger.error("Dark model is hybrid_skin_model_final.pkl instead of the deployable model")
+        else:
+            logger.warning("Unknown dark model file: %s", dark_path)
+
+        # Test model loading
+        light_model = get_ad_model_light()
+        dark_model = get_ad_model_dark()
+
+        logger.info("Light model type: %s, dark model type: %s", type(light_model).__name__, type(dark_model).__name__)
+        
+        # Test prediction with dummy data
+        dummy_img = np.random.random((224, 224, 3)).astype('float32')
+        
+        # Test light model
+        light_input = np.expand_dims(dummy_img, 0)
+        light_pred = light_model.predict(light_input, verbose=0)
+        logger.info("Light model test prediction: %.4f", light_pred[0][0])
+
+        return True
+
+    except Exception:
+        logger.exception("Model verification failed")
+        return False
+
+
+def warmup_models():
+    """Load both models and run a dummy prediction so the first request does not pay for it."""
+    logger.info("Initializing skin analysis models")
+    ok = verify_models()
+    if ok:
+        for model in (get_ad_model_light(), getattr(get_ad_model_dark(), 'feature_extractor', None)):
+            if isinstance(model, CompiledKerasModel):
+                model.warmup()
+    return ok
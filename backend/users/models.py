@@ -3,6 +3,8 @@ from django.contrib.auth.models import User
 from django.db.models.signals import post_save
 from django.dispatch import receiver
 from django.contrib.postgres.fields import JSONField
+from django.core.serializers.json import DjangoJSONEncoder
+from django.utils import timezone
 
 class Profile(models.Model):
     ROLE_CHOICES = (
@@ -47,19 +49,176 @@ class MessageReply(models.Model):
 class AdScanImage(models.Model):
     user = models.ForeignKey(User, on_delete=models.CASCADE)
     image = models.ImageField(upload_to='adscan_images/')
+    thumbnail = models.ImageField(upload_to='adscan_images/thumbs/', blank=True, null=True)  # see users.thumbnails
     uploaded_at = models.DateTimeField(auto_now_add=True)
 
+RECOMMENDATION_META_KEYS = ("recommendation", "recommendation_pending", "follow_up")
+
+def summarize_scan_messages(messages):
+    """
+    Scan summary derived from the "meta" dicts in Chat.messages: the first model_used and
+    risk_estimate, the total of meta.images and how many messages carry a recommendation flag.
+    """
+    summary = {"model_used": None, "risk_estimate": None, "images_count": 0, "recommendations_count": 0}
+    for m in messages or []:
+        meta = m.get("meta") if isinstance(m, dict) else None
+        if not meta or not isinstance(meta, dict):
+            continue
+        if summary["model_used"] is None and meta.get("model_used"):
+            summary["model_used"] = str(meta["model_used"])[:100]
+        if summary["risk_estimate"] is None and meta.get("risk_estimate") is not None:
+            try:
+                summary["risk_estimate"] = float(meta["risk_estimate"])
+            except (TypeError, ValueError):
+                pass
+        try:
+            summary["images_count"] += max(int(meta.get("images", 0) or 0), 0)
+        except (TypeError, ValueError):
+            pass
+        if any(meta.get(key) for key in RECOMMENDATION_META_KEYS):
+            summary["recommendations_count"] += 1
+    return summary
+
 class Chat(models.Model):
+    PDF_STATUS_CHOICES = (
+        ('none', 'No report'),
+        ('pending', 'Pending'),
+        ('ready', 'Ready'),
+        ('failed', 'Failed'),
+    )
+
+    # denormalized from messages on every save (see summarize_scan_messages / backfill_chat_summaries)
+    SCAN_SUMMARY_FIELDS = ("model_used", "risk_estimate", "images_count", "recommendations_count", "summary_updated_at")
+
     user = models.ForeignKey(User, on_delete=models.CASCADE)
-    created_at = models.DateTimeField(auto_now_add=True)
+    created_at = models.DateTimeField(auto_now_add=True, db_index=True)
     updated_at = models.DateTimeField(auto_now=True)
     messages = models.JSONField(default=list)  # Store list of {sender, text}
     pdf_report = models.FileField(upload_to='chat_reports/', blank=True, null=True)  # PDF file
+    pdf_status = models.CharField(max_length=10, choices=PDF_STATUS_CHOICES, default='none')  # see PdfReportJob
+
+    # scan summary columns, so analytics can filter and aggregate without reading messages
+    model_used = models.CharField(max_length=100, blank=True, null=True, db_index=True)
+    risk_estimate = models.FloatField(blank=True, null=True)
+    images_count = models.PositiveIntegerField(default=0)
+    recommendations_count = models.PositiveIntegerField(default=0)
+    summary_updated_at = models.DateTimeField(blank=True, null=True)  # NULL = not backfilled yet
+
+    class Meta:
+        indexes = [
+            # backs the scan history cursor: WHERE user_id = ? ORDER BY created_at DESC, id DESC
+            models.Index(fields=["user", "-created_at", "-id"], name="chat_user_created_idx"),
+        ]
 
     def __str__(self):
         return f"Chat {self.id} by {self.user.username}"
 
+    def apply_scan_summary(self):
+        for field, value in summarize_scan_messages(self.messages).items():
+            setattr(self, field, value)
+        self.summary_updated_at = timezone.now()
+
+    def save(self, *args, **kwargs):
+        # only when messages are written: a narrow save (e.g. pdf_status) must not overwrite the
+        # summary columns from a possibly stale copy of messages
+        update_fields = kwargs.get("update_fields")
+        if update_fields is None or "messages" in update_fields:
+            self.apply_scan_summary()
+            if update_fields is not None:
+                kwargs["update_fields"] = set(update_fields) | set(self.SCAN_SUMMARY_FIELDS)
+        super().save(*args, **kwargs)
+
 class ChatImage(models.Model):
     chat = models.ForeignKey(Chat, related_name="images", on_delete=models.CASCADE)
     file = models.ImageField(upload_to="chat_images/")
     uploaded_at = models.DateTimeField(auto_now_add=True)
+
+class PdfReportJob(models.Model):
+    """
+    A queued PDF report for a Chat. The request that saves the scan stores the
+    generate_pdf_report arguments here and returns; a background worker (see
+    users.pdf_reports) renders the PDF, attaches it to the chat and flips
+    Chat.pdf_status to 'ready' or 'failed'.
+    """
+    STATUS_CHOICES = (
+        ('pending', 'Pending'),
+        ('running', 'Running'),
+        ('done', 'Done'),
+        ('failed', 'Failed'),
+    )
+    chat = models.ForeignKey(Chat, related_name="pdf_jobs", on_delete=models.CASCADE)
+    payload = models.JSONField(default=dict, encoder=DjangoJSONEncoder)  # report, symptom_answers, scan_results, assessment
+    filename = models.CharField(max_length=255)
+    status = models.CharField(max_length=10, choices=STATUS_CHOICES, default='pending', db_index=True)
+    attempts = models.PositiveSmallIntegerField(default=0)
+    error = models.TextField(blank=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+    started_at = models.DateTimeField(blank=True, null=True)
+    finished_at = models.DateTimeField(blank=True, null=True)
+
+    def __str__(self):
+        return f"PDF job {self.id} for chat {self.chat_id} ({self.status})"
+
+class Prediction(models.Model):
+    """
+    One model's score for one AdScanImage. Upload requests write one row per image and model
+    (see users.prediction_records); `manage.py score_images` appends 'batch' rows. Rows are
+    never updated, so re-scoring after a retrain or threshold change keeps the history.
+    """
+    SOURCE_CHOICES = (
+        ('upload', 'Upload'),
+        ('batch', 'Batch re-score'),
+    )
+    image = models.ForeignKey(AdScanImage, related_name="predictions", on_delete=models.CASCADE)
+    model_type = models.CharField(max_length=10)  # 'light' or 'dark'
+    model_version = models.CharField(max_length=255)  # see model_registry.model_version
+    probability = models.FloatField()  # raw model output
+    threshold = models.FloatField()
+    label = models.CharField(max_length=10)  # 'ad' / 'not_ad'
+    is_ad = models.BooleanField()
+    source = models.CharField(max_length=10, choices=SOURCE_CHOICES, default='upload')
+    created_at = models.DateTimeField(auto_now_add=True)
+    latency_ms = models.FloatField(blank=True, null=True)  # wall time of the batched predict call that produced it
+
+    class Meta:
+        indexes = [
+            # latest prediction per image and model: WHERE image_id IN (...) ORDER BY created_at DESC
+            models.Index(fields=["image", "model_type", "-created_at"], name="prediction_image_model_idx"),
+            # analytics over a time window, per model
+            models.Index(fields=["model_type", "created_at"], name="prediction_model_created_idx"),
+        ]
+
+    def __str__(self):
+        return f"{self.model_type} {self.label} ({self.probability:.3f}) for image {self.image_id}"
+
+class OutboxEmail(models.Model):
+    """
+    An email waiting for (or done with) delivery by users.mail_outbox, which sends queued
+    rows in batches over one persistent SMTP connection and retries failures with backoff.
+    """
+    STATUS_CHOICES = (
+        ('pending', 'Pending'),
+        ('sending', 'Sending'),
+        ('sent', 'Sent'),
+        ('failed', 'Failed'),
+    )
+    subject = models.CharField(max_length=255)
+    body = models.TextField()
+    from_email = models.CharField(max_length=255, blank=True)  # '' = DEFAULT_FROM_EMAIL
+    to = models.JSONField(default=list)
+    status = models.CharField(max_length=10, choices=STATUS_CHOICES, default='pending')
+    attempts = models.PositiveSmallIntegerField(default=0)
+    error = models.TextField(blank=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+    next_attempt_at = models.DateTimeField(default=timezone.now)  # pushed back by each failed attempt
+    claimed_at = models.DateTimeField(blank=True, null=True)
+    sent_at = models.DateTimeField(blank=True, null=True)
+
+    class Meta:
+        indexes = [
+            # the sender's poll: WHERE status = 'pending' AND next_attempt_at <= now ORDER BY id
+            models.Index(fields=["status", "next_attempt_at"], name="outbox_due_idx"),
+        ]
+
+    def __str__(self):
+        return f"Email {self.id} to {', '.join(self.to)} ({self.status})"
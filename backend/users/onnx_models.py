@@ -0,0 +1,100 @@
+"""
+ONNX Runtime backend for the AD detection models (ADSCAN_LIGHT_RUNTIME / ADSCAN_DARK_RUNTIME = 'onnx').
+
+`manage.py export_onnx` writes:
+- MODEL_PATH_LIGHT_ONNX: the light Keras model,
+- MODEL_PATH_DARK_ONNX: the dark deployable model's feature_extractor (the CNN part),
+- MODEL_PATH_DARK_CLASSIFIER: its sklearn-style classifier and optimal_threshold, pickled on
+  their own so serving never unpickles the Keras sub-models.
+
+At runtime the CNN parts run in onnxruntime InferenceSessions (thread-safe, shared by all
+request threads, sized with ADSCAN_ONNX_INTRA_OP_THREADS / ADSCAN_ONNX_INTER_OP_THREADS) and
+the classifier is called natively. `manage.py onnx_parity` checks them against the originals.
+"""
+import numpy as np
+from django.conf import settings
+
+
+class OnnxModel:
+    """Keras-style predict() over an onnxruntime InferenceSession with a dynamic batch axis."""
+
+    def __init__(self, model_path, intra_op_threads=None, inter_op_threads=None):
+        import onnxruntime as ort  # type: ignore
+
+        options = ort.SessionOptions()
+        options.graph_optimization_level = ort.GraphOptimizationLevel.ORT_ENABLE_ALL
+        if intra_op_threads:
+            options.intra_op_num_threads = intra_op_threads
+        if inter_op_threads:
+            options.inter_op_num_threads = inter_op_threads
+        self.model_path = str(model_path)
+        self.session = ort.InferenceSession(self.model_path, sess_options=options,
+                                            providers=['CPUExecutionProvider'])
+        self.input_name = self.session.get_inputs()[0].name
+
+    def predict(self, batch, verbose=0):
+        batch = np.asarray(batch, dtype='float32')
+        if batch.ndim == 3:
+            batch = np.expand_dims(batch, axis=0)
+        return self.session.run(None, {self.input_name: batch})[0]
+
+
+class OnnxDarkModel:
+    """Deployable dark model with the feature_extractor in ONNX Runtime and the native classifier."""
+
+    def __init__(self, feature_extractor, classifier, optimal_threshold=None):
+        self.feature_extractor = feature_extractor
+        self.classifier = classifier
+        if optimal_threshold is not None:
+            self.optimal_threshold = optimal_threshold
+
+
+def _session_kwargs():
+    return {
+        'intra_op_threads': getattr(settings, 'ADSCAN_ONNX_INTRA_OP_THREADS', None),
+        'inter_op_threads': getattr(settings, 'ADSCAN_ONNX_INTER_OP_THREADS', None),
+    }
+
+
+def _required_setting(name):
+    value = getattr(settings, name, None)
+    if not value:
+        raise RuntimeError(f"{name} not configured in settings.")
+    return value
+
+
+def load_light_onnx():
+    return OnnxModel(_required_setting('MODEL_PATH_LIGHT_ONNX'), **_session_kwargs())
+
+
+def load_dark_onnx():
+    import joblib
+
+    head = joblib.load(str(_required_setting('MODEL_PATH_DARK_CLASSIFIER')))
+    return OnnxDarkModel(
+        OnnxModel(_required_setting('MODEL_PATH_DARK_ONNX'), **_session_kwargs()),
+        head['classifier'],
+        head.get('optimal_threshold'),
+    )
+
+
+# ============================================================
+# Export (needs tensorflow + tf2onnx, not needed for serving)
+# ============================================================
+def export_keras_model(keras_model, output_path, opset=13):
+    """Convert a Keras model taking (N, 224, 224, 3) float32 input to ONNX with a dynamic batch axis."""
+    import tensorflow as tf  # type: ignore
+    import tf2onnx  # type: ignore
+
+    spec = (tf.TensorSpec((None, 224, 224, 3), tf.float32, name='input'),)
+    tf2onnx.convert.from_keras(keras_model, input_signature=spec, opset=opset, output_path=str(output_path))
+
+
+def export_dark_classifier(deployable_model, output_path):
+    """Pickle the deployable model's classifier and threshold without its Keras sub-models."""
+    import joblib
+
+    joblib.dump({
+        'classifier': deployable_model.classifier,
+        'optimal_threshold': getattr(deployable_model, 'optimal_threshold', None),
+    }, str(output_path))
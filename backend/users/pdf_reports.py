@@ -0,0 +1,256 @@
+"""
+Background PDF report generation.
+
+save_adscan and universal_symptom_assessment call enqueue_pdf_report(), which stores a
+PdfReportJob, marks the chat's pdf_status 'pending' and returns without running reportlab.
+How the job is picked up depends on settings.ADSCAN_PDF_BACKEND:
+
+- 'thread' (default): a small in-process thread pool renders it once the request's
+                      transaction has committed.
+- 'queue':            jobs wait in the table until `manage.py process_pdf_jobs` drains them
+                      (from cron, or as a long-running worker with --loop).
+
+process_pdf_jobs also requeues jobs left 'running' by a worker that died mid-render.
+"""
+import io
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from django.conf import settings
+from django.core.files.base import ContentFile
+from django.db import close_old_connections, transaction
+from django.db.models import F
+from django.utils import timezone
+from reportlab.lib.pagesizes import letter
+from reportlab.lib.utils import ImageReader
+from reportlab.pdfgen import canvas
+
+from .models import AdScanImage, Chat, PdfReportJob
+from .prediction_records import latest_predictions
+from .timing import timed
+
+logger = logging.getLogger(__name__)
+
+
+@timed("pdf")
+def generate_pdf_report(report, symptom_answers, scan_results, user, assessment):
+    buffer = io.BytesIO()
+    c = canvas.Canvas(buffer, pagesize=letter)
+    width, height = letter
+    y_position = height - 50  # Starting Y position
+
+    # Helper to add text and handle page breaks
+    def add_text(text, font_size=12, bold=False, indent=0):
+        nonlocal y_position
+        if bold:
+            c.setFont("Helvetica-Bold", font_size)
+        else:
+            c.setFont("Helvetica", font_size)
+        lines = text.split('\n')
+        for line in lines:
+            if y_position < 100:  # New page if near bottom
+                c.showPage()
+                y_position = height - 50
+                c.setFont("Helvetica-Bold" if bold else "Helvetica", font_size)
+            c.drawString(100 + indent, y_position, line)
+            y_position -= font_size + 2
+
+    # Title
+    add_text(report.get('title', 'Assessment Report'), font_size=16, bold=True)
+    y_position -= 20
+
+    # Summary
+    add_text(f"Summary: {report.get('summary', 'N/A')}", font_size=12)
+    y_position -= 20
+
+    # Section 1: Scanned Images
+    add_text("1. Scanned Images", font_size=14, bold=True)
+    y_position -= 10
+    # one query for every embedded image instead of one per result
+    image_ids = [(res.get('uploaded') or {}).get('id') for res in scan_results]
+    ad_images = AdScanImage.objects.in_bulk([i for i in image_ids if i])
+    for i, res in enumerate(scan_results):
+        # Get image path from AdScanImage if available
+        img_path = None
+        ad_img = ad_images.get(image_ids[i]) if image_ids[i] else None
+        if ad_img is not None:
+            # the 256px thumbnail is plenty for a 100x100pt slot; fall back to the original
+            img_path = (ad_img.thumbnail or ad_img.image).path
+        if img_path:
+            try:
+                img = ImageReader(img_path)
+                c.drawImage(img, 100, y_position - 100, width=100, height=100)
+                y_position -= 120
+            except Exception as e:
+                add_text(f"Image {i+1}: Failed to embed ({str(e)})", indent=20)
+        else:
+            add_text(f"Image {i+1}: No image available", indent=20)
+        if y_position < 150:
+            c.showPage()
+            y_position = height - 50
+
+    # Section 2: Initial Scan Results
+    # the predictions recorded at upload time win over the results JSON sent by the client
+    add_text("2. Initial Scan Results", font_size=14, bold=True)
+    y_position -= 10
+    stored = latest_predictions(image_ids, user=user)
+    for i, res in enumerate(scan_results):
+        recorded = stored.get(image_ids[i]) if image_ids[i] else None
+        if recorded:
+            for p in recorded:
+                add_text(f"Image {i+1}: {p.label} (Probability: {p.probability:.2f}, threshold {p.threshold:.2f})",
+                         indent=20)
+                add_text(f"Model Used: {p.model_type} ({p.model_version})", indent=40)
+        else:
+            pred = res.get('prediction', {})
+            add_text(f"Image {i+1}: {pred.get('label', 'N/A')} (Score: {pred.get('score', 0):.2f})", indent=20)
+            add_text(f"Model Used: {pred.get('model_used', 'N/A')}", indent=40)
+        y_position -= 10
+        if y_position < 100:
+            c.showPage()
+            y_position = height - 50
+
+    # Section 3: Form Questions and Answers
+    add_text("3. Form Questions and Answers", font_size=14, bold=True)
+    y_position -= 10
+    for q, a in symptom_answers.items():
+        add_text(f"{q}: {a}", indent=20)
+        if y_position < 100:
+            c.showPage()
+            y_position = height - 50
+
+    # Section 4: Assessment Details
+    add_text("4. Assessment Details", font_size=14, bold=True)
+    y_position -= 10
+    add_text(f"Assessment Level: {report.get('assessment_level', 'N/A')}", indent=20)
+    add_text(f"Final Confidence: {report.get('final_confidence', 0):.2f}", indent=20)
+    add_text(f"Skin Tone Considered: {assessment.get('skin_tone_considered', 'N/A')}", indent=20)
+    add_text(f"Images Analyzed: {assessment.get('images_analyzed', 0)}", indent=20)
+    add_text(f"User Type: {assessment.get('user_type', 'N/A')}", indent=20)
+    if 'breakdown' in assessment:
+        add_text("Breakdown:", indent=20)
+        for key, value in assessment['breakdown'].items():
+            add_text(f"{key}: {value}", indent=40)
+    if 'key_findings' in report:
+        add_text("Key Findings:", indent=20)
+        for finding in report['key_findings']:
+            add_text(f"- {finding}", indent=40)
+    if 'recommendations' in report:
+        add_text("Recommendations:", indent=20)
+        for rec in report['recommendations']:
+            add_text(f"- {rec}", indent=40)
+    if 'next_steps' in report:
+        add_text("Next Steps:", indent=20)
+        for step in report['next_steps']:
+            add_text(f"- {step}", indent=40)
+    y_position -= 20
+
+    # Section 5: Final Result
+    add_text("5. Final Result", font_size=14, bold=True)
+    y_position -= 10
+    add_text(f"Overall Confidence: {assessment.get('final_confidence', 0):.2f}", indent=20)
+    add_text(f"Urgency: {report.get('urgency', 'N/A')}", indent=20)
+    add_text(f"Timestamp: {report.get('timestamp', 'N/A')}", indent=20)
+
+    c.save()
+    buffer.seek(0)
+    return buffer
+
+
+# ============================================================
+# Job queue
+# ============================================================
+_executor = None
+_executor_lock = threading.Lock()
+
+
+def get_pdf_backend():
+    return getattr(settings, 'ADSCAN_PDF_BACKEND', 'thread')
+
+
+def _get_executor():
+    global _executor
+    if _executor is None:
+        with _executor_lock:
+            if _executor is None:
+                _executor = ThreadPoolExecutor(max_workers=getattr(settings, 'ADSCAN_PDF_WORKERS', 2),
+                                               thread_name_prefix="pdf-report")
+    return _executor
+
+
+def enqueue_pdf_report(chat, filename, report, symptom_answers, scan_results, assessment):
+    """Queue a PDF for `chat` (already saved) and mark it pending; returns the PdfReportJob."""
+    job = PdfReportJob.objects.create(
+        chat=chat,
+        filename=filename,
+        payload={
+            "report": report,
+            "symptom_answers": symptom_answers,
+            "scan_results": scan_results,
+            "assessment": assessment,
+        },
+    )
+    Chat.objects.filter(id=chat.id).update(pdf_status='pending')
+    chat.pdf_status = 'pending'
+    if get_pdf_backend() == 'thread':
+        transaction.on_commit(lambda: _get_executor().submit(_run_in_thread, job.id))
+    return job
+
+
+def _run_in_thread(job_id):
+    close_old_connections()
+    try:
+        run_job(job_id)
+    except Exception:
+        logger.exception("PDF job %s crashed", job_id)
+    finally:
+        close_old_connections()
+
+
+def run_job(job_id):
+    """Claim a pending job, render and attach its PDF. Returns True if the PDF is ready."""
+    claimed = PdfReportJob.objects.filter(id=job_id, status='pending').update(
+        status='running', started_at=timezone.now(), attempts=F('attempts') + 1)
+    if not claimed:
+        return False  # another worker has it, or it already ran
+    job = PdfReportJob.objects.select_related('chat__user').get(id=job_id)
+    chat = job.chat
+    payload = job.payload or {}
+    try:
+        buffer = generate_pdf_report(
+            payload.get("report") or {},
+            payload.get("symptom_answers") or {},
+            payload.get("scan_results") or [],
+            chat.user,
+            payload.get("assessment") or {},
+        )
+        chat.pdf_report.save(job.filename, ContentFile(buffer.getvalue()), save=False)
+        # update() rather than chat.save(): only touch the PDF columns, never the messages
+        Chat.objects.filter(id=chat.id).update(pdf_report=chat.pdf_report.name, pdf_status='ready')
+        job.status, job.error = 'done', ''
+    except Exception as e:
+        logger.exception("PDF generation failed for chat %s", chat.id)
+        Chat.objects.filter(id=chat.id).update(pdf_status='failed')
+        job.status, job.error = 'failed', f"{type(e).__name__}: {e}"
+    job.finished_at = timezone.now()
+    job.save(update_fields=["status", "error", "finished_at"])
+    return job.status == 'done'
+
+
+def requeue_stale_jobs(older_than):
+    """Put jobs stuck in 'running' since before `older_than` back to pending; returns the count."""
+    stale = PdfReportJob.objects.filter(status='running', started_at__lt=older_than)
+    chat_ids = list(stale.values_list('chat_id', flat=True))
+    count = stale.update(status='pending')
+    Chat.objects.filter(id__in=chat_ids).update(pdf_status='pending')
+    return count
+
+
+def retry_failed_jobs(max_attempts):
+    """Requeue failed jobs that have been tried fewer than `max_attempts` times."""
+    failed = PdfReportJob.objects.filter(status='failed', attempts__lt=max_attempts)
+    chat_ids = list(failed.values_list('chat_id', flat=True))
+    count = failed.update(status='pending')
+    Chat.objects.filter(id__in=chat_ids).update(pdf_status='pending')
+    return count
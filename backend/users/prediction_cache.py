@@ -0,0 +1,155 @@
+"""
+Content-hash prediction cache.
+
+Raw model outputs (light: sigmoid probability, dark: predict_single_image-style dict) are
+stored in the Django cache alias settings.ADSCAN_PREDICTION_CACHE_ALIAS, keyed by the
+SHA-256 of the uploaded bytes plus the model identity (path and mtime of every file the
+model is loaded from, and the decision threshold), so retraining or replacing a model
+file invalidates old entries.
+
+Eviction and the size cap come from the cache backend: LocMemCache is LRU bounded by
+OPTIONS['MAX_ENTRIES'] (per process); point the alias at Redis with an allkeys-lru policy
+to share entries between gunicorn workers. Hit/miss counters live in the same cache.
+Derived outputs (e.g. test-time augmentation summaries, variant='tta6') are cached next to
+the raw outputs under their own variant key. `bypassed()` turns the cache off for one
+context (run_benchmarks uses it so every case reaches the model).
+"""
+import contextlib
+import contextvars
+import hashlib
+import logging
+import os
+
+from django.conf import settings
+from django.core.cache import caches
+
+from .model_registry import DARK_AD_THRESHOLD, LIGHT_AD_THRESHOLD, model_paths
+
+logger = logging.getLogger(__name__)
+
+KEY_PREFIX = "adscan:pred"
+HITS_KEY = f"{KEY_PREFIX}:hits"
+MISSES_KEY = f"{KEY_PREFIX}:misses"
+
+_bypass = contextvars.ContextVar('adscan_prediction_cache_bypass', default=False)
+
+
+def is_enabled():
+    return not _bypass.get() and getattr(settings, 'ADSCAN_PREDICTION_CACHE_ENABLED', True)
+
+
+@contextlib.contextmanager
+def bypassed():
+    """Lookups miss and nothing is stored inside the block (this thread/task only)."""
+    token = _bypass.set(True)
+    try:
+        yield
+    finally:
+        _bypass.reset(token)
+
+
+def get_cache():
+    return caches[getattr(settings, 'ADSCAN_PREDICTION_CACHE_ALIAS', 'adscan_predictions')]
+
+
+def image_digest(image_file):
+    """SHA-256 hex digest of an upload, file object or path; leaves file objects rewound."""
+    precomputed = getattr(image_file, 'sha256', None)  # hashed while streaming (uploads.py)
+    if precomputed:
+        return precomputed
+    digest = hashlib.sha256()
+    if hasattr(image_file, 'chunks'):
+        for chunk in image_file.chunks():
+            digest.update(chunk)
+    elif hasattr(image_file, 'read'):
+        image_file.seek(0)
+        for chunk in iter(lambda: image_file.read(64 * 1024), b''):
+            digest.update(chunk)
+    else:
+        with open(image_file, 'rb') as fh:
+            for chunk in iter(lambda: fh.read(64 * 1024), b''):
+                digest.update(chunk)
+    if hasattr(image_file, 'seek'):
+        image_file.seek(0)
+    return digest.hexdigest()
+
+
+def model_identity(model_type):
+    """Short fingerprint of the model files (path + mtime of each) and the threshold applied to them."""
+    threshold = DARK_AD_THRESHOLD if model_type == 'dark' else LIGHT_AD_THRESHOLD
+    files = []
+    for path in model_paths(model_type):
+        try:
+            mtime = os.path.getmtime(path) if path else 0
+        except OSError:
+            mtime = 0
+        files.append(f"{path}|{mtime}")
+    return hashlib.sha1(f"{'|'.join(files)}|{threshold}".encode()).hexdigest()[:16]
+
+
+def _key(model_type, identity, digest, variant=''):
+    kind = f"{model_type}.{variant}" if variant else model_type
+    return f"{KEY_PREFIX}:{kind}:{identity}:{digest}"
+
+
+def _count(key, delta):
+    if not delta:
+        return
+    cache = get_cache()
+    try:
+        cache.add(key, 0, timeout=None)
+        cache.incr(key, delta)
+    except ValueError:
+        # counter evicted between add and incr; start it again
+        cache.set(key, delta, timeout=None)
+
+
+def lookup(model_type, digests, variant=''):
+    """Return {digest: raw_output} for the digests that are cached for this model."""
+    if not is_enabled() or not digests:
+        return {}
+    if model_type == 'both':
+        # cached per model; an ensemble hit needs both halves
+        light, dark = lookup('light', digests, variant), lookup('dark', digests, variant)
+        return {d: {"light": light[d], "dark": dark[d], "shared_backbone": None} for d in light if d in dark}
+    identity = model_identity(model_type)
+    keys = {_key(model_type, identity, d, variant): d for d in digests}
+    try:
+        found = get_cache().get_many(list(keys))
+    except Exception:
+        logger.exception("Prediction cache lookup failed")
+        return {}
+    hits = {keys[k]: v for k, v in found.items()}
+    _count(HITS_KEY, len(hits))
+    _count(MISSES_KEY, len(set(digests)) - len(hits))
+    return hits
+
+
+def store(model_type, outputs, variant=''):
+    """Cache {digest: raw_output} for this model."""
+    if not is_enabled() or not outputs:
+        return
+    if model_type == 'both':
+        store('light', {d: v["light"] for d, v in outputs.items()}, variant)
+        store('dark', {d: v["dark"] for d, v in outputs.items()}, variant)
+        return
+    identity = model_identity(model_type)
+    timeout = getattr(settings, 'ADSCAN_PREDICTION_CACHE_TIMEOUT', 7 * 24 * 3600)
+    try:
+        get_cache().set_many({_key(model_type, identity, d, variant): v for d, v in outputs.items()},
+                             timeout=timeout)
+    except Exception:
+        logger.exception("Prediction cache store failed")
+
+
+def stats():
+    cache = get_cache()
+    hits = cache.get(HITS_KEY) or 0
+    misses = cache.get(MISSES_KEY) or 0
+    total = hits + misses
+    return {
+        "enabled": is_enabled(),
+        "hits": hits,
+        "misses": misses,
+        "hit_rate": (hits / total) if total else None,
+    }
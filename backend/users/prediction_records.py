@@ -0,0 +1,97 @@
+"""
+Server-side record of every upload prediction.
+
+AdScanImageUploadView calls record_predictions() once per request, after the batched
+forward pass: one Prediction row per image and model (two for model_type 'both'), written
+with a single bulk_create. The rows carry the model version, the probability the decision
+was taken on (the TTA mean when TTA ran), the threshold, the label and the latency of the
+predict call, so analytics, PDF reports and re-scoring read them instead of the results
+JSON the client sends back to save_adscan.
+"""
+import logging
+
+from .model_registry import DARK_AD_THRESHOLD, LIGHT_AD_THRESHOLD, model_version
+from .models import Prediction
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_THRESHOLDS = {'light': LIGHT_AD_THRESHOLD, 'dark': DARK_AD_THRESHOLD}
+
+
+def _per_model(model_type, prediction):
+    """(model, prediction dict) pairs of one API prediction ('both' nests light and dark)."""
+    if model_type == 'both':
+        return [(m, prediction[m]) for m in ('light', 'dark') if isinstance(prediction.get(m), dict)]
+    return [(model_type, prediction)]
+
+
+def prediction_rows(image_id, model_type, prediction, versions, latency_ms=None, source='upload'):
+    """
+    Unsaved Prediction rows for one image's API prediction dict. Error fallbacks
+    (success False, e.g. predict_ad_dark_fixed's 0.5 default) are not predictions and are skipped.
+    """
+    rows = []
+    for model, pred in _per_model(model_type, prediction):
+        if pred.get('success') is False or pred.get('raw_probability') is None:
+            continue
+        rows.append(Prediction(
+            image_id=image_id,
+            model_type=model,
+            model_version=versions[model],
+            probability=float(pred['raw_probability']),
+            threshold=float(pred.get('threshold_used', DEFAULT_THRESHOLDS[model])),
+            label=pred['label'],
+            is_ad=bool(pred['is_atopic_dermatitis']),
+            source=source,
+            latency_ms=latency_ms,
+        ))
+    return rows
+
+
+def _rows(model_type, scored, latency_ms):
+    versions = {m: model_version(m) for m in ('light', 'dark')}
+    return [row for image_id, prediction in scored
+            for row in prediction_rows(image_id, model_type, prediction, versions, latency_ms)]
+
+
+def record_predictions(model_type, scored, latency_ms=None):
+    """
+    bulk_create the rows for `scored`, a list of (AdScanImage id, prediction dict).
+    Best-effort: the upload response does not depend on it, so failures are only logged.
+    Returns the created rows.
+    """
+    try:
+        rows = _rows(model_type, scored, latency_ms)
+        return Prediction.objects.bulk_create(rows) if rows else []
+    except Exception:
+        logger.exception("Recording %d %s predictions failed", len(scored), model_type)
+        return []
+
+
+async def arecord_predictions(model_type, scored, latency_ms=None):
+    """record_predictions for async views (one abulk_create)."""
+    try:
+        rows = _rows(model_type, scored, latency_ms)
+        return await Prediction.objects.abulk_create(rows) if rows else []
+    except Exception:
+        logger.exception("Recording %d %s predictions failed", len(scored), model_type)
+        return []
+
+
+def latest_predictions(image_ids, user=None):
+    """
+    {image id: [latest Prediction per model]} for the given AdScanImage ids, optionally
+    limited to images owned by `user`. Uses prediction_image_model_idx.
+    """
+    qs = Prediction.objects.filter(image_id__in=[i for i in image_ids if i])
+    if user is not None:
+        qs = qs.filter(image__user=user)
+    latest = {}
+    seen = set()
+    for prediction in qs.order_by('image_id', 'model_type', '-created_at', '-id'):
+        key = (prediction.image_id, prediction.model_type)
+        if key in seen:
+            continue
+        seen.add(key)
+        latest.setdefault(prediction.image_id, []).append(prediction)
+    return latest
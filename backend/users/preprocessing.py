@@ -0,0 +1,233 @@
+"""
+Image preprocessing shared by every model path.
+
+The notebook pipeline is: decode, convert('RGB'), ImageOps.fit(224x224, BILINEAR),
+float32 / 255. `preprocess_batch` writes each image straight into one (N, 224, 224, 3)
+float32 buffer (reused per thread when asked) and spreads decoding over a thread pool;
+Pillow releases the GIL while decoding and resizing. Outputs are bit-identical to the
+notebook pipeline (see users/tests.py).
+
+settings.ADSCAN_PREPROCESS_DRAFT = True also lets the JPEG decoder downscale by 1/2..1/8
+(Image.draft) before the fit. That is much cheaper for multi-megapixel uploads but NOT
+bit-identical, since DCT-domain scaling differs from BILINEAR resampling, so it is off by
+default; check it with the parity commands before turning it on. JPEGs larger than
+ADSCAN_PREPROCESS_DRAFT_ABOVE_PIXELS are always draft-decoded.
+
+Pixel budget: `open_image` reads only the header and rejects images whose decoded size
+would exceed ADSCAN_MAX_IMAGE_PIXELS (after any draft downscale) with ImageTooLarge, so a
+small, highly compressed PNG cannot expand to hundreds of megapixels. Within
+`request_decode_budget()` the images being decoded at the same time are also held against
+ADSCAN_MAX_REQUEST_DECODE_BYTES: a decode charges its (drafted) size while it runs and
+releases it when done, waiting for other decodes of the request to finish when the cap is
+reached, so many ordinary photos in one upload fit while one request can never hold more
+than the cap in decoded pixels.
+"""
+import contextlib
+import contextvars
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+from django.conf import settings
+from PIL import Image, ImageOps
+
+TARGET_SIZE = (224, 224)  # (width, height), as passed to ImageOps.fit
+
+# Pillow keeps RGB/RGBA/L images in 4-byte pixels while decoding; used for the memory estimate
+DECODED_BYTES_PER_PIXEL = 4
+
+_pools = {}  # worker count -> executor
+_pool_lock = threading.Lock()
+_local = threading.local()
+_decode_budget = contextvars.ContextVar('adscan_decode_budget', default=None)
+
+
+class ImageTooLarge(ValueError):
+    """The image (or this request's images together) exceeds the decode budget."""
+
+
+# ============================================================
+# Pixel budget and per-request decode accounting
+# ============================================================
+class DecodeBudget:
+    """Decoded bytes held by one request's concurrent decodes, capped at `limit` (0 = no cap)."""
+
+    def __init__(self, limit):
+        self.limit = limit
+        self.in_use = 0
+        self.peak = 0
+        self._cond = threading.Condition()
+
+    def charge(self, nbytes):
+        """Reserve `nbytes`, waiting for running decodes to release theirs if needed."""
+        with self._cond:
+            if self.limit and nbytes > self.limit:
+                raise ImageTooLarge("This image is too large to process.")
+            while self.limit and self.in_use + nbytes > self.limit:
+                self._cond.wait()
+            self.in_use += nbytes
+            self.peak = max(self.peak, self.in_use)
+
+    def release(self, nbytes):
+        with self._cond:
+            self.in_use -= nbytes
+            self._cond.notify_all()
+
+
+@contextlib.contextmanager
+def request_decode_budget(limit=None):
+    """Account every image decoded inside the block; yields the DecodeBudget."""
+    if limit is None:
+        limit = getattr(settings, 'ADSCAN_MAX_REQUEST_DECODE_BYTES', 512 * 1024 * 1024)
+    budget = DecodeBudget(limit)
+    token = _decode_budget.set(budget)
+    try:
+        yield budget
+    finally:
+        _decode_budget.reset(token)
+
+
+@contextlib.contextmanager
+def decoding(img, budget=None):
+    """Hold an opened image's decoded size against the request budget while it is decoded."""
+    budget = budget if budget is not None else _decode_budget.get()
+    nbytes = img.size[0] * img.size[1] * DECODED_BYTES_PER_PIXEL
+    img = None  # the caller owns the image; this frame must not keep it alive
+    if budget is None:
+        yield
+        return
+    budget.charge(nbytes)
+    try:
+        yield
+    finally:
+        budget.release(nbytes)
+
+
+def _use_draft(draft, pixels):
+    if draft is not None:
+        return draft
+    if getattr(settings, 'ADSCAN_PREPROCESS_DRAFT', False):
+        return True
+    above = getattr(settings, 'ADSCAN_PREPROCESS_DRAFT_ABOVE_PIXELS', 16_000_000)
+    return bool(above) and pixels > above
+
+
+def open_image(image_file, target_size=TARGET_SIZE, draft=None):
+    """
+    Open an image without decoding it: read the header, pick a JPEG draft scale and check
+    the decoded size against ADSCAN_MAX_IMAGE_PIXELS (raising ImageTooLarge). Decode it
+    inside `decoding(img)` to account it against the current request_decode_budget.
+    """
+    if hasattr(image_file, 'seek'):
+        image_file.seek(0)
+    try:
+        img = Image.open(image_file)
+    except Image.DecompressionBombError as e:
+        raise ImageTooLarge(str(e)) from e
+    width, height = img.size
+    if _use_draft(draft, width * height):
+        img.draft('RGB', target_size)  # JPEG only; keeps at least target_size pixels per side
+    pixels = img.size[0] * img.size[1]
+    limit = getattr(settings, 'ADSCAN_MAX_IMAGE_PIXELS', 40_000_000)
+    if limit and pixels > limit:
+        if not hasattr(image_file, 'read'):
+            img.close()  # opened from a path; file objects stay open for the caller
+        raise ImageTooLarge(f"Image dimensions too large ({width}x{height}). "
+                            f"Max is {limit / 1e6:g} megapixels.")
+    return img
+
+
+def fit_image(img, target_size=TARGET_SIZE):
+    """Center-fit an opened image like Colab: RGB, ImageOps.fit, BILINEAR."""
+    return ImageOps.fit(img.convert('RGB'), target_size, Image.BILINEAR)
+
+
+def load_fitted_image(image_file, target_size=TARGET_SIZE, draft=None):
+    """Decode an upload (or path) within the pixel budget and center-fit it like Colab."""
+    img = open_image(image_file, target_size, draft)
+    with decoding(img):
+        return fit_image(img, target_size)
+
+
+def fitted_to_array(img, out=None):
+    """Scale a fitted RGB image to float32 in [0, 1], writing into `out` when given."""
+    pixels = np.asarray(img)
+    if out is None:
+        return pixels.astype('float32') / 255.0
+    np.divide(pixels, np.float32(255.0), out=out, dtype=np.float32)
+    return out
+
+
+def load_image_array(image_file, target_size=TARGET_SIZE, draft=None):
+    """Decode an upload and apply the Colab preprocessing (fit + scale to [0, 1])."""
+    return fitted_to_array(load_fitted_image(image_file, target_size, draft))
+
+
+def default_workers():
+    return getattr(settings, 'ADSCAN_PREPROCESS_WORKERS', 4)
+
+
+def _get_pool(workers):
+    pool = _pools.get(workers)
+    if pool is None:
+        with _pool_lock:
+            pool = _pools.get(workers)
+            if pool is None:
+                pool = _pools[workers] = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="preprocess")
+    return pool
+
+
+def _batch_buffer(n, target_size, reuse):
+    shape = (n, target_size[1], target_size[0], 3)
+    if not reuse:
+        return np.empty(shape, dtype='float32')
+    buffer = getattr(_local, 'buffer', None)
+    if buffer is None or buffer.shape[0] < n or buffer.shape[1:] != shape[1:]:
+        buffer = _local.buffer = np.empty(shape, dtype='float32')
+    return buffer[:n]
+
+
+def preprocess_batch(image_files, target_size=TARGET_SIZE, draft=None, reuse_buffer=False, workers=None):
+    """
+    Preprocess several images into one (N, H, W, 3) float32 batch.
+
+    Returns (batch, failures): `failures` maps the index of every image that could not be
+    decoded to its exception, and `batch` holds the remaining images in their original
+    order. With reuse_buffer=True the batch is a view of a per-thread buffer that is
+    overwritten by the next reuse_buffer call on the same thread. `workers` is the number of
+    decode threads (default ADSCAN_PREPROCESS_WORKERS).
+    """
+    image_files = list(image_files)
+    batch = _batch_buffer(len(image_files), target_size, reuse_buffer)
+    failures = {}
+
+    # headers are read (and the pixel limit checked) in the calling thread, so oversized
+    # images are refused before any worker starts decoding
+    budget = _decode_budget.get()  # pool threads do not inherit the request context
+    opened = {}
+    for index, image_file in enumerate(image_files):
+        try:
+            opened[index] = open_image(image_file, target_size, draft)
+        except Exception as e:
+            failures[index] = e
+
+    def fill(index):
+        try:
+            with decoding(opened[index], budget):
+                try:
+                    fitted_to_array(fit_image(opened[index], target_size), out=batch[index])
+                finally:
+                    opened[index] = None  # drop the decoded full-size image before releasing
+        except Exception as e:
+            failures[index] = e
+
+    workers = workers or default_workers()
+    if len(opened) > 1 and workers > 1:
+        list(_get_pool(workers).map(fill, list(opened)))
+    else:
+        for index in list(opened):
+            fill(index)
+
+    if failures:
+        batch = batch[[i for i in range(len(image_files)) if i not in failures]]
+    return batch, failures
@@ -3,6 +3,7 @@ from django.contrib.auth.models import User
 from django.contrib.auth.password_validation import validate_password
 from .models import ContactMessage, MessageReply, AdScanImage, Chat
 from django.conf import settings
+from .uploads import UploadedImageField, too_large_error
 
 class UserSerializer(serializers.ModelSerializer):
     password = serializers.CharField(write_only=True, required=False, validators=[validate_password])
@@ -57,9 +58,12 @@ class ContactMessageSerializer(serializers.ModelSerializer):
         fields = ['id', 'name', 'email', 'message', 'created_at', 'replies']
 
 class AdScanImageSerializer(serializers.ModelSerializer):
+    image = UploadedImageField()
+
     class Meta:
         model = AdScanImage
-        fields = ['id', 'image', 'uploaded_at']
+        fields = ['id', 'image', 'thumbnail', 'uploaded_at']
+        read_only_fields = ['thumbnail']
 
 class AdScanSerializer(serializers.Serializer):
     """
@@ -68,15 +72,17 @@ class AdScanSerializer(serializers.Serializer):
     Validations:
     - file type limited to jpeg/jpg/png
     - configurable max size via settings.ADSCAN_MAX_UPLOAD_BYTES (defaults to 5 MB)
+
+    Files parsed by uploads.AdScanUploadHandler were already size- and signature-checked
+    while streaming; their verdict is reported by UploadedImageField.
     """
-    image = serializers.ImageField()
+    image = UploadedImageField()
 
     def validate_image(self, value):
         # max size (bytes)
         max_bytes = getattr(settings, 'ADSCAN_MAX_UPLOAD_BYTES', 5 * 1024 * 1024)
         if value.size > max_bytes:
-            mb = max_bytes // (1024 * 1024)
-            raise serializers.ValidationError(f'Image too large. Max size is {mb} MB.')
+            raise serializers.ValidationError(too_large_error())
 
         # content type check (some file storages may not set content_type)
         content_type = getattr(value, 'content_type', None)
@@ -91,4 +97,52 @@ class AdScanSerializer(serializers.Serializer):
 class ChatSerializer(serializers.ModelSerializer):
     class Meta:
         model = Chat
-        fields = ['id', 'messages', 'pdf_report', 'created_at']
+        fields = ['id', 'messages', 'pdf_report', 'pdf_status', 'created_at']
+        read_only_fields = ['pdf_status']
+
+class ScanHistorySerializer(serializers.ModelSerializer):
+    """
+    Summary row for the scan history list. Reads the denormalized scan summary
+    columns instead of the messages JSON; pass `fields` to restrict the output
+    (messages are only included when asked for explicitly).
+    """
+    has_pdf = serializers.SerializerMethodField()
+
+    DEFAULT_FIELDS = ['id', 'created_at', 'model_used', 'risk_estimate', 'images_count',
+                      'recommendations_count', 'has_pdf', 'pdf_report', 'pdf_status']
+    # model columns each output field reads, used to build the .only() projection
+    FIELD_COLUMNS = {'has_pdf': ['pdf_report']}
+
+    class Meta:
+        model = Chat
+        fields = ['id', 'created_at', 'model_used', 'risk_estimate', 'images_count',
+                  'recommendations_count', 'has_pdf', 'pdf_report', 'pdf_status', 'messages']
+
+    def __init__(self, *args, fields=None, **kwargs):
+        super().__init__(*args, **kwargs)
+        keep = set(fields or self.DEFAULT_FIELDS)
+        for name in set(self.fields) - keep:
+            self.fields.pop(name)
+
+    def get_has_pdf(self, obj):
+        return bool(obj.pdf_report)
+
+    @classmethod
+    def parse_fields(cls, raw):
+        """Split a comma-separated `fields` query param; raises ValidationError on unknown names."""
+        if not raw:
+            return list(cls.DEFAULT_FIELDS)
+        requested = [f.strip() for f in raw.split(',') if f.strip()]
+        unknown = sorted(set(requested) - set(cls.Meta.fields))
+        if unknown:
+            raise serializers.ValidationError({"fields": f"Unknown field(s): {', '.join(unknown)}"})
+        if 'id' not in requested:
+            requested.insert(0, 'id')
+        return requested
+
+    @classmethod
+    def columns_for(cls, fields):
+        columns = {'id', 'created_at'}  # always needed for the cursor
+        for name in fields:
+            columns.update(cls.FIELD_COLUMNS.get(name, [name]))
+        return sorted(columns)
@@ -1,18 +1,16 @@
 from django_rest_passwordreset.signals import reset_password_token_created
-from django.core.mail import send_mail
-from django.conf import settings
 from django.db.models.signals import post_save
 from django.dispatch import receiver
 from django.contrib.auth.models import User
+from .mail_outbox import enqueue_email
 from .models import Profile
 
 
 def password_reset_token_created(sender, instance, reset_password_token, *args, **kwargs):
-    send_mail(
+    enqueue_email(
         "Password Reset",
         f"Use this token to reset your password: {reset_password_token.key}",
-        settings.DEFAULT_FROM_EMAIL,
-        [reset_password_token.user.email]
+        [reset_password_token.user.email],
     )
 
 
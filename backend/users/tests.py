@@ -1,3 +1,1458 @@
-from django.test import TestCase
+import asyncio
+import contextlib
+import hashlib
+import importlib
+import importlib.util
+import io
+import json
+import os
+import smtplib
+import socketserver
+import struct
+import sys
+import tempfile
+import threading
+import time
+import zlib
+from concurrent.futures import ThreadPoolExecutor
+from datetime import timedelta
+from types import SimpleNamespace
+from unittest import mock, skipUnless
+
+import numpy as np
+from asgiref.sync import sync_to_async
+from django.contrib.auth.models import User
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.mail import get_connection
+from django.http import HttpResponse
+from django.http.multipartparser import MultiPartParser
+from django.test import RequestFactory, SimpleTestCase, TestCase, override_settings
+from django.test.client import BOUNDARY, MULTIPART_CONTENT, encode_multipart
+from django.utils import timezone
+from PIL import Image, ImageOps
+from rest_framework.test import APIClient
+from rest_framework_simplejwt.tokens import AccessToken
+
+from . import (
+    async_views, bulk_scoring, inference_service, model_registry, onnx_models, pdf_reports, prediction_cache,
+    tflite_light, views,
+)
+from .async_views import InferenceGate, Overloaded
+from .benchmarks import compare_reports, run_suite, summarize, synthetic_image
+from .mail_outbox import deliver, is_permanent, retry_delay
+from .model_registry import _dark_hybrid_probabilities
+from .models import AdScanImage, Chat, OutboxEmail, PdfReportJob, Prediction
+from .prediction_records import prediction_rows
+from .preprocessing import ImageTooLarge, load_image_array, open_image, preprocess_batch, request_decode_budget
+from .serializers import AdScanImageSerializer, AdScanSerializer
+from .thumbnails import render_thumbnail
+from .timing import STAGE_SECONDS, ServerTimingMiddleware, metrics_view, span
+from .tracing import RequestTraceMiddleware, trace, trace_enabled
+from .tta import augmented_batch, near_threshold
+from .uploads import INVALID_TYPE_ERROR, AdScanUploadHandler, ScannedUpload
+
+
+def _reference_array(data):
+    """The notebook pipeline, kept verbatim: decode, RGB, fit BILINEAR, float32 / 255."""
+    img = Image.open(io.BytesIO(data)).convert('RGB')
+    img = ImageOps.fit(img, (224, 224), Image.BILINEAR)
+    return np.array(img).astype('float32') / 255.0
+
+def _encoded(size, fmt='JPEG', mode='RGB', seed=0):
+    rng = np.random.default_rng(seed)
+    channels = {'RGB': 3, 'RGBA': 4, 'L': 1}[mode]
+    pixels = rng.integers(0, 256, size=(size[1], size[0], channels), dtype=np.uint8)
+    img = Image.fromarray(pixels.squeeze(-1) if channels == 1 else pixels, mode)
+    buf = io.BytesIO()
+    img.save(buf, fmt)
+    return buf.getvalue()
+
+class PreprocessingTests(SimpleTestCase):
+    CASES = [
+        ((3000, 2000), 'JPEG', 'RGB'),
+        ((640, 480), 'JPEG', 'L'),
+        ((224, 224), 'PNG', 'RGB'),
+        ((300, 900), 'PNG', 'RGBA'),
+    ]
+
+    def test_single_image_matches_notebook_pipeline(self):
+        for i, (size, fmt, mode) in enumerate(self.CASES):
+            data = _encoded(size, fmt, mode, seed=i)
+            out = load_image_array(io.BytesIO(data), draft=False)
+            self.assertEqual(out.dtype, np.float32)
+            np.testing.assert_array_equal(out, _reference_array(data))
+
+    @override_settings(ADSCAN_PREPROCESS_WORKERS=4)
+    def test_threaded_batch_matches_notebook_pipeline(self):
+        datas = [_encoded(size, fmt, mode, seed=i) for i, (size, fmt, mode) in enumerate(self.CASES)]
+        for reuse in (False, True):
+            batch, failures = preprocess_batch([io.BytesIO(d) for d in datas], draft=False, reuse_buffer=reuse)
+            self.assertEqual(failures, {})
+            self.assertEqual(batch.shape, (len(datas), 224, 224, 3))
+            np.testing.assert_array_equal(batch, np.stack([_reference_array(d) for d in datas]))
+
+    def test_undecodable_images_are_reported_and_skipped(self):
+        good = _encoded((400, 300), seed=1)
+        batch, failures = preprocess_batch([io.BytesIO(b'not an image'), io.BytesIO(good)], draft=False)
+        self.assertEqual(list(failures), [0])
+        np.testing.assert_array_equal(batch, _reference_array(good)[None])
+
+    def test_draft_decode_is_close_but_opt_in(self):
+        data = _encoded((3000, 2000), seed=2)
+        with override_settings(ADSCAN_PREPROCESS_DRAFT=False):
+            np.testing.assert_array_equal(load_image_array(io.BytesIO(data)), _reference_array(data))
+        drafted = load_image_array(io.BytesIO(data), draft=True)
+        self.assertEqual(drafted.shape, (224, 224, 3))
+        self.assertLess(float(np.abs(drafted - _reference_array(data)).mean()), 0.05)
+
+
+def _solid(value):
+    buf = io.BytesIO()
+    Image.new('RGB', (64, 48), (value,) * 3).save(buf, 'PNG')
+    buf.seek(0)
+    return buf
+
+
+@override_settings(ADSCAN_PREDICTION_CACHE_ENABLED=False, ADSCAN_INFERENCE_BACKEND='inline')
+class BatchPredictionTests(SimpleTestCase):
+    VALUES = [51, None, 204, None, 102]  # None: undecodable upload
+
+    def _files(self):
+        return [_solid(v) if v is not None else io.BytesIO(b'not an image at all') for v in self.VALUES]
+
+    def _predict(self, name):
+        from . import views
+
+        def fake_run_batch(model_type, batch):
+            means = [float(a.mean()) for a in batch]
+            if model_type == 'light':
+                return means
+            return [{'probability': m, 'confidence': 'High', 'success': True} for m in means]
+
+        dark_model = SimpleNamespace(predict_arrays=lambda batch, use_hybrid=True: None)
+        with mock.patch.object(views, 'run_batch', side_effect=fake_run_batch), \
+                mock.patch.object(views, 'get_ad_model_dark', return_value=dark_model):
+            return getattr(views, name)(self._files(), tta='off')
+
+    def _assert_aligned(self, results):
+        self.assertEqual(len(results), len(self.VALUES))
+        for value, result in zip(self.VALUES, results):
+            if value is not None:
+                self.assertAlmostEqual(result['raw_probability'], value / 255, places=5)
+                self.assertTrue(result.get('success', True))
+
+    def test_light_batch_keeps_order_and_reports_failures(self):
+        results = self._predict('predict_ad_light_batch')
+        self._assert_aligned(results)
+        self.assertIsInstance(results[1], Exception)
+        self.assertIsInstance(results[3], Exception)
+        self.assertEqual([r['label'] for r in (results[0], results[2], results[4])], ['ad', 'not_ad', 'not_ad'])
+
+    def test_dark_batch_uses_the_single_image_fallback_inline(self):
+        with self.assertLogs('users.views', 'ERROR') as logs:
+            results = self._predict('predict_ad_dark_batch')
+        self.assertEqual(len(logs.records), 2)
+        self._assert_aligned(results)
+        for fallback in (results[1], results[3]):
+            self.assertEqual(
+                {k: fallback[k] for k in ('label', 'raw_probability', 'model_used', 'threshold_used', 'success')},
+                {'label': 'not_ad', 'raw_probability': 0.5, 'model_used': 'Dark Skin Optimized Model (Error Fallback)',
+                 'threshold_used': 0.3, 'success': False})
+            self.assertIn('error', fallback)
+        self.assertEqual([r['label'] for r in (results[0], results[2], results[4])], ['not_ad', 'ad', 'ad'])
+
+    @override_settings(ADSCAN_INFERENCE_BACKEND='pool')
+    def test_dark_batch_reports_failures_when_the_model_is_remote(self):
+        results = self._predict('predict_ad_dark_batch')
+        self._assert_aligned(results)
+        self.assertIsInstance(results[1], Exception)
+        self.assertIsInstance(results[3], Exception)
+
+
+@override_settings(
+    ADSCAN_PREDICTION_CACHE_ENABLED=True,
+    ADSCAN_PREDICTION_CACHE_ALIAS='test_predictions',
+    CACHES={'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'},
+            'test_predictions': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+                                 'LOCATION': 'adscan-test-predictions'}},
+)
+class PredictionCacheTests(SimpleTestCase):
+    def setUp(self):
+        prediction_cache.get_cache().clear()
+        tmp = tempfile.NamedTemporaryFile(suffix='.keras', delete=False)
+        tmp.close()
+        self.addCleanup(os.remove, tmp.name)
+        self.model_path = tmp.name
+        patcher = mock.patch.object(prediction_cache, 'model_paths', return_value=[tmp.name])
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.digest = prediction_cache.image_digest(io.BytesIO(_encoded((32, 32))))
+        prediction_cache.store('light', {self.digest: 0.42})
+
+    def _counts(self):
+        stats = prediction_cache.stats()
+        return stats['hits'], stats['misses']
+
+    def test_identical_bytes_hit(self):
+        same = prediction_cache.image_digest(io.BytesIO(_encoded((32, 32))))
+        other = prediction_cache.image_digest(io.BytesIO(_encoded((32, 32), seed=1)))
+        self.assertEqual(prediction_cache.lookup('light', [same, other]), {self.digest: 0.42})
+        self.assertEqual(self._counts(), (1, 1))
+        self.assertEqual(prediction_cache.lookup('dark', [same]), {})
+        self.assertEqual(self._counts(), (1, 2))
+
+    def test_changed_threshold_misses(self):
+        with mock.patch.object(prediction_cache, 'LIGHT_AD_THRESHOLD', 0.5):
+            self.assertEqual(prediction_cache.lookup('light', [self.digest]), {})
+        self.assertEqual(prediction_cache.lookup('light', [self.digest]), {self.digest: 0.42})
+        self.assertEqual(self._counts(), (1, 1))
+
+    def test_replaced_model_file_misses(self):
+        mtime = os.path.getmtime(self.model_path)
+        os.utime(self.model_path, (mtime + 60, mtime + 60))
+        self.assertEqual(prediction_cache.lookup('light', [self.digest]), {})
+        self.assertEqual(self._counts(), (0, 1))
+
+    def test_variants_are_cached_separately(self):
+        self.assertEqual(prediction_cache.lookup('light', [self.digest], variant='tta6'), {})
+        prediction_cache.store('light', {self.digest: {'mean': 0.4}}, variant='tta6')
+        self.assertEqual(prediction_cache.lookup('light', [self.digest], variant='tta6'), {self.digest: {'mean': 0.4}})
+        self.assertEqual(prediction_cache.lookup('light', [self.digest]), {self.digest: 0.42})
+
+    def test_bypassed_neither_reads_nor_writes(self):
+        with prediction_cache.bypassed():
+            self.assertEqual(prediction_cache.lookup('light', [self.digest]), {})
+            prediction_cache.store('dark', {self.digest: {'probability': 0.1}})
+        self.assertEqual(self._counts(), (0, 0))
+        self.assertEqual(prediction_cache.lookup('dark', [self.digest]), {})
+        self.assertEqual(prediction_cache.lookup('light', [self.digest]), {self.digest: 0.42})
+
+
+def _scan_messages(model_used, risk, images, recommendation=False):
+    meta = {"model_used": model_used, "risk_estimate": risk, "images": images}
+    if recommendation:
+        meta["recommendation"] = "See a dermatologist"
+    return [{"sender": "user", "text": "scan"}, {"sender": "ai", "text": "result", "meta": meta}]
+
+
+class ChatSummaryTests(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user('patient', 'patient@example.com', 'pw')
+        self.admin = User.objects.create_user('admin', 'admin@example.com', 'pw', is_staff=True)
+        self.admin.profile.role = 'admin'
+        self.admin.profile.save()
+
+    def test_save_fills_the_summary_columns(self):
+        chat = Chat.objects.create(user=self.user, messages=[
+            {"sender": "user", "text": "hi"},
+            {"sender": "ai", "text": "a", "meta": {"model_used": "light", "risk_estimate": "0.25", "images": 2}},
+            {"sender": "ai", "text": "b", "meta": {"model_used": "dark", "risk_estimate": 0.9, "images": "3",
+                                                  "follow_up": True}},
+            {"sender": "ai", "text": "c", "meta": {"images": "lots", "recommendation_pending": False}},
+        ])
+        chat.refresh_from_db()
+        self.assertEqual((chat.model_used, chat.risk_estimate, chat.images_count, chat.recommendations_count),
+                         ("light", 0.25, 5, 1))
+        self.assertIsNotNone(chat.summary_updated_at)
+
+        # a partial save still refreshes the summary columns
+        chat.messages = _scan_messages("both", 0.6, 1, recommendation=True)
+        chat.save(update_fields=["messages"])
+        chat.refresh_from_db()
+        self.assertEqual((chat.model_used, chat.risk_estimate, chat.images_count, chat.recommendations_count),
+                         ("both", 0.6, 1, 1))
+
+    def test_narrow_saves_leave_the_summary_alone(self):
+        chat = Chat.objects.create(user=self.user, messages=_scan_messages("light", 0.2, 2))
+        stale = Chat.objects.get(id=chat.id)
+        chat.messages = _scan_messages("dark", 0.8, 5)
+        chat.save()
+
+        # e.g. a status flip from an instance loaded before the messages changed
+        stale.pdf_status = 'ready'
+        with mock.patch('users.models.summarize_scan_messages') as summarize:
+            stale.save(update_fields=['pdf_status'])
+        summarize.assert_not_called()
+        chat.refresh_from_db()
+        self.assertEqual((chat.pdf_status, chat.model_used, chat.risk_estimate, chat.images_count),
+                         ('ready', 'dark', 0.8, 5))
+
+    def test_migration_backfills_chats_saved_before_the_columns(self):
+        from django.apps import apps
+        backfill = importlib.import_module('users.migrations.0014_backfill_chat_summaries')
+
+        chat = Chat.objects.create(user=self.user, messages=_scan_messages("dark", 0.7, 3, recommendation=True))
+        Chat.objects.filter(id=chat.id).update(model_used=None, risk_estimate=None, images_count=0,
+                                               recommendations_count=0, summary_updated_at=None)
+        backfill.backfill_chat_summaries(apps, None)
+        chat.refresh_from_db()
+        self.assertEqual((chat.model_used, chat.risk_estimate, chat.images_count, chat.recommendations_count),
+                         ("dark", 0.7, 3, 1))
+        self.assertIsNotNone(chat.summary_updated_at)
+
+    def test_admin_analytics_aggregates(self):
+        Chat.objects.create(user=self.user, messages=_scan_messages("light", 0.2, 2))
+        Chat.objects.create(user=self.user, messages=_scan_messages("light", 0.4, 1, recommendation=True))
+        Chat.objects.create(user=self.user, messages=_scan_messages("dark", 0.9, 3))
+        Chat.objects.create(user=self.user, messages=[{"sender": "user", "text": "no scan"}])
+        old = Chat.objects.create(user=self.user, messages=_scan_messages("dark", 0.5, 4))
+        Chat.objects.filter(id=old.id).update(created_at=timezone.now() - timedelta(days=45))
+
+        image = AdScanImage.objects.create(user=self.user, image='adscan_images/x.jpg')
+        for model_type, probability, is_ad, latency in [('light', 0.2, True, 10.0), ('light', 0.6, False, 30.0),
+                                                        ('dark', 0.7, True, 20.0)]:
+            Prediction.objects.create(image=image, model_type=model_type, model_version='v1', probability=probability,
+                                      threshold=0.3, label='ad' if is_ad else 'not_ad', is_ad=is_ad,
+                                      latency_ms=latency)
+
+        client = APIClient()
+        client.force_authenticate(self.admin)
+        response = client.get('/api/admin/analytics/')
+        self.assertEqual(response.status_code, 200)
+        data = response.data
+        self.assertEqual(data["totals"], {"users": 2, "scans": 5, "pdf_reports": 0, "images_analyzed": 10})
+        self.assertEqual(data["model_usage"], {"light": 2, "dark": 2})
+        self.assertAlmostEqual(data["average_risk_estimate"], (0.2 + 0.4 + 0.9 + 0.5) / 4)
+        self.assertEqual(sum(data["scans_per_day"].values()), 4)
+        self.assertEqual(len(data["recent_scans"]), 5)
+        self.assertEqual(data["predictions"]["light"]["count"], 2)
+        self.assertAlmostEqual(data["predictions"]["light"]["ad_rate"], 0.5)
+        self.assertAlmostEqual(data["predictions"]["light"]["avg_probability"], 0.4)
+        self.assertAlmostEqual(data["predictions"]["light"]["avg_latency_ms"], 20.0)
+        self.assertEqual((data["predictions"]["dark"]["count"], data["predictions"]["dark"]["ad_rate"]), (1, 1.0))
+
+        client.force_authenticate(self.user)
+        with self.assertLogs('django.request', 'WARNING'):
+            self.assertEqual(client.get('/api/admin/analytics/').status_code, 403)
+
+
+@override_settings(ADSCAN_PDF_BACKEND='queue')
+class PdfReportJobTests(TestCase):
+    def setUp(self):
+        media = tempfile.TemporaryDirectory()
+        self.addCleanup(media.cleanup)
+        media_root = override_settings(MEDIA_ROOT=media.name)
+        media_root.enable()
+        self.addCleanup(media_root.disable)
+        self.user = User.objects.create_user('patient', 'patient@example.com', 'pw')
+        self.chat = Chat.objects.create(user=self.user, messages=_scan_messages("light", 0.3, 1))
+        self.job = pdf_reports.enqueue_pdf_report(self.chat, 'report.pdf', {'title': 'Report'}, {}, [], {})
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+        self.fail_next = False
+        self.seen_status = []
+
+        def fake_generate(report, symptom_answers, scan_results, user, assessment):
+            self.seen_status.append(PdfReportJob.objects.get(id=self.job.id).status)
+            if self.fail_next:
+                raise RuntimeError("reportlab exploded")
+            return io.BytesIO(b'%PDF-1.4 fake')
+
+        patcher = mock.patch.object(pdf_reports, 'generate_pdf_report', side_effect=fake_generate)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def _state(self):
+        self.job.refresh_from_db()
+        self.chat.refresh_from_db()
+        return self.job.status, self.chat.pdf_status, self.job.attempts
+
+    def _download(self):
+        return self.client.get(f'/api/download-scan-pdf/{self.chat.id}/')
+
+    def test_pending_job_runs_to_done(self):
+        self.assertEqual(self._state(), ('pending', 'pending', 0))
+        response = self._download()
+        self.assertEqual((response.status_code, response.data['status']), (202, 'pending'))
+
+        self.assertTrue(pdf_reports.run_job(self.job.id))
+        self.assertEqual(self.seen_status, ['running'])
+        self.assertEqual(self._state(), ('done', 'ready', 1))
+        self.assertIsNotNone(self.job.finished_at)
+        response = self._download()
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(b''.join(response.streaming_content), b'%PDF-1.4 fake')
+
+        # a finished job is never claimed again
+        self.assertFalse(pdf_reports.run_job(self.job.id))
+        self.assertEqual(len(self.seen_status), 1)
+
+    def test_failed_job_is_retried(self):
+        self.fail_next = True
+        with self.assertLogs('users.pdf_reports', 'ERROR'):
+            self.assertFalse(pdf_reports.run_job(self.job.id))
+        self.assertEqual(self._state(), ('failed', 'failed', 1))
+        self.assertEqual(self.job.error, 'RuntimeError: reportlab exploded')
+        with self.assertLogs('django.request', 'ERROR'):
+            self.assertEqual(self._download().status_code, 500)
+
+        self.assertEqual(pdf_reports.retry_failed_jobs(max_attempts=1), 0)
+        self.assertEqual(pdf_reports.retry_failed_jobs(max_attempts=3), 1)
+        self.assertEqual(self._state(), ('pending', 'pending', 1))
+        self.fail_next = False
+        self.assertTrue(pdf_reports.run_job(self.job.id))
+        self.assertEqual(self._state(), ('done', 'ready', 2))
+
+    def test_stale_running_job_is_requeued(self):
+        started = timezone.now() - timedelta(minutes=30)
+        PdfReportJob.objects.filter(id=self.job.id).update(status='running', started_at=started, attempts=1)
+        self.assertFalse(pdf_reports.run_job(self.job.id))  # someone else holds it
+        self.assertEqual(pdf_reports.requeue_stale_jobs(started - timedelta(minutes=1)), 0)
+        self.assertEqual(pdf_reports.requeue_stale_jobs(timezone.now() - timedelta(minutes=10)), 1)
+        self.assertEqual(self._state(), ('pending', 'pending', 1))
+        self.assertTrue(pdf_reports.run_job(self.job.id))
+        self.assertEqual(self._state(), ('done', 'ready', 2))
+
+
+class ScanHistoryPaginationTests(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user('patient', 'patient@example.com', 'pw')
+        other = User.objects.create_user('other', 'other@example.com', 'pw')
+        Chat.objects.create(user=other, messages=_scan_messages("dark", 0.9, 1))
+        base = timezone.now() - timedelta(days=1)
+        # three chats share a timestamp, so the id tie-break decides their order
+        for i, minutes in enumerate([0, 1, 2, 2, 2, 5, 6]):
+            chat = Chat.objects.create(user=self.user, messages=_scan_messages("light", i / 10, i))
+            Chat.objects.filter(id=chat.id).update(created_at=base + timedelta(minutes=minutes))
+        self.expected = list(Chat.objects.filter(user=self.user).order_by('-created_at', '-id')
+                             .values_list('id', flat=True))
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+    def _get(self, url, **params):
+        response = self.client.get(url, params)
+        self.assertEqual(response.status_code, 200)
+        return response.data
+
+    def test_pages_are_stable_and_complete(self):
+        page = self._get('/api/scan-history/', page_size=3)
+        self.assertEqual(set(page), {'next', 'previous', 'results'})
+        self.assertIsNone(page['previous'])
+        first_ids = [row['id'] for row in page['results']]
+
+        # a scan saved while paging is newer than the cursor, so it does not shift later pages
+        Chat.objects.create(user=self.user, messages=_scan_messages("light", 0.5, 1))
+        seen = list(first_ids)
+        while page['next']:
+            page = self._get(page['next'])
+            self.assertLessEqual(len(page['results']), 3)
+            seen.extend(row['id'] for row in page['results'])
+        self.assertEqual(seen, self.expected)
+
+        second = self._get(self._get('/api/scan-history/', page_size=3)['next'])
+        back = self._get(second['previous'])
+        self.assertEqual([row['id'] for row in back['results']][-2:], first_ids[:2])
+
+    def test_default_and_requested_fields(self):
+        row = self._get('/api/scan-history/')['results'][0]
+        self.assertEqual(set(row), {'id', 'created_at', 'model_used', 'risk_estimate', 'images_count',
+                                    'recommendations_count', 'has_pdf', 'pdf_report', 'pdf_status'})
+        self.assertEqual((row['id'], row['model_used'], row['has_pdf']), (self.expected[0], 'light', False))
+
+        rows = self._get('/api/scan-history/', fields='id,messages')['results']
+        self.assertEqual(set(rows[0]), {'id', 'messages'})
+        self.assertEqual(len(rows), 7)
+        with self.assertLogs('django.request', 'WARNING'):
+            self.assertEqual(self.client.get('/api/scan-history/', {'fields': 'id,password'}).status_code, 400)
+
+
+class ModelIdentityTests(SimpleTestCase):
+    def test_dark_onnx_identity_covers_the_classifier(self):
+        folder = tempfile.TemporaryDirectory()
+        self.addCleanup(folder.cleanup)
+        onnx_path, head_path = (os.path.join(folder.name, name) for name in ('dark.onnx', 'dark_head.joblib'))
+        for path in (onnx_path, head_path):
+            open(path, 'wb').close()
+            os.utime(path, (1000, 1000))
+        with override_settings(ADSCAN_DARK_RUNTIME='onnx', MODEL_PATH_DARK_ONNX=onnx_path,
+                               MODEL_PATH_DARK_CLASSIFIER=head_path):
+            self.assertEqual(model_registry.model_paths('dark'), [onnx_path, head_path])
+            self.assertEqual(model_registry.model_version('dark'), 'onnx:dark.onnx@1000+dark_head.joblib@1000')
+            identity = prediction_cache.model_identity('dark')
+            os.utime(head_path, (2000, 2000))  # retrained classifier, same feature extractor
+            self.assertEqual(model_registry.model_version('dark'), 'onnx:dark.onnx@1000+dark_head.joblib@2000')
+            self.assertNotEqual(prediction_cache.model_identity('dark'), identity)
+
+    @override_settings(ADSCAN_LIGHT_RUNTIME='keras', MODEL_PATH_LIGHT='/nowhere/light.keras')
+    def test_single_file_version(self):
+        self.assertEqual(model_registry.model_version('light'), 'keras:light.keras@0')
+
+    def test_failed_warmup_is_logged_not_printed(self):
+        stdout = io.StringIO()
+        with mock.patch.object(model_registry, 'get_ad_model_light', side_effect=OSError('no model file')), \
+                contextlib.redirect_stdout(stdout), self.assertLogs('users.model_registry', 'INFO') as logs:
+            self.assertFalse(model_registry.warmup_models())
+        self.assertEqual(stdout.getvalue(), '')
+        self.assertEqual(logs.records[-1].levelname, 'ERROR')
+        self.assertIn('no model file', logs.output[-1])
+
+
+class InferenceServiceTests(SimpleTestCase):
+    def _service(self, workers, calls, max_batch_size=64):
+        def fake_score_batch(model_type, batch):
+            calls.append(len(batch))
+            time.sleep(0.05)
+            return [float(image[0, 0, 0]) for image in batch]
+
+        # threads instead of spawned processes, so the fake is what the pool runs
+        pool = mock.patch.object(inference_service, 'ProcessPoolExecutor',
+                                 lambda max_workers, **kwargs: ThreadPoolExecutor(max_workers))
+        score = mock.patch.object(inference_service, 'score_batch', fake_score_batch)
+        with pool:
+            service = inference_service.InferenceService(workers=workers, max_batch_size=max_batch_size,
+                                                         max_wait_ms=0)
+        score.start()
+        self.addCleanup(score.stop)
+        self.addCleanup(service.shutdown)
+        return service
+
+    def test_requests_wait_for_a_free_worker_and_are_coalesced(self):
+        calls = []
+        service = self._service(1, calls)
+        with ThreadPoolExecutor(8) as clients:
+            futures = list(clients.map(lambda _: service.submit('light', np.zeros((1, 2, 2, 3))), range(8)))
+            results = [f.result(timeout=5) for f in futures]
+        self.assertEqual(sum(calls), 8)
+        self.assertLess(len(calls), 8)
+        self.assertTrue(all(len(r) == 1 for r in results))
+
+    def test_batches_never_exceed_the_cap(self):
+        calls = []
+        service = self._service(1, calls, max_batch_size=4)
+
+        def images(first, n):
+            return np.arange(first, first + n, dtype='float32')[:, None, None, None] * np.ones((1, 2, 2, 3), 'float32')
+
+        with ThreadPoolExecutor(4) as clients:
+            futures = list(clients.map(lambda first: service.submit('light', images(first, 3)), (0, 10, 20, 30)))
+            big = service.submit('light', images(100, 10))
+            results = [f.result(timeout=5) for f in futures]
+        self.assertEqual(results, [[float(first + i) for i in range(3)] for first in (0, 10, 20, 30)])
+        self.assertEqual(big.result(timeout=5), [float(100 + i) for i in range(10)])
+        self.assertEqual(sum(calls), 22)
+        self.assertLessEqual(max(calls), 4)
+
+
+class EagerLoadingTests(SimpleTestCase):
+    def _is_server(self, argv, **environ):
+        from .apps import UsersConfig
+        with mock.patch.object(sys, 'argv', argv), mock.patch.dict(os.environ, environ, clear=True):
+            return UsersConfig._is_server_process()
+
+    def test_only_serving_processes_load_models(self):
+        self.assertTrue(self._is_server(['/venv/bin/gunicorn', 'backend.wsgi']))
+        self.assertTrue(self._is_server(['/venv/bin/uvicorn', 'backend.asgi:application']))
+        self.assertTrue(self._is_server(['manage.py', 'runserver'], RUN_MAIN='true'))
+        self.assertTrue(self._is_server(['manage.py', 'runserver', '--noreload']))
+        self.assertTrue(self._is_server(['manage.py', 'runserver_plus'], WERKZEUG_RUN_MAIN='true'))
+        self.assertFalse(self._is_server(['manage.py', 'runserver']))  # the autoreloader parent
+        for command in ('migrate', 'send_outbox', 'process_pdf_jobs', 'backfill_chat_summaries',
+                        'regenerate_thumbnails', 'export_onnx', 'run_inference_server', 'warmup_models'):
+            self.assertFalse(self._is_server(['manage.py', command]), command)
+        self.assertFalse(self._is_server(['/venv/bin/django-admin', 'send_outbox']))
+
+
+class BenchmarkHarnessTests(SimpleTestCase):
+    def test_synthetic_image_decodes_at_requested_size(self):
+        for fmt in ('JPEG', 'PNG'):
+            img = Image.open(io.BytesIO(synthetic_image((320, 240), fmt)))
+            self.assertEqual((img.format, img.size), (fmt, (320, 240)))
+
+    def test_summarize_percentiles_are_ordered(self):
+        stats = summarize([0.001 * i for i in range(1, 101)], batch_size=4)
+        self.assertLessEqual(stats['p50_ms'], stats['p95_ms'])
+        self.assertLessEqual(stats['p95_ms'], stats['p99_ms'])
+        self.assertAlmostEqual(stats['per_image_p50_ms'], stats['p50_ms'] / 4)
+
+    def test_compare_reports_flags_only_regressions(self):
+        def report(p50):
+            return {'results': [{'path': 'light', 'format': 'JPEG', 'resolution': '224x224',
+                                 'batch_size': 1, 'p50_ms': p50}]}
+        self.assertEqual(compare_reports(report(11.0), report(10.0), max_regression=0.2), [])
+        regressions = compare_reports(report(13.0), report(10.0), max_regression=0.2)
+        self.assertEqual([r['case'] for r in regressions], [('light', 'JPEG', '224x224', 1)])
+
+    def test_preprocess_suite_writes_a_json_report(self):
+        report = run_suite(['preprocess'], resolutions=[(64, 48)], formats=['JPEG'], batch_sizes=[2],
+                           iterations=2, warmup=0)
+        case, = json.loads(json.dumps(report))['results']
+        self.assertEqual((case['path'], case['batch_size']), ('preprocess', 2))
+        self.assertGreater(case['images_per_sec'], 0)
+        with prediction_cache.bypassed():
+            report = run_suite(['preprocess'], resolutions=[(64, 48)], formats=['JPEG'], batch_sizes=[1],
+                               iterations=1, warmup=0)
+        self.assertIs(report['meta']['prediction_cache'], False)
+        with self.assertRaises(ValueError):
+            run_suite(['nope'])
+
+    def test_failing_case_is_recorded_and_the_suite_continues(self):
+        from . import benchmarks
+
+        def failing_upload(files):
+            raise benchmarks.UploadFailed(500, {'error': 'model not loaded'})
+
+        paths = {'upload': failing_upload, 'preprocess': lambda files: preprocess_batch(files)}
+        with mock.patch.object(benchmarks, 'model_paths', return_value=paths):
+            report = run_suite(['upload', 'preprocess'], resolutions=[(64, 48)], formats=['JPEG'],
+                               batch_sizes=[1, 2], iterations=1, warmup=0)
+        self.assertEqual(report['errors'], 2)
+        failed = [c for c in report['results'] if c['path'] == 'upload']
+        self.assertEqual([(c['status'], c['error']) for c in failed],
+                         [(500, "UploadFailed: upload returned 500: {'error': 'model not loaded'}")] * 2)
+        self.assertTrue(all('p50_ms' in c for c in report['results'] if c['path'] == 'preprocess'))
+
+
+
+class BenchmarkCleanupTests(TestCase):
+    def test_uploaded_files_are_deleted(self):
+        from .management.commands.run_benchmarks import _delete_uploaded_files
+        media = tempfile.TemporaryDirectory()
+        self.addCleanup(media.cleanup)
+        with override_settings(MEDIA_ROOT=media.name):
+            user = User.objects.create_user('adscan-benchmark', 'benchmark@example.invalid')
+            ad_image = AdScanImage(user=user)
+            ad_image.image.save('bench_0.jpg', SimpleUploadedFile('bench_0.jpg', _encoded((32, 32))), save=False)
+            ad_image.thumbnail.save('bench_0.webp', SimpleUploadedFile('bench_0.webp', b'thumb'), save=False)
+            ad_image.save()
+            _delete_uploaded_files(user)
+            self.assertEqual([files for _, _, files in os.walk(media.name) if files], [])
+
+
+def _stub_tensorflow(traced):
+    """tensorflow stand-in for CompiledKerasModel: tf.function checks the fixed batch size."""
+    def function(fn, input_signature):
+        size = input_signature[0].shape[0]
+
+        def call(x):
+            assert x.shape == (size, 224, 224, 3), x.shape
+            traced.append(size)
+            return fn(x)
+        return call
+
+    return SimpleNamespace(function=function, float32='float32',
+                           TensorSpec=lambda shape, dtype: SimpleNamespace(shape=shape, dtype=dtype))
+
+
+class CompiledKerasModelTests(SimpleTestCase):
+    def test_batches_are_padded_split_and_trimmed(self):
+        traced = []
+        model = mock.Mock(side_effect=lambda x, training=False: np.asarray(x).reshape(len(x), -1)[:, :1] * 2)
+        with mock.patch.dict(sys.modules, {'tensorflow': _stub_tensorflow(traced)}):
+            compiled = model_registry.CompiledKerasModel(model, buckets=(8, 1, 4))
+        self.assertEqual(compiled.buckets, (1, 4, 8))
+
+        for n, calls in ((1, [1]), (3, [4]), (17, [8, 8, 1]), (20, [8, 8, 4])):
+            traced.clear()
+            batch = np.arange(n, dtype='float32')[:, None, None, None] * np.ones((1, 224, 224, 3), 'float32')
+            output = compiled.predict(batch)
+            self.assertEqual(output.shape, (n, 1))
+            np.testing.assert_array_equal(output[:, 0], np.arange(n) * 2)  # order kept, padding dropped
+            self.assertEqual(traced, calls)
+
+        traced.clear()
+        self.assertEqual(compiled.predict(np.full((224, 224, 3), 3.0, 'float32')).tolist(), [[6.0]])
+        self.assertEqual(traced, [1])
+        self.assertIs(compiled.layers, model.layers)  # everything but predict goes to the model
+
+
+class _FakeInterpreter:
+    """tf.lite.Interpreter stand-in: one output per input row (its mean)."""
+    created = []
+
+    def __init__(self, model_content, num_threads=None):
+        self.sizes = []
+        _FakeInterpreter.created.append(self)
+
+    def get_input_details(self):
+        return [{'index': 0, 'dtype': np.float32, 'quantization': (0.0, 0)}]
+
+    def get_output_details(self):
+        return [{'index': 1, 'dtype': np.float32, 'quantization': (0.0, 0)}]
+
+    def resize_tensor_input(self, index, shape):
+        self.sizes.append(shape[0])
+
+    def allocate_tensors(self):
+        pass
+
+    def set_tensor(self, index, value):
+        assert len(value) == self.sizes[-1]
+        self.value = value
+
+    def invoke(self):
+        pass
+
+    def get_tensor(self, index):
+        return self.value.reshape(len(self.value), -1).mean(axis=1, keepdims=True)
+
+
+class TFLiteLightTests(SimpleTestCase):
+    def test_batches_are_padded_to_buckets(self):
+        with tempfile.NamedTemporaryFile(suffix='.tflite') as fh:
+            _FakeInterpreter.created = []
+            with mock.patch.object(tflite_light, '_interpreter_class', return_value=_FakeInterpreter):
+                model = tflite_light.TFLiteLightModel(fh.name, buckets=(1, 4, 8))
+            rng = np.random.default_rng(0)
+            for n in (1, 2, 3, 5, 7, 11, 20):
+                batch = rng.random((n, 224, 224, 3), dtype='float32')
+                output = model.predict(batch)
+                self.assertEqual(output.shape, (n, 1))
+                np.testing.assert_allclose(output[:, 0], batch.reshape(n, -1).mean(axis=1), rtol=1e-5)
+        self.assertEqual(sorted(i.sizes[0] for i in _FakeInterpreter.created), [1, 4, 8])
+
+
+class _LogisticHead:
+    """Picklable sklearn-style classifier stand-in for the dark model's head."""
+
+    def __init__(self, weights):
+        self.weights = weights
+
+    def predict_proba(self, features):
+        p = 1.0 / (1.0 + np.exp(-features @ self.weights))
+        return np.stack([1.0 - p, p], axis=1)
+
+
+def _has_onnx_export():
+    return all(importlib.util.find_spec(m) for m in ('onnxruntime', 'tf2onnx', 'tensorflow'))
+
+
+@skipUnless(_has_onnx_export(), "needs onnxruntime, tf2onnx and tensorflow")
+class OnnxParityTests(SimpleTestCase):
+    TOLERANCE = 1e-4
+
+    def setUp(self):
+        import tensorflow as tf  # type: ignore
+
+        tf.keras.utils.set_random_seed(0)
+        self.tf = tf
+        self.dir = tempfile.TemporaryDirectory()
+        self.addCleanup(self.dir.cleanup)
+        rng = np.random.default_rng(0)
+        self.batch = rng.random((5, 224, 224, 3), dtype='float32')
+
+    def _tiny_cnn(self, outputs, activation):
+        layers = self.tf.keras.layers
+        return self.tf.keras.Sequential([
+            layers.Input((224, 224, 3)),
+            layers.Conv2D(4, 3, strides=4, activation='relu'),
+            layers.GlobalAveragePooling2D(),
+            layers.Dense(outputs, activation=activation),
+        ])
+
+    def test_light_model_matches_keras(self):
+        keras_model = self._tiny_cnn(1, 'sigmoid')
+        path = os.path.join(self.dir.name, 'light.onnx')
+        onnx_models.export_keras_model(keras_model, path)
+        with override_settings(MODEL_PATH_LIGHT_ONNX=path):
+            candidate = onnx_models.load_light_onnx()
+        np.testing.assert_allclose(candidate.predict(self.batch), keras_model.predict(self.batch, verbose=0),
+                                   atol=self.TOLERANCE)
+
+    def test_dark_model_matches_the_deployable_model(self):
+        deployable = SimpleNamespace(feature_extractor=self._tiny_cnn(8, None),
+                                     classifier=_LogisticHead(np.linspace(-1.0, 1.0, 8)), optimal_threshold=0.3)
+        onnx_path = os.path.join(self.dir.name, 'dark.onnx')
+        head_path = os.path.join(self.dir.name, 'dark_head.joblib')
+        onnx_models.export_keras_model(deployable.feature_extractor, onnx_path)
+        onnx_models.export_dark_classifier(deployable, head_path)
+        with override_settings(MODEL_PATH_DARK_ONNX=onnx_path, MODEL_PATH_DARK_CLASSIFIER=head_path):
+            candidate = onnx_models.load_dark_onnx()
+        self.assertEqual(candidate.optimal_threshold, 0.3)
+        np.testing.assert_allclose(_dark_hybrid_probabilities(candidate, self.batch),
+                                   _dark_hybrid_probabilities(deployable, self.batch), atol=self.TOLERANCE)
+
+
+class _Backbone:
+    """Keras-layer stand-in: 32x32 average pooling then a channel mix, (N, 7, 7, 4) out."""
+
+    def __init__(self, weights):
+        self.weights = weights
+
+    def get_weights(self):
+        return [self.weights]
+
+    def __call__(self, x, training=False):
+        x = np.asarray(x)
+        return x.reshape(len(x), 7, 32, 7, 32, 3).mean(axis=(2, 4)) @ self.weights
+
+    def predict(self, x, verbose=0):
+        return self(x)
+
+
+class _GlobalAveragePooling2D:
+    def __call__(self, x, training=False):
+        return x.mean(axis=(1, 2))
+
+
+class _Dense:
+    def __init__(self, weights):
+        self.weights = weights
+
+    def __call__(self, x, training=False):
+        return 1.0 / (1.0 + np.exp(-(x @ self.weights)))[:, None]
+
+
+class _Sequential:
+    def __init__(self, layers):
+        self.layers = layers
+
+    def predict(self, x, verbose=0):
+        for layer in self.layers:
+            x = layer(x)
+        return x
+
+
+class SharedBackboneTests(SimpleTestCase):
+    def setUp(self):
+        rng = np.random.default_rng(0)
+        self.weights = rng.normal(size=(3, 4))
+        self.light = _Sequential([_Backbone(self.weights), _GlobalAveragePooling2D(), _Dense(rng.normal(size=4))])
+        self.batch = rng.random((4, 224, 224, 3), dtype='float32')
+
+    def _dark(self, weights):
+        model = SimpleNamespace(feature_extractor=_Backbone(weights), optimal_threshold=0.3,
+                                classifier=_LogisticHead(np.linspace(-0.5, 0.5, 7 * 7 * 4)))
+        model.predict_arrays = lambda batch, use_hybrid=True: model_registry._dark_hybrid_results(
+            model, model_registry._dark_hybrid_probabilities(model, batch))
+        return model
+
+    def _predict_both(self, dark, checked=False):
+        with mock.patch.multiple(model_registry, _ad_model_light=self.light, _ad_model_dark=dark,
+                                 _shared_light_head=None, _shared_backbone_checked=checked):
+            return model_registry.predict_both(self.batch)
+
+    def test_shared_pass_matches_separate_models(self):
+        dark = self._dark(self.weights.copy())
+        shared = self._predict_both(dark)
+        separate = self._predict_both(dark, checked=True)  # decided already: no shared head
+        self.assertEqual({r['shared_backbone'] for r in shared}, {True})
+        self.assertEqual({r['shared_backbone'] for r in separate}, {False})
+        np.testing.assert_allclose([r['light'] for r in shared], [r['light'] for r in separate], rtol=1e-6)
+        np.testing.assert_allclose([r['light'] for r in shared],
+                                   np.ravel(self.light.predict(self.batch)), rtol=1e-6)
+        for a, b in zip(shared, separate):
+            self.assertAlmostEqual(a['dark']['probability'], b['dark']['probability'], places=6)
+            self.assertEqual(a['dark']['prediction'], b['dark']['prediction'])
+
+    def test_different_backbones_run_separately(self):
+        results = self._predict_both(self._dark(self.weights + 0.01))
+        self.assertEqual({r['shared_backbone'] for r in results}, {False})
+        np.testing.assert_allclose([r['light'] for r in results], np.ravel(self.light.predict(self.batch)))
+
+
+class _StubOrtSession:
+    """onnxruntime.InferenceSession stand-in running _Backbone with the weights saved at `path`."""
+    sessions = []
+
+    def __init__(self, path, sess_options=None, providers=None):
+        self.backbone = _Backbone(np.load(path))
+        self.options, self.providers = sess_options, providers
+        _StubOrtSession.sessions.append(self)
+
+    def get_inputs(self):
+        return [SimpleNamespace(name='input')]
+
+    def run(self, output_names, feeds):
+        (name, batch), = feeds.items()
+        assert name == 'input' and batch.dtype == np.float32 and batch.ndim == 4
+        return [self.backbone(batch).astype('float32')]
+
+
+def _stub_onnxruntime():
+    return SimpleNamespace(
+        SessionOptions=SimpleNamespace, InferenceSession=_StubOrtSession,
+        GraphOptimizationLevel=SimpleNamespace(ORT_ENABLE_ALL='all'),
+    )
+
+
+class OnnxRuntimeWrapperTests(SimpleTestCase):
+    """OnnxModel / OnnxDarkModel against a stub session, so they are checked without onnxruntime."""
+
+    def test_dark_model_matches_the_deployable_model(self):
+        rng = np.random.default_rng(0)
+        weights = rng.normal(size=(3, 4)).astype('float32')
+        native = SimpleNamespace(feature_extractor=_Backbone(weights), optimal_threshold=0.35,
+                                 classifier=_LogisticHead(np.linspace(-0.5, 0.5, 7 * 7 * 4)))
+        folder = tempfile.TemporaryDirectory()
+        self.addCleanup(folder.cleanup)
+        onnx_path, head_path = os.path.join(folder.name, 'dark.npy'), os.path.join(folder.name, 'dark_head.joblib')
+        np.save(onnx_path, weights)
+        onnx_models.export_dark_classifier(native, head_path)
+
+        _StubOrtSession.sessions = []
+        with mock.patch.dict(sys.modules, {'onnxruntime': _stub_onnxruntime()}), \
+                override_settings(MODEL_PATH_DARK_ONNX=onnx_path, MODEL_PATH_DARK_CLASSIFIER=head_path,
+                                  ADSCAN_ONNX_INTRA_OP_THREADS=2, ADSCAN_ONNX_INTER_OP_THREADS=None):
+            candidate = onnx_models.load_dark_onnx()
+        session, = _StubOrtSession.sessions
+        self.assertEqual((session.options.intra_op_num_threads, session.providers), (2, ['CPUExecutionProvider']))
+        self.assertFalse(hasattr(session.options, 'inter_op_num_threads'))
+        self.assertEqual(candidate.optimal_threshold, 0.35)
+
+        batch = rng.random((3, 224, 224, 3), dtype='float32')
+        expected = model_registry._dark_hybrid_probabilities(native, batch)
+        np.testing.assert_allclose(model_registry._dark_hybrid_probabilities(candidate, batch), expected, rtol=1e-5)
+        self.assertEqual(
+            [r['prediction'] for r in model_registry._dark_hybrid_results(candidate, expected)],
+            [r['prediction'] for r in model_registry._dark_hybrid_results(native, expected)])
+        # a single (224, 224, 3) image is batched like Keras predict
+        np.testing.assert_allclose(candidate.feature_extractor.predict(batch[0]),
+                                   native.feature_extractor.predict(batch[:1]), rtol=1e-5)
+
+
+class TimingTests(SimpleTestCase):
+    def setUp(self):
+        STAGE_SECONDS.clear()
+
+    def _view(self, request):
+        with span("validate"):
+            pass
+        with span("validate"):
+            pass
+        with span("inference", "light"):
+            pass
+        return HttpResponse("ok")
+
+    def test_middleware_sets_server_timing_and_logs_spans(self):
+        request = RequestFactory().get('/api/adscan/upload/')
+        with self.assertLogs('users.timing', 'INFO') as logs:
+            response = ServerTimingMiddleware(self._view)(request)
+        names = [entry.split(';')[0] for entry in response['Server-Timing'].split(', ')]
+        self.assertEqual(names, ['validate', 'inference_light', 'total'])
+        record = json.loads(logs.records[0].getMessage())
+        self.assertEqual([s['stage'] for s in record['spans']], ['validate', 'validate', 'inference'])
+
+    def test_requests_without_spans_are_untouched(self):
+        response = ServerTimingMiddleware(lambda r: HttpResponse("ok"))(RequestFactory().get('/'))
+        self.assertFalse(response.has_header('Server-Timing'))
+
+    def test_metrics_exposes_stage_histograms(self):
+        with span("preprocess"):
+            pass
+        with span("inference", "dark"):
+            pass
+        body = metrics_view(RequestFactory().get('/metrics')).content.decode()
+        self.assertIn('# TYPE adscan_stage_duration_seconds histogram', body)
+        self.assertIn('adscan_stage_duration_seconds_count{stage="inference",model="dark"} 1', body)
+        self.assertIn('adscan_stage_duration_seconds_bucket{stage="preprocess",model="",le="+Inf"} 1', body)
+
+    @override_settings(ADSCAN_METRICS_TOKEN='s3cret')
+    def test_metrics_token(self):
+        self.assertEqual(metrics_view(RequestFactory().get('/metrics')).status_code, 403)
+        response = metrics_view(RequestFactory().get('/metrics', HTTP_AUTHORIZATION='Bearer s3cret'))
+        self.assertEqual(response.status_code, 200)
+        response = metrics_view(RequestFactory().get('/metrics', HTTP_AUTHORIZATION='Bearer wrong'))
+        self.assertEqual(response.status_code, 403)
+
+    @override_settings(ADSCAN_METRICS_TOKEN=None, ADSCAN_METRICS_ALLOWED_IPS=('127.0.0.1',))
+    def test_metrics_without_token_is_local_or_staff_only(self):
+        def status_for(remote_addr, user=None, debug=False):
+            request = RequestFactory().get('/metrics', REMOTE_ADDR=remote_addr)
+            if user is not None:
+                request.user = user
+            with override_settings(DEBUG=debug):
+                return metrics_view(request).status_code
+
+        self.assertEqual(status_for('127.0.0.1'), 200)
+        self.assertEqual(status_for('203.0.113.7'), 403)
+        self.assertEqual(status_for('203.0.113.7', SimpleNamespace(is_authenticated=True, is_staff=False)), 403)
+        self.assertEqual(status_for('203.0.113.7', SimpleNamespace(is_authenticated=True, is_staff=True)), 200)
+        self.assertEqual(status_for('203.0.113.7', debug=True), 200)
+
+
+class TracingTests(SimpleTestCase):
+    class Lazy:
+        formatted = 0
+
+        def __repr__(self):
+            TracingTests.Lazy.formatted += 1
+            return "lazy"
+
+    def _view(self, request):
+        trace("raw result: %r", self.value)
+        return HttpResponse(str(trace_enabled()))
+
+    def _call(self, **headers):
+        self.value = self.Lazy()
+        self.Lazy.formatted = 0
+        return RequestTraceMiddleware(self._view)(RequestFactory().get('/', **headers))
+
+    @override_settings(ADSCAN_TRACE_SAMPLE_RATE=0.0, ADSCAN_TRACE_ALLOW_HEADER=True)
+    def test_untraced_requests_do_not_format(self):
+        response = self._call()
+        self.assertEqual(response.content, b'False')
+        self.assertEqual(self.Lazy.formatted, 0)
+
+    @override_settings(ADSCAN_TRACE_SAMPLE_RATE=0.0, ADSCAN_TRACE_ALLOW_HEADER=True)
+    def test_debug_header_traces_the_request(self):
+        with self.assertLogs('users.trace', 'INFO') as logs:
+            response = self._call(HTTP_X_ADSCAN_DEBUG='1')
+        self.assertEqual(response.content, b'True')
+        self.assertEqual(logs.records[0].getMessage(), "raw result: lazy")
+
+    @override_settings(ADSCAN_TRACE_SAMPLE_RATE=0.0, ADSCAN_TRACE_ALLOW_HEADER=False)
+    def test_debug_header_can_be_disabled(self):
+        self.assertEqual(self._call(HTTP_X_ADSCAN_DEBUG='1').content, b'False')
+
+    @override_settings(ADSCAN_TRACE_SAMPLE_RATE=1.0)
+    def test_sampling(self):
+        with self.assertLogs('users.trace', 'INFO'):
+            self.assertEqual(self._call().content, b'True')
+
+
+class StreamingUploadTests(SimpleTestCase):
+    def _parse(self, *payloads):
+        files = [SimpleUploadedFile(f"img{i}.jpg", data, content_type='image/jpeg') for i, data in enumerate(payloads)]
+        body = encode_multipart(BOUNDARY, {'images': files, 'model_type': 'light'})
+        meta = {'CONTENT_TYPE': MULTIPART_CONTENT, 'CONTENT_LENGTH': str(len(body))}
+        _, parsed = MultiPartParser(meta, io.BytesIO(body), [AdScanUploadHandler()]).parse()
+        return parsed.getlist('images')
+
+    def test_valid_image_is_hashed_while_streaming(self):
+        data = _encoded((320, 240))
+        upload, = self._parse(data)
+        self.assertIsInstance(upload, ScannedUpload)
+        self.assertIsNone(upload.upload_error)
+        self.assertEqual(upload.sha256, hashlib.sha256(data).hexdigest())
+        self.assertEqual(prediction_cache.image_digest(upload), upload.sha256)
+        self.assertEqual(upload.read(), data)
+
+    def test_wrong_signature_is_rejected_without_buffering(self):
+        upload, = self._parse(b'GIF89a' + b'\0' * 5000)
+        self.assertEqual(upload.upload_error, INVALID_TYPE_ERROR)
+        self.assertEqual(upload.read(), b'')
+        serializer = AdScanSerializer(data={'image': upload})
+        self.assertFalse(serializer.is_valid())
+        self.assertEqual(serializer.errors['image'], [INVALID_TYPE_ERROR])
+
+    @override_settings(ADSCAN_MAX_UPLOAD_BYTES=10 * 1024)
+    def test_oversized_image_is_cut_off(self):
+        big, small = _encoded((600, 600), 'PNG'), _encoded((32, 32))
+        uploads = self._parse(big, small)
+        self.assertEqual(uploads[0].size, len(big))
+        self.assertEqual(uploads[0].read(), b'')
+        self.assertFalse(AdScanSerializer(data={'image': uploads[0]}).is_valid())
+        self.assertIsNone(uploads[1].upload_error)
+
+    @override_settings(ADSCAN_MAX_UPLOAD_REQUEST_BYTES=1)
+    def test_request_budget_rejects_later_files(self):
+        first, second = self._parse(_encoded((32, 32)), _encoded((32, 32), seed=1))
+        self.assertIsNone(first.upload_error)
+        self.assertIsNotNone(second.upload_error)
+
+    def test_image_is_verified_once_across_serializers(self):
+        upload, = self._parse(_encoded((64, 64)))
+        self.assertTrue(AdScanSerializer(data={'image': upload}).is_valid())
+        self.assertTrue(upload.image_verified)
+        with mock.patch('PIL.Image.open', side_effect=AssertionError("decoded again")):
+            self.assertTrue(AdScanImageSerializer(data={'image': upload}).is_valid())
+
+
+def _png_header(width, height):
+    """A PNG that claims width x height pixels but carries a single, tiny IDAT chunk."""
+    def chunk(kind, data):
+        return struct.pack('>I', len(data)) + kind + data + struct.pack('>I', zlib.crc32(kind + data))
+    ihdr = struct.pack('>IIBBBBB', width, height, 8, 0, 0, 0, 0)
+    return b'\x89PNG\r\n\x1a\n' + chunk(b'IHDR', ihdr) + chunk(b'IDAT', zlib.compress(b'\0' * 64)) + chunk(b'IEND', b'')
+
+
+class PixelBudgetTests(SimpleTestCase):
+    def test_bomb_is_rejected_from_the_header(self):
+        with mock.patch('PIL.ImageFile.ImageFile.load', side_effect=AssertionError("decoded")):
+            for size in ((9000, 9000), (30000, 30000)):
+                with self.assertRaises(ImageTooLarge):
+                    open_image(io.BytesIO(_png_header(*size)))
+
+    def test_serializer_reports_the_pixel_budget(self):
+        upload = SimpleUploadedFile('bomb.png', _png_header(9000, 9000), content_type='image/png')
+        serializer = AdScanSerializer(data={'image': upload})
+        self.assertFalse(serializer.is_valid())
+        self.assertIn('Max is 40 megapixels', str(serializer.errors['image'][0]))
+
+    @override_settings(ADSCAN_MAX_IMAGE_PIXELS=100_000, ADSCAN_PREPROCESS_DRAFT_ABOVE_PIXELS=200_000)
+    def test_large_jpegs_are_draft_decoded_instead_of_rejected(self):
+        png, jpeg = _encoded((640, 480), 'PNG'), _encoded((640, 480), 'JPEG')
+        batch, failures = preprocess_batch([io.BytesIO(png), io.BytesIO(jpeg)])
+        self.assertIsInstance(failures[0], ImageTooLarge)
+        self.assertEqual(batch.shape, (1, 224, 224, 3))
+        self.assertEqual(open_image(io.BytesIO(jpeg)).size, (320, 240))
+
+    @override_settings(ADSCAN_PREPROCESS_WORKERS=4)
+    def test_request_decode_budget_caps_concurrent_decodes(self):
+        data = _encoded((200, 100))
+        one = 200 * 100 * 4
+        with request_decode_budget(limit=one * 2) as budget:
+            batch, failures = preprocess_batch([io.BytesIO(data) for _ in range(6)], draft=False)
+        self.assertEqual((len(batch), failures), (6, {}))
+        self.assertLessEqual(budget.peak, one * 2)
+        self.assertEqual(budget.in_use, 0)
+
+        with request_decode_budget(limit=one - 1):
+            batch, failures = preprocess_batch([io.BytesIO(data)], draft=False)
+        self.assertIsInstance(failures[0], ImageTooLarge)
+
+    def test_a_phone_photo_upload_fits_the_default_budget(self):
+        # 11 distinct 12 MP photos (below the draft threshold) plus their TTA/thumbnail passes
+        buf = io.BytesIO()
+        Image.new('RGB', (4032, 3024), (120, 90, 60)).save(buf, 'JPEG')
+        photos = [io.BytesIO(buf.getvalue()) for _ in range(11)]
+        with request_decode_budget() as budget:
+            batch, failures = preprocess_batch(photos)
+            for photo in photos[:3]:
+                render_thumbnail(photo)
+        self.assertEqual((len(batch), failures), (11, {}))
+        self.assertEqual(budget.in_use, 0)
+
+
+class ThumbnailTests(SimpleTestCase):
+    def _rotated_jpeg(self, orientation):
+        # stored landscape: red left half, blue right half
+        img = Image.new('RGB', (1200, 600), (0, 0, 255))
+        img.paste((255, 0, 0), (0, 0, 600, 600))
+        exif = Image.Exif()
+        exif[0x0112] = orientation
+        buf = io.BytesIO()
+        img.save(buf, 'JPEG', exif=exif)
+        buf.seek(0)
+        return buf
+
+    def _colour(self, thumb, xy):
+        r, g, b = thumb.getpixel(xy)
+        return 'red' if r > 200 and b < 60 else 'blue' if b > 200 and r < 60 else (r, g, b)
+
+    @override_settings(ADSCAN_THUMBNAIL_SIZE=256, ADSCAN_THUMBNAIL_FORMAT='JPEG')
+    def test_exif_rotation_is_applied(self):
+        source = self._rotated_jpeg(6)  # camera held upright: display rotated 90 degrees clockwise
+        thumb = Image.open(io.BytesIO(render_thumbnail(source)))
+        self.assertEqual((thumb.format, thumb.size), ('JPEG', (128, 256)))
+        self.assertEqual((self._colour(thumb, (64, 10)), self._colour(thumb, (64, 245))), ('red', 'blue'))
+        self.assertNotIn(0x0112, thumb.getexif())
+        self.assertEqual(source.tell(), 0)
+
+        thumb = Image.open(io.BytesIO(render_thumbnail(self._rotated_jpeg(8), size=100, fmt='webp')))
+        self.assertEqual((thumb.format, thumb.size), ('WEBP', (50, 100)))
+        self.assertEqual((self._colour(thumb, (25, 5)), self._colour(thumb, (25, 95))), ('blue', 'red'))
+
+
+@override_settings(ADSCAN_PREDICTION_CACHE_ENABLED=False, ADSCAN_INFERENCE_BACKEND='inline', ADSCAN_TTA_VIEWS=6)
+class TestTimeAugmentationTests(SimpleTestCase):
+    def test_views_are_batched_and_start_with_the_input(self):
+        batch = np.stack([load_image_array(io.BytesIO(_encoded((300, 200), seed=i))) for i in range(2)])
+        views = augmented_batch(batch, 6)
+        self.assertEqual(views.shape, (12, 224, 224, 3))
+        np.testing.assert_array_equal(views[0], batch[0])
+        np.testing.assert_array_equal(views[6], batch[1])
+        np.testing.assert_array_equal(views[1], batch[0][:, ::-1])
+        self.assertTrue(0.0 <= views.min() and views.max() <= 1.0)
+
+    def test_near_threshold(self):
+        self.assertTrue(near_threshold('light', 0.35))
+        self.assertFalse(near_threshold('light', 0.9))
+        self.assertTrue(near_threshold('dark', {'probability': 0.25}))
+        self.assertTrue(near_threshold('both', {'light': 0.9, 'dark': {'probability': 0.32}}))
+
+    def _predict(self, mode, first_pass, view_probs):
+        from . import views
+
+        def fake_run_batch(model_type, batch):
+            probs = first_pass if len(batch) == len(first_pass) else view_probs
+            self.assertEqual(len(batch), len(probs))
+            return probs
+
+        files = [io.BytesIO(_encoded((64, 64), seed=i)) for i in range(len(first_pass))]
+        with mock.patch.object(views, 'run_batch', side_effect=fake_run_batch) as run:
+            return views.predict_ad_light_batch(files, tta=mode), run.call_count
+
+    def test_auto_mode_only_augments_borderline_images(self):
+        # image 0 sits on the 0.31 threshold, image 1 is clearly not AD
+        results, calls = self._predict('auto', [0.32, 0.95], [0.2, 0.25, 0.3, 0.2, 0.25, 0.3])
+        self.assertEqual(calls, 2)
+        self.assertAlmostEqual(results[0]['tta']['mean'], 0.25)
+        self.assertAlmostEqual(results[0]['tta']['first_pass_probability'], 0.32)
+        self.assertEqual((results[0]['label'], results[0]['tta']['views']), ('ad', 6))
+        self.assertNotIn('tta', results[1])
+
+    def test_off_mode_is_a_single_pass(self):
+        results, calls = self._predict('off', [0.32], [])
+        self.assertEqual((calls, results[0]['label']), (1, 'not_ad'))
+        self.assertNotIn('tta', results[0])
+
+    def test_views_reuse_the_first_pass_arrays(self):
+        from . import views
+
+        batches = []
+
+        def fake_run_batch(model_type, batch):
+            batches.append(np.array(batch))
+            return [0.32] * len(batch)
+
+        files = [io.BytesIO(_encoded((640, 480), seed=i)) for i in range(3)]
+        with mock.patch.object(views, 'run_batch', side_effect=fake_run_batch), \
+                mock.patch.object(views, 'preprocess_batch', wraps=preprocess_batch) as decode:
+            results = views.predict_ad_light_batch(files, tta='always')
+        self.assertEqual(decode.call_count, 1)
+        self.assertEqual([len(b) for b in batches], [3, 18])
+        for i in range(3):
+            np.testing.assert_array_equal(batches[1][i * 6], batches[0][i])
+            self.assertEqual(results[i]['tta']['views'], 6)
+
+
+class BulkScoringTests(SimpleTestCase):
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(self.tmp.cleanup)
+        self.folder = os.path.join(self.tmp.name, 'images')
+        os.makedirs(os.path.join(self.folder, 'sub'))
+        for i, name in enumerate(['a.jpg', 'b.png', 'sub/c.jpg']):
+            with open(os.path.join(self.folder, name), 'wb') as fh:
+                fh.write(_encoded((80, 60), 'PNG' if name.endswith('png') else 'JPEG', seed=i))
+        with open(os.path.join(self.folder, 'broken.jpg'), 'wb') as fh:
+            fh.write(b'\xff\xd8\xffnot really a jpeg')
+        with open(os.path.join(self.folder, 'notes.txt'), 'w') as fh:
+            fh.write('skip me')
+
+    def test_directory_source_is_sorted_and_resumable(self):
+        keys = [key for key, _ in bulk_scoring.iter_directory(self.folder)]
+        self.assertEqual(keys, ['a.jpg', 'b.png', 'broken.jpg', os.path.join('sub', 'c.jpg')])
+        self.assertEqual([k for k, _ in bulk_scoring.iter_directory(self.folder, after='b.png')], keys[2:])
+
+    def test_prefetch_keeps_order_and_reports_decode_failures(self):
+        batches = list(bulk_scoring.prefetch_batches(bulk_scoring.iter_directory(self.folder), 3))
+        self.assertEqual([b[0] for b in batches], [['a.jpg', 'b.png', 'broken.jpg'], [os.path.join('sub', 'c.jpg')]])
+        all_keys, keys, batch, failures = batches[0]
+        self.assertEqual(keys, ['a.jpg', 'b.png'])
+        self.assertEqual(batch.shape, (2, 224, 224, 3))
+        self.assertEqual(list(failures), ['broken.jpg'])
+
+    def test_workers_reach_the_decode_pool(self):
+        from . import preprocessing
+        with mock.patch.object(preprocessing, '_get_pool', wraps=preprocessing._get_pool) as get_pool:
+            list(bulk_scoring.prefetch_batches(bulk_scoring.iter_directory(self.folder), 3, workers=3))
+        self.assertEqual({c.args for c in get_pool.call_args_list}, {(3,)})
+        self.assertEqual(preprocessing._get_pool(3)._max_workers, 3)
+
+    def test_rows_for_both_models(self):
+        rows = bulk_scoring.rows_for('both', 7, {'light': 0.2, 'dark': {'probability': 0.1}},
+                                     {'light': 'lv', 'dark': 'dv'})
+        self.assertEqual([(r['model_type'], r['label'], r['model_version']) for r in rows],
+                         [('light', 'ad', 'lv'), ('dark', 'not_ad', 'dv')])
+
+    def _score(self, output, checkpoint, state=None):
+        scored = []
+
+        def fake_run_batch(model_type, batch):
+            scored.append(len(batch))
+            return [0.9] * len(batch)
+
+        with mock.patch.object(bulk_scoring, 'run_batch', side_effect=fake_run_batch), \
+                mock.patch.object(bulk_scoring, 'model_version', return_value='test'):
+            items = bulk_scoring.iter_directory(self.folder, after=(state or {}).get('last_key'))
+            state = bulk_scoring.score_items(items, 'light', bulk_scoring.CsvWriter(output), batch_size=2,
+                                             flush_every=1, checkpoint_path=checkpoint, state=state)
+        return state, scored
+
+    def test_csv_run_checkpoints_and_resumes(self):
+        import csv
+        output = os.path.join(self.tmp.name, 'out.csv')
+        checkpoint = output + '.checkpoint.json'
+        state, scored = self._score(output, checkpoint)
+        self.assertEqual((state['images'], state['failed'], scored), (3, 1, [2, 1]))
+        self.assertEqual(bulk_scoring.load_checkpoint(checkpoint)['last_key'], os.path.join('sub', 'c.jpg'))
+        with open(output, newline='') as fh:
+            rows = list(csv.DictReader(fh))
+        self.assertEqual([r['key'] for r in rows if r['error']], ['broken.jpg'])
+        self.assertEqual({r['label'] for r in rows if not r['error']}, {'not_ad'})
+
+        # a finished run resumed from its checkpoint scores nothing more
+        state, scored = self._score(output, checkpoint, bulk_scoring.load_checkpoint(checkpoint))
+        self.assertEqual((state['images'], scored), (3, []))
+
+
+class PredictionRecordTests(SimpleTestCase):
+    def test_rows_for_a_both_prediction(self):
+        from . import views
+        prediction = {
+            "light": views._light_prediction(0.2, {"views": 6, "mean": 0.4, "variance": 0.01}),
+            "dark": views._dark_prediction(0.7, {"probability": 0.7}),
+        }
+        rows = prediction_rows(5, 'both', prediction, {'light': 'lv', 'dark': 'dv'}, latency_ms=12.5)
+        self.assertEqual(
+            [(r.image_id, r.model_type, r.model_version, r.probability, r.threshold, r.label, r.is_ad, r.latency_ms)
+             for r in rows],
+            [(5, 'light', 'lv', 0.4, 0.31, 'not_ad', False, 12.5), (5, 'dark', 'dv', 0.7, 0.3, 'ad', True, 12.5)],
+        )
+
+    def test_error_fallbacks_are_not_recorded(self):
+        fallback = {"label": "not_ad", "raw_probability": 0.5, "is_atopic_dermatitis": False, "success": False}
+        self.assertEqual(prediction_rows(1, 'dark', fallback, {'light': 'lv', 'dark': 'dv'}), [])
+
+
+class AsyncEndpointTests(SimpleTestCase):
+    def test_gate_rejects_beyond_capacity_and_frees_slots(self):
+        gate = InferenceGate(workers=1, queue_size=1)
+        release = threading.Event()
+        held = [gate.submit(release.wait) for _ in range(2)]
+        with self.assertRaises(Overloaded):
+            gate.submit(release.wait)
+        release.set()
+        for future in held:
+            future.result(timeout=5)
+        self.assertEqual(asyncio.run(gate.run(lambda: 42)), 42)
+        self.assertEqual(gate.stats(), {"workers": 1, "capacity": 2, "in_flight": 0, "rejected": 1})
+
+    def test_gate_jobs_see_the_request_timeline(self):
+        def inference():
+            with span("inference", "light"):
+                pass
+
+        async def view(request):
+            await InferenceGate(1, 0).run(inference)
+            return HttpResponse("ok")
+
+        middleware = ServerTimingMiddleware(view)
+        self.assertTrue(asyncio.iscoroutinefunction(middleware))
+        response = asyncio.run(middleware(RequestFactory().get('/x')))
+        self.assertIn('inference_light;dur=', response['Server-Timing'])
+
+
+class _InlineGate:
+    """InferenceGate stand-in running jobs on the test's DB connection."""
+
+    async def run(self, fn, *args):
+        return await sync_to_async(fn)(*args)
+
+
+@override_settings(ADSCAN_PREDICTION_CACHE_ENABLED=False, ADSCAN_ASYNC_RETRY_AFTER=7)
+class AsyncUploadViewTests(TestCase):
+    def setUp(self):
+        media = tempfile.TemporaryDirectory()
+        self.addCleanup(media.cleanup)
+        media_root = override_settings(MEDIA_ROOT=media.name)
+        media_root.enable()
+        self.addCleanup(media_root.disable)
+        self.user = User.objects.create_user('patient', 'patient@example.com', 'pw')
+        self.token = str(AccessToken.for_user(self.user))
+        for target, name, kwargs in (
+                (async_views, 'get_inference_gate', {'return_value': _InlineGate()}),
+                (views, 'predict_ad_light_batch',
+                 {'side_effect': lambda files, tta=None: [views._light_prediction(0.9) for _ in files]})):
+            patcher = mock.patch.object(target, name, **kwargs)
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+    def _data(self):
+        return {'images': [SimpleUploadedFile('scan.jpg', _encoded((64, 48)), content_type='image/jpeg')]}
+
+    async def test_authenticated_upload_is_scored_and_recorded(self):
+        response = await self.async_client.post('/api/adscan/upload/async/', self._data(),
+                                                headers={'Authorization': f'Bearer {self.token}'})
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual([r['prediction']['label'] for r in response.json()['results']], ['not_ad'])
+        self.assertEqual(await Prediction.objects.acount(), 1)
+
+    async def test_anonymous_upload_answers_like_the_sync_view(self):
+        # AllowAny, but an anonymous upload cannot be saved: both views answer 207 per image
+        with self.assertLogs('users.views', 'ERROR'):
+            response = await self.async_client.post('/api/adscan/upload/async/', self._data())
+            sync_response = await sync_to_async(APIClient().post)('/api/adscan/upload/', self._data())
+        self.assertEqual(response.status_code, sync_response.status_code)
+        self.assertEqual([e['error'] for e in response.json()['errors']],
+                         [e['error'] for e in sync_response.json()['errors']])
+
+    async def test_invalid_token_is_refused(self):
+        with self.assertLogs('django.request', 'WARNING'):
+            response = await self.async_client.post('/api/adscan/upload/async/', self._data(),
+                                                    headers={'Authorization': 'Bearer not-a-token'})
+        self.assertEqual(response.status_code, 401)
+
+    async def test_full_gate_answers_503_with_retry_after(self):
+        gate = InferenceGate(workers=1, queue_size=0)
+        gate.in_flight = gate.capacity
+        with mock.patch.object(async_views, 'get_inference_gate', return_value=gate), \
+                self.assertLogs('django.request', 'ERROR'):
+            response = await self.async_client.post('/api/adscan/upload/async/', self._data(),
+                                                    headers={'Authorization': f'Bearer {self.token}'})
+        self.assertEqual((response.status_code, response['Retry-After']), (503, '7'))
+        self.assertEqual(gate.stats()['rejected'], 1)
+
+
+class _SmtpSink(socketserver.ThreadingTCPServer):
+    """Minimal local SMTP server: records messages, counts connections, can drop a connection."""
+    daemon_threads = True
+    allow_reuse_address = True
+
+    def __init__(self, drop_after=None):
+        self.messages, self.connections, self.drop_after = [], 0, drop_after
+        super().__init__(('127.0.0.1', 0), _SmtpHandler)
+
+
+class _SmtpHandler(socketserver.StreamRequestHandler):
+    def reply(self, line):
+        self.wfile.write(line.encode() + b'\r\n')
+
+    def handle(self):
+        self.server.connections += 1
+        self.reply('220 sink')
+        data = None
+        for raw in self.rfile:
+            line = raw.decode().rstrip('\r\n')
+            if data is not None:
+                if line != '.':
+                    data.append(line)
+                    continue
+                self.server.messages.append('\n'.join(data))
+                data = None
+                self.reply('250 queued')
+                if len(self.server.messages) == self.server.drop_after:
+                    return  # hang up without QUIT, like an idle timeout
+            elif line.upper().startswith('DATA'):
+                data = []
+                self.reply('354 go ahead')
+            elif line.upper().startswith('RCPT') and 'bounce@' in line:
+                self.reply('550 no such user')
+            elif line.upper().startswith('QUIT'):
+                self.reply('221 bye')
+                return
+            else:
+                self.reply('250 ok')
+
+
+class MailOutboxTests(SimpleTestCase):
+    def _sink(self, **kwargs):
+        sink = _SmtpSink(**kwargs)
+        threading.Thread(target=sink.serve_forever, daemon=True).start()
+        self.addCleanup(sink.server_close)
+        self.addCleanup(sink.shutdown)
+        connection = get_connection('django.core.mail.backends.smtp.EmailBackend', host='127.0.0.1',
+                                    port=sink.server_address[1], use_tls=False, username='', password='')
+        self.addCleanup(connection.close)
+        return sink, connection
+
+    def _emails(self, *recipients):
+        return [OutboxEmail(id=i, subject='Your 2FA Code', body=f'code {i}', to=[to], from_email='a@example.com')
+                for i, to in enumerate(recipients, start=1)]
+
+    def test_batch_reuses_one_connection(self):
+        sink, connection = self._sink()
+        outcomes = deliver(self._emails('x@example.com', 'y@example.com', 'z@example.com'), connection)
+        self.assertEqual([error for _, error in outcomes], [None, None, None])
+        self.assertEqual((len(sink.messages), sink.connections), (3, 1))
+        self.assertIn('code 2', sink.messages[1])
+
+    def test_reconnects_when_the_server_hangs_up(self):
+        sink, connection = self._sink(drop_after=1)
+        outcomes = deliver(self._emails('x@example.com', 'y@example.com'), connection)
+        self.assertEqual([error for _, error in outcomes], [None, None])
+        self.assertEqual((len(sink.messages), sink.connections), (2, 2))
+
+    def test_rejected_recipient_is_permanent(self):
+        sink, connection = self._sink()
+        (_, error), (_, ok) = deliver(self._emails('bounce@example.com', 'y@example.com'), connection)
+        self.assertTrue(is_permanent(error))
+        self.assertIsNone(ok)
+        self.assertFalse(is_permanent(smtplib.SMTPResponseException(421, 'try later')))
+
+    @override_settings(ADSCAN_MAIL_RETRY_BASE_SECONDS=5, ADSCAN_MAIL_RETRY_MAX_SECONDS=60)
+    def test_retry_backoff(self):
+        self.assertEqual([retry_delay(n) for n in range(1, 6)], [5, 10, 20, 40, 60])
 
-# Create your tests here.
@@ -0,0 +1,116 @@
+"""
+TFLite runtime for the light-skin model.
+
+`manage.py export_light_tflite` converts settings.MODEL_PATH_LIGHT to a .tflite file with
+dynamic-range or int8 quantization. With settings.ADSCAN_LIGHT_RUNTIME = 'tflite',
+get_ad_model_light() returns a TFLiteLightModel instead of the Keras model: it exposes the
+same `predict(batch, verbose=0)` -> (N, 1) contract, so every caller keeps working, but
+runs on tf.lite.Interpreter (or the standalone tflite_runtime package when installed).
+Interpreters are not thread-safe, so each thread gets its own. Like CompiledKerasModel,
+batches are zero-padded up to the next of settings.ADSCAN_BATCH_BUCKETS and larger ones
+are split into chunks of the largest, so a thread holds at most one interpreter per bucket.
+`manage.py tflite_parity` compares it against the Keras model on a folder of images.
+"""
+import threading
+
+import numpy as np
+from django.conf import settings
+
+
+def _interpreter_class():
+    try:
+        from tflite_runtime.interpreter import Interpreter  # type: ignore  # small runtime-only wheel
+    except ImportError:
+        from tensorflow.lite import Interpreter  # type: ignore
+    return Interpreter
+
+
+class TFLiteLightModel:
+    """Keras-compatible wrapper around a light-model .tflite file."""
+
+    def __init__(self, model_path, num_threads=None, buckets=(1, 4, 8, 16)):
+        self.model_path = str(model_path)
+        with open(self.model_path, 'rb') as fh:
+            self._content = fh.read()
+        self.num_threads = num_threads
+        self.buckets = tuple(sorted(buckets))
+        self._interpreter_cls = _interpreter_class()
+        self._local = threading.local()
+
+    def _interpreter(self, batch_size):
+        cache = getattr(self._local, 'interpreters', None)
+        if cache is None:
+            cache = self._local.interpreters = {}
+        interpreter = cache.get(batch_size)
+        if interpreter is None:
+            interpreter = self._interpreter_cls(model_content=self._content, num_threads=self.num_threads)
+            input_index = interpreter.get_input_details()[0]['index']
+            interpreter.resize_tensor_input(input_index, [batch_size, 224, 224, 3])
+            interpreter.allocate_tensors()
+            cache[batch_size] = interpreter
+        return interpreter
+
+    def predict(self, batch, verbose=0):
+        batch = np.asarray(batch, dtype='float32')
+        if batch.ndim == 3:
+            batch = np.expand_dims(batch, axis=0)
+        largest = self.buckets[-1]
+        outputs = []
+        for start in range(0, len(batch), largest):
+            chunk = batch[start:start + largest]
+            n = len(chunk)
+            size = next(b for b in self.buckets if b >= n)
+            if size > n:
+                chunk = np.concatenate([chunk, np.zeros((size - n,) + chunk.shape[1:], dtype='float32')])
+            outputs.append(self._invoke(chunk)[:n])
+        return np.concatenate(outputs, axis=0)
+
+    def _invoke(self, batch):
+        interpreter = self._interpreter(len(batch))
+        input_details = interpreter.get_input_details()[0]
+        output_details = interpreter.get_output_details()[0]
+
+        if input_details['dtype'] in (np.int8, np.uint8):  # full-integer model with quantized I/O
+            scale, zero_point = input_details['quantization']
+            batch = np.round(batch / scale + zero_point).astype(input_details['dtype'])
+        interpreter.set_tensor(input_details['index'], batch)
+        interpreter.invoke()
+        output = interpreter.get_tensor(output_details['index'])
+        if output_details['dtype'] in (np.int8, np.uint8):
+            scale, zero_point = output_details['quantization']
+            output = (output.astype('float32') - zero_point) * scale
+        return np.asarray(output, dtype='float32').reshape(len(batch), -1)
+
+
+def load_light_tflite():
+    model_path = getattr(settings, 'MODEL_PATH_LIGHT_TFLITE', None)
+    if not model_path:
+        raise RuntimeError("MODEL_PATH_LIGHT_TFLITE not configured in settings.")
+    return TFLiteLightModel(model_path, num_threads=getattr(settings, 'ADSCAN_TFLITE_NUM_THREADS', None),
+                            buckets=getattr(settings, 'ADSCAN_BATCH_BUCKETS', (1, 4, 8, 16)))
+
+
+def convert_light_model(keras_path, quantization='dynamic', calibration_images=()):
+    """
+    Convert the Keras light model to TFLite bytes.
+    quantization: 'none' (float32), 'dynamic' (int8 weights, float activations) or 'int8'
+    (int8 weights and activations, calibrated on `calibration_images` paths; float I/O kept).
+    """
+    import tensorflow as tf  # type: ignore
+    from .preprocessing import load_image_array
+
+    model = tf.keras.models.load_model(str(keras_path))
+    converter = tf.lite.TFLiteConverter.from_keras_model(model)
+    if quantization in ('dynamic', 'int8'):
+        converter.optimizations = [tf.lite.Optimize.DEFAULT]
+    if quantization == 'int8':
+        if not calibration_images:
+            raise ValueError("int8 quantization needs calibration images.")
+
+        def representative_dataset():
+            for path in calibration_images:
+                yield [np.expand_dims(load_image_array(path), axis=0)]
+
+        converter.representative_dataset = representative_dataset
+        converter.target_spec.supported_ops = [tf.lite.OpsSet.TFLITE_BUILTINS_INT8]
+    return converter.convert()
@@ -0,0 +1,63 @@
+"""
+Derived thumbnails for AdScanImage uploads.
+
+A small JPEG/WebP copy of every upload is rendered once, at upload time, and stored under
+adscan_images/thumbs/. The PDF report embeds the thumbnail instead of decoding the original,
+and the upload/history serializers expose its URL for previews. Existing rows are filled in
+with `manage.py regenerate_thumbnails`.
+"""
+import io
+import logging
+import os
+
+from django.conf import settings
+from django.core.files.base import ContentFile
+from PIL import Image, ImageOps
+
+from .preprocessing import decoding, open_image
+
+logger = logging.getLogger(__name__)
+
+FORMAT_EXTENSIONS = {"JPEG": "jpg", "WEBP": "webp"}
+
+
+def render_thumbnail(source, size=None, fmt=None):
+    """
+    Render `source` (file object or path) to a thumbnail no larger than size x size.
+    Returns the encoded bytes; file objects are rewound afterwards.
+    """
+    size = size or getattr(settings, 'ADSCAN_THUMBNAIL_SIZE', 256)
+    fmt = (fmt or getattr(settings, 'ADSCAN_THUMBNAIL_FORMAT', 'JPEG')).upper()
+    # JPEG: let the decoder downscale by 1/2..1/8 first; oversized images raise ImageTooLarge
+    with open_image(source, (size, size), draft=True) as img, decoding(img):
+        thumb = ImageOps.exif_transpose(img).convert('RGB')
+    thumb.thumbnail((size, size), Image.LANCZOS)
+    out = io.BytesIO()
+    thumb.save(out, fmt, quality=getattr(settings, 'ADSCAN_THUMBNAIL_QUALITY', 85))
+    if hasattr(source, 'seek'):
+        source.seek(0)
+    return out.getvalue()
+
+
+def thumbnail_name(image_name, fmt=None):
+    fmt = (fmt or getattr(settings, 'ADSCAN_THUMBNAIL_FORMAT', 'JPEG')).upper()
+    stem = os.path.splitext(os.path.basename(image_name))[0]
+    return f"{stem}_thumb.{FORMAT_EXTENSIONS.get(fmt, fmt.lower())}"
+
+
+def attach_thumbnail(ad_image, source=None, save=True):
+    """
+    Render and store the thumbnail for an AdScanImage. `source` defaults to the stored
+    original; pass the in-memory upload to avoid reading it back from storage.
+    """
+    if ad_image.thumbnail:
+        ad_image.thumbnail.delete(save=False)
+    if source is None:
+        with ad_image.image.open('rb') as fh:
+            data = render_thumbnail(fh)
+    else:
+        data = render_thumbnail(source)
+    ad_image.thumbnail.save(thumbnail_name(ad_image.image.name), ContentFile(data), save=False)
+    if save:
+        ad_image.save(update_fields=['thumbnail'])
+    return ad_image.thumbnail
@@ -0,0 +1,265 @@
+"""
+Per-stage timing for the scan pipeline.
+
+Wrap a stage in `with span("preprocess", model="light"):` (or decorate a function with
+`@timed("pdf")`). Every finished span is
+
+- observed in the in-process histogram `adscan_stage_duration_seconds{stage, model}`,
+  exposed in Prometheus text format by `metrics_view` (/metrics);
+- added to the current request's timeline when ServerTimingMiddleware is installed, which
+  returns the timeline as a `Server-Timing` header and logs it as one JSON line on the
+  `users.timing` logger.
+
+Spans outside a request (PDF worker threads, management commands) only feed the histogram
+and a DEBUG log line. Histograms live in process memory: with several gunicorn workers
+each scrape sees the worker that answered it, so scrape every worker or run one.
+"""
+import contextvars
+import functools
+import hmac
+import json
+import logging
+import threading
+import time
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from django.conf import settings
+from django.http import HttpResponse, HttpResponseForbidden
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+_timeline = contextvars.ContextVar('adscan_timeline', default=None)
+
+
+def is_enabled():
+    return getattr(settings, 'ADSCAN_TIMING_ENABLED', True)
+
+
+# ============================================================
+# Histograms (Prometheus text exposition, no client library)
+# ============================================================
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _format_labels(labels):
+    return ','.join(f'{name}="{_escape(value)}"' for name, value in labels)
+
+
+class Histogram:
+    """Cumulative-bucket histogram keyed by a fixed tuple of label names."""
+
+    def __init__(self, name, documentation, label_names, buckets=DEFAULT_BUCKETS):
+        self.name = name
+        self.documentation = documentation
+        self.label_names = tuple(label_names)
+        self.buckets = tuple(sorted(buckets))
+        self._series = {}  # label values -> [bucket counts..., +Inf count, sum]
+        self._lock = threading.Lock()
+
+    def observe(self, value, *label_values):
+        with self._lock:
+            series = self._series.get(label_values)
+            if series is None:
+                series = self._series[label_values] = [0] * (len(self.buckets) + 1) + [0.0]
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    series[i] += 1
+            series[-2] += 1
+            series[-1] += value
+
+    def clear(self):
+        with self._lock:
+            self._series.clear()
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} histogram"]
+        with self._lock:
+            snapshot = {key: list(series) for key, series in self._series.items()}
+        for label_values, series in sorted(snapshot.items()):
+            labels = list(zip(self.label_names, label_values))
+            for bound, count in zip(self.buckets, series):
+                lines.append(f"{self.name}_bucket{{{_format_labels(labels + [('le', repr(float(bound)))])}}} {count}")
+            lines.append(f"{self.name}_bucket{{{_format_labels(labels + [('le', '+Inf')])}}} {series[-2]}")
+            lines.append(f"{self.name}_count{{{_format_labels(labels)}}} {series[-2]}")
+            lines.append(f"{self.name}_sum{{{_format_labels(labels)}}} {series[-1]}")
+        return lines
+
+
+STAGE_SECONDS = Histogram(
+    'adscan_stage_duration_seconds', "Time spent in each scan pipeline stage.", ('stage', 'model'),
+    buckets=getattr(settings, 'ADSCAN_TIMING_BUCKETS', DEFAULT_BUCKETS),
+)
+REQUEST_SECONDS = Histogram(
+    'adscan_request_duration_seconds', "Duration of requests that ran instrumented stages.", ('view', 'status'),
+    buckets=getattr(settings, 'ADSCAN_TIMING_BUCKETS', DEFAULT_BUCKETS),
+)
+
+
+REQUEST_DECODED_BYTES = Histogram(
+    'adscan_request_decoded_bytes', "Peak decoded image memory held at once by a scan request (estimate).", ('view',),
+    buckets=tuple(mb * 1024 * 1024 for mb in (1, 4, 16, 64, 128, 256, 512, 1024)),
+)
+
+
+MAIL_DELIVERY_SECONDS = Histogram(
+    'adscan_mail_delivery_seconds', "Time from enqueueing an email to its final outcome.", ('status',),
+    buckets=(0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 300.0, 900.0, 3600.0),
+)
+MAIL_SEND_SECONDS = Histogram(
+    'adscan_mail_send_seconds', "SMTP time per message on the outbox connection.", ('result',),
+    buckets=getattr(settings, 'ADSCAN_TIMING_BUCKETS', DEFAULT_BUCKETS),
+)
+
+
+def render_metrics():
+    histograms = (STAGE_SECONDS, REQUEST_SECONDS, REQUEST_DECODED_BYTES, MAIL_DELIVERY_SECONDS, MAIL_SEND_SECONDS)
+    return '\n'.join(line for histogram in histograms for line in histogram.render()) + '\n'
+
+
+def metrics_allowed(request):
+    """
+    With ADSCAN_METRICS_TOKEN set, only `Authorization: Bearer <token>` gets in. Without it
+    /metrics is open under DEBUG and otherwise limited to ADSCAN_METRICS_ALLOWED_IPS
+    (localhost by default) and logged-in staff.
+    """
+    token = getattr(settings, 'ADSCAN_METRICS_TOKEN', None)
+    if token:
+        return hmac.compare_digest(request.headers.get('Authorization', ''), f"Bearer {token}")
+    if settings.DEBUG:
+        return True
+    if request.META.get('REMOTE_ADDR') in getattr(settings, 'ADSCAN_METRICS_ALLOWED_IPS', ('127.0.0.1', '::1')):
+        return True
+    user = getattr(request, 'user', None)
+    return bool(user and user.is_authenticated and user.is_staff)
+
+
+def metrics_view(request):
+    """Prometheus scrape endpoint; see metrics_allowed for who may read it."""
+    if not metrics_allowed(request):
+        return HttpResponseForbidden()
+    return HttpResponse(render_metrics(), content_type='text/plain; version=0.0.4; charset=utf-8')
+
+
+# ============================================================
+# Spans
+# ============================================================
+class span:
+    """Time a block as `stage` (optionally per `model`); usable as a context manager."""
+
+    __slots__ = ('stage', 'model', 'started', 'duration')
+
+    def __init__(self, stage, model=''):
+        self.stage = stage
+        self.model = model or ''
+        self.duration = None
+
+    def __enter__(self):
+        self.started = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.duration = time.perf_counter() - self.started
+        if not is_enabled():
+            return False
+        STAGE_SECONDS.observe(self.duration, self.stage, self.model)
+        timeline = _timeline.get()
+        if timeline is not None:
+            timeline.append((self.stage, self.model, self.duration, exc_type is not None))
+        else:
+            logger.debug("span stage=%s model=%s ms=%.2f error=%s",
+                         self.stage, self.model, self.duration * 1000, exc_type is not None)
+        return False
+
+
+def timed(stage, model=''):
+    """Decorator form of `span`."""
+    def decorator(func):
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            with span(stage, model):
+                return func(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+# ============================================================
+# Request middleware
+# ============================================================
+def server_timing_header(timeline, total):
+    """Sum repeated stages (e.g. per-image validation) into one Server-Timing entry each."""
+    totals = {}
+    for stage, model, duration, _ in timeline:
+        name = f"{stage}_{model}" if model else stage
+        totals[name] = totals.get(name, 0.0) + duration
+    entries = [f"{name};dur={seconds * 1000:.1f}" for name, seconds in totals.items()]
+    entries.append(f"total;dur={total * 1000:.1f}")
+    return ', '.join(entries)
+
+
+class ServerTimingMiddleware:
+    """
+    Collect the spans of one request into a Server-Timing header and a JSON log line.
+    Sync and async capable, so async views (users/async_views.py) stay on the event loop.
+    """
+
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        if iscoroutinefunction(get_response):
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        if not is_enabled():
+            return self.get_response(request)
+        timeline = []
+        token = _timeline.set(timeline)
+        started = time.perf_counter()
+        try:
+            response = self.get_response(request)
+        finally:
+            _timeline.reset(token)
+        return self._finish(request, response, timeline, started)
+
+    async def __acall__(self, request):
+        if not is_enabled():
+            return await self.get_response(request)
+        timeline = []
+        token = _timeline.set(timeline)
+        started = time.perf_counter()
+        try:
+            response = await self.get_response(request)
+        finally:
+            _timeline.reset(token)
+        return self._finish(request, response, timeline, started)
+
+    def _finish(self, request, response, timeline, started):
+        if not timeline:
+            return response
+
+        total = time.perf_counter() - started
+        match = getattr(request, 'resolver_match', None)
+        view = (match.url_name or match.view_name) if match else ''
+        REQUEST_SECONDS.observe(total, view, str(response.status_code))
+        if getattr(settings, 'ADSCAN_SERVER_TIMING_HEADER', True):
+            response['Server-Timing'] = server_timing_header(timeline, total)
+        if logger.isEnabledFor(logging.INFO):
+            logger.info("%s", json.dumps({
+                "event": "request_timing",
+                "method": request.method,
+                "path": request.path,
+                "view": view,
+                "status": response.status_code,
+                "total_ms": round(total * 1000, 2),
+                "spans": [
+                    {"stage": stage, "model": model, "ms": round(duration * 1000, 2), "error": error}
+                    for stage, model, duration, error in timeline
+                ],
+            }))
+        return response
@@ -0,0 +1,85 @@
+"""
+Verbose inference traces (raw model outputs, extracted probabilities, fallback attempts).
+
+Hot paths call `trace("... %s", value)` instead of print. Arguments are formatted only if
+the record is emitted, and that happens only when:
+
+- the current request is traced: it sent the `X-AdScan-Debug: 1` header (honoured when
+  settings.ADSCAN_TRACE_ALLOW_HEADER is on; defaults to DEBUG) or it was picked by
+  sampling (settings.ADSCAN_TRACE_SAMPLE_RATE, a fraction of requests). Traced requests
+  log at INFO on the `users.trace` logger; or
+- the `users.trace` logger is set to DEBUG, which traces every request.
+
+Use `trace_enabled()` to guard work that is needed only for a trace, such as
+inspect.signature. Code outside a request (commands, worker threads) can use
+`with traced():`.
+"""
+import contextlib
+import contextvars
+import logging
+import random
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from django.conf import settings
+
+logger = logging.getLogger('users.trace')
+
+DEBUG_HEADER = 'X-AdScan-Debug'
+
+_traced = contextvars.ContextVar('adscan_traced', default=False)
+
+
+def _level():
+    return logging.INFO if _traced.get() else logging.DEBUG
+
+
+def trace_enabled():
+    return logger.isEnabledFor(_level())
+
+
+def trace(msg, *args):
+    logger.log(_level(), msg, *args)
+
+
+@contextlib.contextmanager
+def traced(enabled=True):
+    token = _traced.set(enabled)
+    try:
+        yield
+    finally:
+        _traced.reset(token)
+
+
+def should_trace(request):
+    """Per-request debug flag first, then sampling."""
+    allow_header = getattr(settings, 'ADSCAN_TRACE_ALLOW_HEADER', settings.DEBUG)
+    if allow_header and request.headers.get(DEBUG_HEADER, '').lower() in ('1', 'true', 'yes'):
+        return True
+    rate = getattr(settings, 'ADSCAN_TRACE_SAMPLE_RATE', 0.0)
+    return rate > 0 and random.random() < rate
+
+
+class RequestTraceMiddleware:
+    """Marks the request as traced (see module docstring) for the duration of the view."""
+
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        if iscoroutinefunction(get_response):
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        if not should_trace(request):
+            return self.get_response(request)
+        with traced():
+            return self.get_response(request)
+
+    async def __acall__(self, request):
+        if not should_trace(request):
+            return await self.get_response(request)
+        with traced():
+            return await self.get_response(request)
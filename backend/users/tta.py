@@ -0,0 +1,112 @@
+"""
+Test-time augmentation (TTA) for the AD models.
+
+The notebook trained with ImageDataGenerator(rotation_range=20, horizontal_flip=True,
+zoom_range=0.2), so the views here stay inside that distribution: horizontal flips, a
+center zoom-in, and small rotations cropped to their inscribed square (no fill pixels,
+which the training data never had). Views are built from the already fitted 224x224
+image, stacked into one (N * K, 224, 224, 3) tensor and scored in one forward pass; the
+per-image mean and variance of the K probabilities are returned.
+
+Modes (settings.ADSCAN_TTA_MODE, or the `tta` field of an upload):
+- 'off':    single center view (default).
+- 'auto':   TTA only for images whose first-pass probability lies within
+            ADSCAN_TTA_BAND of the model's decision threshold.
+- 'always': TTA for every image.
+"""
+import math
+
+import numpy as np
+from django.conf import settings
+from PIL import Image
+
+from .model_registry import DARK_AD_THRESHOLD, LIGHT_AD_THRESHOLD
+
+TTA_MODES = ('off', 'auto', 'always')
+
+# (horizontal flip, zoom-in factor, rotation degrees), in the order they are added as K grows
+VIEWS = (
+    (False, 1.0, 0),
+    (True, 1.0, 0),
+    (False, 1.1, 0),
+    (True, 1.1, 0),
+    (False, 1.0, 10),
+    (False, 1.0, -10),
+    (True, 1.0, 10),
+    (True, 1.0, -10),
+)
+
+
+def get_tta_mode(requested=None):
+    mode = (requested or getattr(settings, 'ADSCAN_TTA_MODE', 'off')).lower()
+    return mode if mode in TTA_MODES else 'off'
+
+
+def view_count():
+    return max(1, min(getattr(settings, 'ADSCAN_TTA_VIEWS', 6), len(VIEWS)))
+
+
+def _probabilities(model_type, raw):
+    """Model probabilities (one per model) from a raw score_batch output."""
+    if model_type == 'both':
+        return _probabilities('light', raw['light']) + _probabilities('dark', raw['dark'])
+    if model_type == 'dark':
+        return [(float(raw['probability']), DARK_AD_THRESHOLD)]
+    return [(float(raw), LIGHT_AD_THRESHOLD)]
+
+
+def near_threshold(model_type, raw, band=None):
+    """True when any model's first-pass probability is within `band` of its threshold."""
+    band = getattr(settings, 'ADSCAN_TTA_BAND', 0.1) if band is None else band
+    return any(abs(prob - threshold) < band for prob, threshold in _probabilities(model_type, raw))
+
+
+def _augment(img, flip, zoom, degrees):
+    width, height = img.size
+    if flip:
+        img = img.transpose(Image.FLIP_LEFT_RIGHT)
+    if degrees:
+        img = img.rotate(degrees, resample=Image.BILINEAR)
+        # the largest centered square free of rotation corners
+        rad = math.radians(abs(degrees))
+        zoom *= math.cos(rad) + math.sin(rad)
+    if zoom != 1.0:
+        crop_w, crop_h = width / zoom, height / zoom
+        left, top = (width - crop_w) / 2, (height - crop_h) / 2
+        img = img.resize((width, height), Image.BILINEAR, box=(left, top, left + crop_w, top + crop_h))
+    return img
+
+
+def augmented_batch(batch, k=None):
+    """
+    (N, H, W, 3) float32 batch in [0, 1] -> (N * k, H, W, 3), the k views of image i at rows
+    i*k .. i*k + k - 1. View 0 is the input itself.
+    """
+    k = k or view_count()
+    batch = np.asarray(batch, dtype='float32')
+    out = np.empty((len(batch) * k,) + batch.shape[1:], dtype='float32')
+    for i, array in enumerate(batch):
+        # fitted_to_array divided uint8 pixels by 255, so this round trip is exact
+        img = Image.fromarray(np.rint(array * 255.0).astype('uint8'))
+        out[i * k] = array
+        for j, (flip, zoom, degrees) in enumerate(VIEWS[1:k], start=1):
+            np.divide(np.asarray(_augment(img, flip, zoom, degrees)), np.float32(255.0),
+                      out=out[i * k + j], dtype=np.float32)
+    return out
+
+
+def _moments(probabilities):
+    probs = np.asarray(probabilities, dtype='float64')
+    return {"views": len(probs), "mean": float(probs.mean()), "variance": float(probs.var())}
+
+
+def summarize(model_type, outputs):
+    """Mean/variance over the K raw outputs of one image ({"light", "dark"} for 'both')."""
+    if model_type == 'both':
+        return {
+            "light": summarize('light', [o['light'] for o in outputs]),
+            "dark": summarize('dark', [o['dark'] for o in outputs]),
+        }
+    if model_type == 'dark':
+        return _moments([float(o['probability']) for o in outputs])
+    return _moments([float(o) for o in outputs])
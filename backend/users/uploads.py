@@ -0,0 +1,146 @@
+"""
+Streaming handling for AdScan image uploads.
+
+AdScanUploadHandler replaces Django's memory/temp-file upload handlers on the scan
+endpoints (see StreamingUploadMixin). While the multipart body is read from the network it
+
+- checks the first bytes against the JPEG/PNG signatures,
+- stops buffering a file once it passes settings.ADSCAN_MAX_UPLOAD_BYTES, and stops
+  buffering any more files once the request holds ADSCAN_MAX_UPLOAD_REQUEST_BYTES,
+- feeds every chunk into a SHA-256.
+
+Each file arrives as one in-memory ScannedUpload carrying `.sha256` (used as the
+prediction-cache key) and `.upload_error` (the reason it was rejected, or None). The same
+buffer is then validated (UploadedImageField), saved and scored, so the body is read
+from the socket once and never spooled to disk. Rejected files still appear in
+request.FILES so the view can report them per image.
+"""
+import hashlib
+import io
+
+from django.conf import settings
+from django.core.files.uploadedfile import InMemoryUploadedFile
+from django.core.files.uploadhandler import FileUploadHandler
+from rest_framework import serializers
+
+from .preprocessing import ImageTooLarge, open_image, request_decode_budget
+from .timing import REQUEST_DECODED_BYTES
+
+IMAGE_SIGNATURES = (
+    b'\xff\xd8\xff',  # JPEG
+    b'\x89PNG\r\n\x1a\n',  # PNG
+)
+SIGNATURE_BYTES = max(len(s) for s in IMAGE_SIGNATURES)
+
+INVALID_TYPE_ERROR = 'Invalid image type. Allowed types: jpeg, png.'
+
+
+def max_upload_bytes():
+    return getattr(settings, 'ADSCAN_MAX_UPLOAD_BYTES', 5 * 1024 * 1024)
+
+
+def too_large_error():
+    return f'Image too large. Max size is {max_upload_bytes() // (1024 * 1024)} MB.'
+
+
+class ScannedUpload(InMemoryUploadedFile):
+    """In-memory upload with the digest and verdict computed while it streamed in."""
+
+    def __init__(self, *args, sha256=None, upload_error=None, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.sha256 = sha256
+        self.upload_error = upload_error
+
+
+class AdScanUploadHandler(FileUploadHandler):
+    def __init__(self, request=None):
+        super().__init__(request)
+        self.request_bytes = 0
+
+    def new_file(self, *args, **kwargs):
+        super().new_file(*args, **kwargs)
+        self.buffer = io.BytesIO()
+        self.digest = hashlib.sha256()
+        self.head = b''
+        self.error = None
+        if self.request_bytes >= getattr(settings, 'ADSCAN_MAX_UPLOAD_REQUEST_BYTES', 64 * 1024 * 1024):
+            self.error = 'Too many images in one upload.'
+
+    def receive_data_chunk(self, raw_data, start):
+        if self.error:
+            return None  # drain the rest of this part without keeping it
+        if len(self.head) < SIGNATURE_BYTES:
+            self.head += raw_data[:SIGNATURE_BYTES - len(self.head)]
+            if len(self.head) >= SIGNATURE_BYTES and not self.head.startswith(IMAGE_SIGNATURES):
+                self.error = INVALID_TYPE_ERROR
+                return None
+        if start + len(raw_data) > max_upload_bytes():
+            self.error = too_large_error()
+            return None
+        self.buffer.write(raw_data)
+        self.digest.update(raw_data)
+        self.request_bytes += len(raw_data)
+        return None
+
+    def file_complete(self, file_size):
+        if not self.error and not self.head.startswith(IMAGE_SIGNATURES):
+            self.error = INVALID_TYPE_ERROR  # shorter than any signature
+        if self.error:
+            self.buffer = io.BytesIO()
+        self.buffer.seek(0)
+        return ScannedUpload(
+            file=self.buffer,
+            field_name=self.field_name,
+            name=self.file_name,
+            content_type=self.content_type,
+            size=file_size,
+            charset=self.charset,
+            content_type_extra=self.content_type_extra,
+            sha256=None if self.error else self.digest.hexdigest(),
+            upload_error=self.error,
+        )
+
+
+class StreamingUploadMixin:
+    """
+    APIView mixin: parse multipart uploads with AdScanUploadHandler only, and account the
+    images decoded by the request (preprocessing.request_decode_budget).
+    """
+
+    def initialize_request(self, request, *args, **kwargs):
+        request.upload_handlers = [AdScanUploadHandler(request)]
+        return super().initialize_request(request, *args, **kwargs)
+
+    def dispatch(self, request, *args, **kwargs):
+        with request_decode_budget() as budget:
+            response = super().dispatch(request, *args, **kwargs)
+        if budget.peak:
+            REQUEST_DECODED_BYTES.observe(budget.peak, type(self).__name__)
+        return response
+
+
+class UploadedImageField(serializers.ImageField):
+    """
+    ImageField that reports the streaming handler's verdict, checks the pixel budget from
+    the header before PIL verifies the file, and verifies each file object only once,
+    however many serializers validate it.
+    """
+
+    def to_internal_value(self, data):
+        error = getattr(data, 'upload_error', None)
+        if error:
+            raise serializers.ValidationError(error)
+        if getattr(data, 'image_verified', False):
+            return serializers.FileField.to_internal_value(self, data)
+        try:
+            open_image(data)  # header only
+        except ImageTooLarge as e:
+            raise serializers.ValidationError(str(e))
+        except Exception:
+            pass  # not an image at all: ImageField reports it below
+        finally:
+            if hasattr(data, 'seek'):
+                data.seek(0)
+        value = super().to_internal_value(data)
+        data.image_verified = True
+        return value
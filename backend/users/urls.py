@@ -1,6 +1,7 @@
 from django.urls import path
 from .views import admin_stats, admin_analytics, RegisterView, LoginView, Verify2FAView, CreateAdminView, Resend2FAView, ContactMessageListCreateView, UserProfileView, UserContactMessagesView, AdScanImageUploadView, AdScanAPIView, universal_symptom_assessment, ChatListCreateView, ChatRetrieveUpdateDestroyView, diagnose_model_issue, model_health_check, debug_model_performance, save_adscan, get_scan_history, get_scan_details, download_scan_pdf, delete_scan, user_dashboard
 from rest_framework_simplejwt.views import TokenRefreshView
+from .async_views import adscan_single_async, adscan_upload_async, model_health_async
 from .views import UserListCreateView, UserRetrieveUpdateDestroyView, MessageReplyListCreateView, ContactMessageUpdateDeleteView, MessageReplyUpdateView
 
 urlpatterns = [
@@ -21,6 +22,9 @@ urlpatterns = [
     path("adscan/upload/", AdScanImageUploadView.as_view(), name="adscan-upload"),
     path("adscan/save/", save_adscan, name="adscan-save"),  # <-- add this route
     path('api/adscan/', AdScanAPIView.as_view(), name='adscan-single'),
+    # async (ASGI) variants with bounded inference and 503 + Retry-After, see users/async_views.py
+    path("adscan/upload/async/", adscan_upload_async, name="adscan-upload-async"),
+    path('api/adscan/async/', adscan_single_async, name='adscan-single-async'),
     path('universal-assessment/', universal_symptom_assessment, name='universal-assessment'),
     path("admin/stats/", admin_stats, name="admin-stats"),
     path("admin/analytics/", admin_analytics, name="admin-analytics"),
@@ -28,6 +32,7 @@ urlpatterns = [
     path('chats/<int:pk>/', ChatRetrieveUpdateDestroyView.as_view(), name='chat-detail'),
     path('api/model-diagnose/', diagnose_model_issue, name='model-diagnose'),
     path('api/model-health/', model_health_check, name='model-health'),
+    path('api/model-health/async/', model_health_async, name='model-health-async'),
     path('api/debug-model/', debug_model_performance, name='debug-model'),
     path('scan-history/', get_scan_history, name='scan-history'),
     path('scan-details/<int:chat_id>/', get_scan_details, name='scan-details'),
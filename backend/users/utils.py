@@ -1,8 +1,7 @@
 import random
-from django.core.mail import send_mail
+from .mail_outbox import enqueue_email
 from .models import Email2FACode
 from django.conf import settings
-from tensorflow.keras.models import load_model
 from PIL import Image
 import numpy as np
 
@@ -11,18 +10,18 @@ _model = None
 def get_model():
     global _model
     if _model is None:
+        from tensorflow.keras.models import load_model  # lazy: keep TensorFlow out of import time
         _model = load_model(str(settings.MODEL_PATH))
     return _model
 
-def generate_2fa_code(user):
+def generate_2fa_code(user, resend=False):
+    """Store a new 2FA code and queue its email (sent by users.mail_outbox, not inline)."""
     code = str(random.randint(100000, 999999))
     Email2FACode.objects.create(user=user, code=code)
-    send_mail(
+    enqueue_email(
         'Your 2FA Code',
-        f'Your 2FA code is: {code}',
-        None,  # Uses DEFAULT_FROM_EMAIL
-        [user.email],
-        fail_silently=False,
+        f'Your new 2FA code is: {code}' if resend else f'Your 2FA code is: {code}',
+        [user.email],  # from DEFAULT_FROM_EMAIL
     )
     return code
 
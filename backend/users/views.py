@@ -10,9 +10,7 @@ from rest_framework.views import APIView
 from rest_framework.response import Response
 from rest_framework import status
 from django.contrib.auth.models import User
-from .models import Email2FACode, ContactMessage, MessageReply, AdScanImage, Chat  # Ensure AdScanImage is included here
-import random
-from django.core.mail import send_mail
+from .models import Email2FACode, ContactMessage, MessageReply, AdScanImage, Chat, Prediction  # Ensure AdScanImage is included here
 from rest_framework.authentication import SessionAuthentication, BasicAuthentication
 from rest_framework_simplejwt.tokens import RefreshToken
 from rest_framework.parsers import MultiPartParser, FormParser
@@ -24,172 +22,39 @@ from rest_framework.permissions import IsAuthenticated
 
 # new imports for model connection and prediction
 from django.conf import settings
-from tensorflow.keras.applications.mobilenet_v2 import preprocess_input  # type: ignore
-from tensorflow.keras.models import load_model  # type: ignore
-from PIL import Image, ImageOps
+from PIL import Image
 import numpy as np
-import joblib
 import tempfile
 import os
-from reportlab.lib.pagesizes import letter
-from reportlab.pdfgen import canvas
-from reportlab.lib.utils import ImageReader
-from django.core.files.base import ContentFile
 import io
 from .models import Chat
-from .serializers import ChatSerializer
+from .serializers import ChatSerializer, ScanHistorySerializer
+from rest_framework.pagination import CursorPagination
+from rest_framework.exceptions import ValidationError
 from django.http import FileResponse  # <-- added FileResponse import
 from django.utils import timezone
 from datetime import timedelta
+from django.db.models import Avg, Count, Q, Sum
+from django.db.models.functions import TruncDate
+
+from .model_registry import get_ad_model_light, get_ad_model_dark
+from .preprocessing import fitted_to_array, load_fitted_image, preprocess_batch
+from .inference_service import get_inference_backend, run_batch
+from .model_registry import DARK_AD_THRESHOLD, LIGHT_AD_THRESHOLD
+from . import prediction_cache
+from .pdf_reports import enqueue_pdf_report
+from .utils import generate_2fa_code
+from .prediction_records import record_predictions
+from .thumbnails import attach_thumbnail
+from .timing import span
+from .tracing import trace, trace_enabled
+from .uploads import StreamingUploadMixin
+from . import tta as tta_views
+
+logger = logging.getLogger(__name__)
 
 # Create your views here.
 
-# ============================================================
-# Model loaders for BOTH models (light and dark skin)
-# ============================================================
-_ad_model_light = None
-_ad_model_dark = None
-
-def get_ad_model_light():
-    global _ad_model_light
-    if _ad_model_light is None:
-        model_path = getattr(settings, 'MODEL_PATH_LIGHT', None)
-        if not model_path:
-            raise RuntimeError("MODEL_PATH_LIGHT not configured in settings.")
-        _ad_model_light = load_model(str(model_path))
-        print("✅ Light skin model loaded successfully")
-    return _ad_model_light
-
-def get_ad_model_dark():
-    global _ad_model_dark
-    if _ad_model_dark is None:
-        model_path = getattr(settings, 'MODEL_PATH_DARK', None)
-        if not model_path:
-            raise RuntimeError("MODEL_PATH_DARK not configured in settings.")
-        
-        # Load the deployable model (joblib serialized)
-        _ad_model_dark = joblib.load(str(model_path))
-        print("✅ Dark skin model (deployable) loaded successfully")
-        
-        # CRITICAL FIX: Inject a robust predict_single_image wrapper that ensures PIL/numpy are used
-        if hasattr(_ad_model_dark, 'predict_single_image'):
-            from PIL import Image as PILImage, ImageOps as PILImageOps
-            import numpy as _np
-            import os
-
-            original_predict = _ad_model_dark.predict_single_image
-
-            def fixed_predict_single_image(image_path, use_hybrid=True):
-                try:
-                    # Preprocess exactly like Colab / app expectations
-                    img = PILImage.open(image_path).convert('RGB')
-                    img = PILImageOps.fit(img, (224, 224), PILImage.BILINEAR)
-                    img_array = _np.array(img).astype('float32') / 255.0
-                    img_array_expanded = _np.expand_dims(img_array, axis=0)
-
-                    # Hybrid path if model exposes feature_extractor + classifier
-                    if use_hybrid and hasattr(_ad_model_dark, 'feature_extractor') and hasattr(_ad_model_dark, 'classifier'):
-                        try:
-                            features = _ad_model_dark.feature_extractor.predict(img_array_expanded, verbose=0)
-                            features_flat = features.reshape(features.shape[0], -1)
-                            # classifier may be sklearn-like with predict_proba
-                            if hasattr(_ad_model_dark.classifier, 'predict_proba'):
-                                prob = float(_ad_model_dark.classifier.predict_proba(features_flat)[0][1])
-                            else:
-                                prob = float(_ad_model_dark.classifier.predict(features_flat)[0])
-                            prediction = "AD" if prob > getattr(_ad_model_dark, 'optimal_threshold', 0.5) else "Not AD"
-                            model_used = "Hybrid"
-                        except Exception as e_feat:
-                            # fallback to original predict if hybrid step fails
-                            try:
-                                raw = original_predict(image_path, use_hybrid=use_hybrid)
-                                if isinstance(raw, dict) and raw.get('probability') is not None:
-                                    prob = float(raw.get('probability', 0.5))
-                                    prediction = raw.get('prediction', 'Error')
-                                else:
-                                    prob = 0.5
-                                    prediction = "Error"
-                                model_used = raw.get('model_used', 'Original')
-                            except Exception:
-                                prob = 0.5
-                                prediction = "Error"
-                                model_used = "Error"
-                    else:
-                        # Original model path: try to use known attribute original_model or fall back to original_predict
-                        if hasattr(_ad_model_dark, 'original_model'):
-                            try:
-                                pred = _ad_model_dark.original_model.predict(img_array_expanded, verbose=0)
-                                # handle nested array outputs
-                                if hasattr(pred, '__len__') and len(pred) > 0:
-                                    p0 = pred[0]
-                                    prob = float(p0[0]) if (hasattr(p0, '__len__') and len(p0) > 0) else float(p0)
-                                else:
-                                    prob = float(pred)
-                                prediction = "AD" if prob > 0.5 else "Not AD"
-                                model_used = "Original"
-                            except Exception:
-                                try:
-                                    raw = original_predict(image_path, use_hybrid=use_hybrid)
-                                    if isinstance(raw, dict) and raw.get('probability') is not None:
-                                        prob = float(raw.get('probability', 0.5))
-                                        prediction = raw.get('prediction', 'Error')
-                                    else:
-                                        prob = 0.5
-                                        prediction = "Error"
-                                    model_used = raw.get('model_used', 'Original')
-                                except Exception:
-                                    prob = 0.5
-                                    prediction = "Error"
-                                    model_used = "Error"
-                        else:
-                            # fallback: call original_predict and interpret dict / numeric results
-                            try:
-                                raw = original_predict(image_path, use_hybrid=use_hybrid)
-                                if isinstance(raw, dict):
-                                    prob = float(raw.get('probability', raw.get('prob', 0.5)))
-                                    prediction = raw.get('prediction', 'Error')
-                                    model_used = raw.get('model_used', 'Original')
-                                elif hasattr(raw, '__float__'):
-                                    prob = float(raw)
-                                    prediction = "AD" if prob > 0.5 else "Not AD"
-                                    model_used = "Original"
-                                else:
-                                    prob = 0.5
-                                    prediction = "Error"
-                                    model_used = "Original"
-                            except Exception:
-                                prob = 0.5
-                                prediction = "Error"
-                                model_used = "Error"
-
-                    return {
-                        'prediction': prediction,
-                        'probability': float(prob),
-                        'confidence': 'High' if abs(prob - 0.5) > 0.3 else 'Medium',
-                        'model_used': model_used,
-                        'threshold_used': getattr(_ad_model_dark, 'optimal_threshold', (0.3 if use_hybrid else 0.5)),
-                        'success': True
-                    }
-
-                except Exception as e:
-                    return {
-                        'prediction': 'Error',
-                        'probability': 0.5,
-                        'confidence': 'Unknown',
-                        'model_used': 'Error',
-                        'error': str(e),
-                        'success': False
-                    }
-
-            # Replace the method with our fixed version
-            try:
-                _ad_model_dark.predict_single_image = fixed_predict_single_image
-                print("🎯 Fixed predict_single_image method with proper imports and fallbacks")
-            except Exception as e_set:
-                print("⚠️ Failed to replace predict_single_image:", e_set)
-            
-    return _ad_model_dark
-
 # ============================================================
 # UPDATED Prediction functions with consistent preprocessing
 # ============================================================
@@ -197,119 +62,30 @@ def predict_ad_light(image_file):
     """
     Original model for light skin tones - FIXED with consistent preprocessing
     """
-    model = get_ad_model_light()
-    target_size = (224, 224)
-
     try:
-        # Reset file pointer
-        if hasattr(image_file, 'seek'):
-            image_file.seek(0)
-            
-        # Use EXACTLY the same preprocessing as Colab
-        img = Image.open(image_file).convert('RGB')
-        img = ImageOps.fit(img, target_size, Image.BILINEAR)  # Same as Colab
-        x = np.array(img).astype('float32') / 255.0           # Same as Colab
-        x = np.expand_dims(x, 0)
-
-        # Predict
-        raw_probability = float(model.predict(x, verbose=0)[0][0])
-
-        # Your existing logic (kept)
-        is_ad = raw_probability < 0.31
-        label = "ad" if is_ad else "not_ad"
-        confidence = (1 - raw_probability) if is_ad else raw_probability
-
-        return {
-            "label": label,
-            "score": float(confidence),
-            "confidence": float(confidence),
-            "is_atopic_dermatitis": bool(is_ad),
-            "raw_probability": float(raw_probability),
-            "model_used": "General Model (Light Skin Optimized)"
-        }
+        # Same Colab preprocessing; cached by content hash, otherwise scored inline or through
+        # the inference service (which may batch it with other requests)
+        fitted = {}
+        raw_probability = _score_files('light', [image_file], fitted)[0]
+        if isinstance(raw_probability, Exception):
+            raise raw_probability
+
+        summary = _tta_summaries('light', [image_file], [raw_probability], fitted=fitted)[0]
+        return _light_prediction(float(raw_probability), summary)
     except Exception as e:
-        print(f"❌ Error in predict_ad_light: {e}")
+        logger.warning("predict_ad_light failed: %s", e)
         raise
 
 def predict_ad_dark(image_file):
     """
     Deployable model for dark skin tones - FIXED to match Colab preprocessing
     """
-    model = get_ad_model_dark()
-    
-    tmp_path = None
     try:
-        # Step 1: Use EXACTLY the same preprocessing as in Colab
-        img = Image.open(image_file).convert('RGB')
-        
-        # CRITICAL FIX: Use the same ImageOps.fit as in Colab
-        img = ImageOps.fit(img, (224, 224), Image.BILINEAR)  # Must match Colab
-        
-        # Save to temp file with proper preprocessing
-        with tempfile.NamedTemporaryFile(delete=False, suffix='.jpg') as tmp_file:
-            img.save(tmp_file, format='JPEG', quality=95)
-            tmp_path = tmp_file.name
-        
-        # Debug info
-        print(f"🖼️  Preprocessed image: {img.size}, mode: {img.mode}")
-        print(f"📁 Temp path: {tmp_path}")
-        
-        # Step 2: Call the model (matches your Colab deployable model)
-        # NOTE: some deployable models execute code that expects "Image" to exist in globals
-        # (e.g. using PIL.Image as Image without importing). Retry with a small injection
-        # if that specific NameError appears in the returned result.
-        result = None
-        try:
-            result = model.predict_single_image(tmp_path, use_hybrid=True)
-        except Exception as e:
-            # If the model raises directly, capture for retry below
-            result = {"error": str(e), "prediction": "Error", "probability": 0.5, "confidence": "Unknown", "model_used": "Error", "success": False}
-            print(f"⚠️ predict_single_image threw exception: {e}")
-
-        # If model returned an error mentioning missing 'Image', attempt a targeted retry
-        needs_injection = False
-        if isinstance(result, dict):
-            err = str(result.get("error") or "")
-            if "name 'Image' is not defined" in err or "NameError: Image" in err:
-                needs_injection = True
-
-        if needs_injection:
-            # Inject PIL.Image as "Image" into builtins for the duration of the call
-            import builtins
-            from PIL import Image as PILImage
-            had_image = hasattr(builtins, 'Image')
-            old_image = getattr(builtins, 'Image', None)
-            builtins.Image = PILImage
-            try:
-                print("🔧 Injected PIL.Image as 'Image' into builtins and retrying predict_single_image()")
-                try:
-                    result = model.predict_single_image(tmp_path, use_hybrid=True)
-                except Exception as e2:
-                    # keep the exception info in result for downstream logging
-                    print(f"⚠️ Retry also failed: {e2}")
-                    result = {"error": str(e2), "prediction": "Error", "probability": 0.5, "confidence": "Unknown", "model_used": "Error", "success": False}
-            finally:
-                # restore builtins.Image to previous state
-                if had_image:
-                    builtins.Image = old_image
-                else:
-                    try:
-                        delattr(builtins, 'Image')
-                    except Exception:
-                        pass
+        # Step 1 + 2: Colab preprocessing (ImageOps.fit, BILINEAR), then the model in memory
+        # (temp-file path only as compatibility fallback); repeated images come from the cache
+        result = _cached_dark_raw(image_file)
 
-        # Final fallback: if result still indicates error, try calling without use_hybrid
-        if isinstance(result, dict) and result.get("success") is False and "error" in result:
-            try:
-                print("🔁 Fallback: calling predict_single_image without use_hybrid")
-                result = model.predict_single_image(tmp_path)
-            except Exception as e3:
-                print(f"❌ Final fallback failed: {e3}")
-                # keep previous result; do not raise here to preserve behavior
-                result = result if result is not None else {"error": str(e3), "prediction": "Error", "probability": 0.5, "confidence": "Unknown", "model_used": "Error", "success": False}
-
-        # Debug: Log full result
-        print(f"📊 Full result: {result}")
+        trace("predict_ad_dark raw result: %r", result)
         
         # Extract probability - handle different result structures
         if isinstance(result, dict):
@@ -322,16 +98,16 @@ def predict_ad_dark(image_file):
             prediction_label = "AD" if prob > 0.5 else "Not AD"
             confidence_level = "Medium"
         
-        print(f"📊 Extracted probability: {prob}")
+        trace("predict_ad_dark extracted probability: %s (%s)", prob, prediction_label)
         
         # Use the optimal threshold from your tested model
-        OPTIMAL_THRESHOLD = 0.3  # From your Colab testing
+        OPTIMAL_THRESHOLD = DARK_AD_THRESHOLD  # From your Colab testing
         
         # Determine final prediction
         is_ad = prob >= OPTIMAL_THRESHOLD
         label = "ad" if is_ad else "not_ad"
         
-        print(f"🎯 Final: label={label}, is_ad={is_ad}, threshold={OPTIMAL_THRESHOLD}")
+        trace("predict_ad_dark final: label=%s is_ad=%s threshold=%s", label, is_ad, OPTIMAL_THRESHOLD)
         
         return {
             "label": label,
@@ -344,96 +120,367 @@ def predict_ad_dark(image_file):
             "threshold_used": OPTIMAL_THRESHOLD
         }
 
-    except Exception as e:
-        print(f"❌ Error in predict_ad_dark: {e}")
-        import traceback
-        print(f"🔍 Full traceback: {traceback.format_exc()}")
+    except Exception:
+        logger.exception("predict_ad_dark failed")
         raise
-    finally:
-        # Cleanup
-        if tmp_path and os.path.exists(tmp_path):
-            try:
-                os.unlink(tmp_path)
-            except:
-                pass
 
 # ============================================================
-# FIXED dark-model wrapper (non-destructive retries, robust parsing)
+# Batched prediction (one forward pass per upload request)
 # ============================================================
-def predict_ad_dark_fixed(image_file):
+def _score_files(model_type, image_files, fitted=None):
     """
-    Safer wrapper around the deployable dark-skin model with enhanced debug logging.
+    Preprocess and score several files with one forward pass, consulting the prediction
+    cache first. Returns a list aligned with `image_files` holding the raw model output
+    (see inference_service.score_batch) or the exception raised for that image.
+    When a dict is passed as `fitted`, it receives {position: fitted (224, 224, 3) array}
+    for every image decoded here; the arrays are views of this thread's reused batch
+    buffer, valid until the next preprocess_batch(reuse_buffer=True) call.
+    """
+    results = [None] * len(image_files)
+    with span("digest"):
+        digests = [prediction_cache.image_digest(f) for f in image_files]
+    with span("cache_lookup", model_type):
+        hits = prediction_cache.lookup(model_type, digests)
+
+    to_decode = []
+    duplicates = []  # (pos, first pos with the same bytes) - scored once per request
+    first_seen = {}
+    for pos in range(len(image_files)):
+        digest = digests[pos]
+        if digest in hits:
+            results[pos] = hits[digest]
+            continue
+        if digest in first_seen:
+            duplicates.append((pos, first_seen[digest]))
+            continue
+        first_seen[digest] = pos
+        to_decode.append(pos)
+
+    positions = []
+    if to_decode:
+        with span("preprocess"):
+            batch, failures = preprocess_batch([image_files[pos] for pos in to_decode], reuse_buffer=True)
+        for i, pos in enumerate(to_decode):
+            if i in failures:
+                results[pos] = failures[i]
+            else:
+                positions.append(pos)
+        if fitted is not None:
+            fitted.update(zip(positions, batch))
+
+    if positions:
+        try:
+            with span("inference", model_type):
+                outputs = run_batch(model_type, batch)
+        except Exception as e:
+            logger.exception("Error scoring %s batch of %d", model_type, len(positions))
+            outputs = [e] * len(positions)
+
+        fresh = {}
+        for output, pos in zip(outputs, positions):
+            results[pos] = output
+            if not isinstance(output, Exception):
+                fresh[digests[pos]] = output
+        prediction_cache.store(model_type, fresh)
+
+    for pos, first in duplicates:
+        results[pos] = results[first]
+    return results
+
+def _tta_summaries(model_type, image_files, raws, mode=None, fitted=None):
+    """
+    Test-time augmentation for the images that need it (see users/tta.py): their K views
+    are scored in one forward pass. Views are built from the first pass's fitted arrays
+    (`fitted`, from _score_files); only images answered from the prediction cache are
+    decoded again. Returns a list aligned with `raws` holding the tta.summarize() dict or
+    None where the first pass is kept. Failures fall back to the first pass.
+    """
+    fitted = fitted or {}
+    summaries = [None] * len(raws)
+    mode = tta_views.get_tta_mode(mode)
+    if mode == 'off':
+        return summaries
+    positions = [
+        pos for pos, raw in enumerate(raws)
+        if not isinstance(raw, Exception) and (mode == 'always' or tta_views.near_threshold(model_type, raw))
+    ]
+    if not positions:
+        return summaries
+
+    k = tta_views.view_count()
+    variant = f"tta{k}"
+    digests = {pos: prediction_cache.image_digest(image_files[pos]) for pos in positions}
+    found = prediction_cache.lookup(model_type, list(set(digests.values())), variant=variant)
+    todo = {}
+    for pos in positions:
+        if digests[pos] not in found:
+            todo.setdefault(digests[pos], pos)
+
+    if todo:
+        try:
+            order = list(todo)
+            missing = [d for d in order if todo[d] not in fitted]  # cache hits were never decoded
+            decoded = {}
+            if missing:
+                with span("preprocess"):
+                    batch, failures = preprocess_batch([image_files[todo[d]] for d in missing])
+                decoded = dict(zip([d for i, d in enumerate(missing) if i not in failures], batch))
+            order = [d for d in order if todo[d] in fitted or d in decoded]
+            # np.stack copies the rows out of the reused first-pass buffer
+            batch = np.stack([fitted[todo[d]] if todo[d] in fitted else decoded[d] for d in order])
+            with span("tta_views"):
+                views = tta_views.augmented_batch(batch, k)
+            with span("inference_tta", model_type):
+                outputs = run_batch(model_type, views)
+            fresh = {d: tta_views.summarize(model_type, outputs[i * k:(i + 1) * k]) for i, d in enumerate(order)}
+            prediction_cache.store(model_type, fresh, variant=variant)
+            found.update(fresh)
+        except Exception:
+            logger.exception("TTA pass failed for %s; keeping single-view predictions", model_type)
+
+    for pos in positions:
+        summaries[pos] = found.get(digests[pos])
+    return summaries
+
+def _cached_dark_raw(image_file):
+    """Raw dark-model result for one file, from the prediction cache when possible."""
+    digest = prediction_cache.image_digest(image_file)
+    cached = prediction_cache.lookup('dark', [digest])
+    if digest in cached:
+        return cached[digest]
+    with span("preprocess"):
+        img = load_fitted_image(image_file)
+    with span("inference", "dark"):
+        result = _predict_dark_raw(get_ad_model_dark(), img)
+    if isinstance(result, dict) and result.get('success') is not False:
+        prediction_cache.store('dark', {digest: result})
+    return result
+
+def _tta_block(first_pass, summary):
+    return {**summary, "first_pass_probability": float(first_pass)}
+
+def _light_prediction(raw_probability, tta=None):
+    """
+    Map a light-model sigmoid output to the response dict used by the API. With a TTA
+    summary the decision uses the mean over the augmented views.
+    """
+    first_pass = raw_probability
+    if tta:
+        raw_probability = tta["mean"]
+    is_ad = raw_probability < LIGHT_AD_THRESHOLD
+    label = "ad" if is_ad else "not_ad"
+    confidence = (1 - raw_probability) if is_ad else raw_probability
+    prediction = {
+        "label": label,
+        "score": float(confidence),
+        "confidence": float(confidence),
+        "is_atopic_dermatitis": bool(is_ad),
+        "raw_probability": float(raw_probability),
+        "model_used": "General Model (Light Skin Optimized)"
+    }
+    if tta:
+        prediction["tta"] = _tta_block(first_pass, tta)
+    return prediction
+
+def predict_ad_light_batch(image_files, tta=None):
+    """
+    Light-skin model for several uploads at once.
+
+    All decodable images that are not already cached are stacked into one
+    (N, 224, 224, 3) tensor and scored with a single forward pass. `tta` picks the
+    test-time augmentation mode ('off' / 'auto' / 'always', default settings.ADSCAN_TTA_MODE).
+    Returns a list aligned with `image_files`: each entry is either the same dict
+    `predict_ad_light` returns or the exception raised for that image.
+    """
+    fitted = {}
+    raws = _score_files('light', image_files, fitted)
+    summaries = _tta_summaries('light', image_files, raws, tta, fitted)
+    return [
+        raw if isinstance(raw, Exception) else _light_prediction(float(raw), summary)
+        for raw, summary in zip(raws, summaries)
+    ]
+
+def _dark_prediction(prob, raw_result, tta=None):
+    """
+    Build the response dict returned by predict_ad_dark_fixed for a probability (the TTA
+    mean when a summary is given).
+    """
+    OPTIMAL_THRESHOLD = DARK_AD_THRESHOLD
+    first_pass = prob
+    if tta:
+        prob = tta["mean"]
+    is_ad = prob >= OPTIMAL_THRESHOLD
+    prediction = {
+        "label": "ad" if is_ad else "not_ad",
+        "score": float(prob),
+        "confidence": float(prob),
+        "is_atopic_dermatitis": bool(is_ad),
+        "raw_probability": float(prob),
+        "model_used": "Dark Skin Optimized Model (Deployable)",
+        "confidence_level": raw_result.get('confidence', "Medium") if isinstance(raw_result, dict) else "Medium",
+        "threshold_used": OPTIMAL_THRESHOLD,
+        "success": False if (isinstance(raw_result, dict) and raw_result.get("success") is False) else True,
+        "raw_result": raw_result
+    }
+    if tta:
+        prediction["tta"] = _tta_block(first_pass, tta)
+    return prediction
+
+def predict_ad_dark_batch(image_files, tta=None):
+    """
+    Dark-skin deployable model for several uploads at once.
+
+    Uses one feature_extractor forward pass and one classifier.predict_proba call for the
+    whole batch. Models without the hybrid parts fall back to `predict_ad_dark_fixed` per
+    image (without TTA). Returns a list aligned with `image_files` like `predict_ad_light_batch`.
+    """
+    inline = get_inference_backend() == 'inline'
+    if inline and (not hasattr(get_ad_model_dark(), 'predict_arrays')
+                   or getattr(settings, 'ADSCAN_DARK_TEMPFILE_FALLBACK', False)):
+        return [predict_ad_dark_fixed(image_file) for image_file in image_files]
+
+    fitted = {}
+    raws = _score_files('dark', image_files, fitted)
+    summaries = _tta_summaries('dark', image_files, raws, tta, fitted)
+    results = []
+    for image_file, raw_result, summary in zip(image_files, raws, summaries):
+        if isinstance(raw_result, Exception):
+            # inline: keep the per-image fallbacks of the single-image wrapper; otherwise the
+            # model lives in the inference workers, so report the failure for this image
+            results.append(predict_ad_dark_fixed(image_file) if inline else raw_result)
+        else:
+            results.append(_dark_prediction(raw_result['probability'], raw_result, summary))
+    return results
+
+def predict_ad_both_batch(image_files, tta=None):
+    """
+    Light and dark models for several uploads in one call (model_type='both').
+
+    Each image is decoded once and the batch goes through model_registry.predict_both,
+    which computes the backbone features once when the two models share them. Returns a
+    list aligned with `image_files` holding {"light": ..., "dark": ..., "shared_backbone": ...}
+    (the per-model prediction dicts; shared_backbone is None for cached results) or the
+    exception raised for that image.
+    """
+    inline = get_inference_backend() == 'inline'
+    if inline and (not hasattr(get_ad_model_dark(), 'predict_arrays')
+                   or getattr(settings, 'ADSCAN_DARK_TEMPFILE_FALLBACK', False)):
+        results = []
+        for light, dark in zip(predict_ad_light_batch(image_files, tta), predict_ad_dark_batch(image_files, tta)):
+            error = next((r for r in (light, dark) if isinstance(r, Exception)), None)
+            results.append(error or {"light": light, "dark": dark, "shared_backbone": False})
+        return results
+
+    fitted = {}
+    raws = _score_files('both', image_files, fitted)
+    summaries = _tta_summaries('both', image_files, raws, tta, fitted)
+    return [
+        raw if isinstance(raw, Exception) else {
+            "light": _light_prediction(float(raw["light"]), summary and summary["light"]),
+            "dark": _dark_prediction(raw["dark"]["probability"], raw["dark"], summary and summary["dark"]),
+            "shared_backbone": raw.get("shared_backbone"),
+        }
+        for raw, summary in zip(raws, summaries)
+    ]
+
+def _predict_dark_from_tempfile(model, img):
+    """
+    Compatibility fallback for deployable models without `predict_array`: re-encode the
+    preprocessed image as a JPEG and hand its path to `predict_single_image`, retrying
+    with PIL.Image injected into builtins and then without use_hybrid.
     """
-    import inspect
-    model = get_ad_model_dark()
     tmp_path = None
     try:
-        # Preprocess exactly like Colab
-        if hasattr(image_file, 'seek'):
-            image_file.seek(0)
-        img = Image.open(image_file).convert('RGB')
-        img = ImageOps.fit(img, (224, 224), Image.BILINEAR)
         with tempfile.NamedTemporaryFile(delete=False, suffix='.jpg') as tmp_file:
             img.save(tmp_file, format='JPEG', quality=95)
             tmp_path = tmp_file.name
 
-        print(f"🖼️  Preprocessed image saved to: {tmp_path} (size={img.size})")
+        trace("Preprocessed image saved to %s (size=%s)", tmp_path, img.size)
 
-        # Inspect predict_single_image signature for debugging
-        pred_fn = getattr(model, 'predict_single_image', None)
-        try:
-            sig = inspect.signature(pred_fn) if pred_fn is not None else None
-        except Exception as _:
-            sig = None
-        print(f"🔍 predict_single_image exists: {pred_fn is not None}, signature: {sig}")
+        # Signature introspection only when someone reads the trace
+        if trace_enabled():
+            import inspect
+            pred_fn = getattr(model, 'predict_single_image', None)
+            try:
+                sig = inspect.signature(pred_fn) if pred_fn is not None else None
+            except Exception:
+                sig = None
+            trace("predict_single_image exists: %s, signature: %s", pred_fn is not None, sig)
 
-        # Try primary call (use_hybrid True first, then fallback), logging raw outputs
+        # Try primary call (use_hybrid True first, then fallback), tracing raw outputs
         result = None
+        err_text = ""
         try:
-            print("▶️ Calling predict_single_image(..., use_hybrid=True)")
             result = model.predict_single_image(tmp_path, use_hybrid=True)
-            print(f"✅ Raw result (use_hybrid=True): type={type(result)}, value={result}")
+            trace("Raw result (use_hybrid=True): %r", result)
             if isinstance(result, dict):
-                print(f"   keys: {list(result.keys())}")
+                err_text = str(result.get("error") or "")
         except Exception as e:
-            print(f"⚠️ predict_single_image(use_hybrid=True) raised: {e}")
-
-            # Try targeted NameError fix by injecting PIL.Image into builtins
+            logger.warning("predict_single_image(use_hybrid=True) raised: %s", e)
             err_text = str(e)
-            if "name 'Image' is not defined" in err_text or "NameError: Image" in err_text:
-                from PIL import Image as PILImage
-                had_image = hasattr(builtins, 'Image')
-                old_image = getattr(builtins, 'Image', None)
-                builtins.Image = PILImage
+
+        # Try targeted NameError fix by injecting PIL.Image into builtins
+        if "name 'Image' is not defined" in err_text or "NameError: Image" in err_text:
+            from PIL import Image as PILImage
+            had_image = hasattr(builtins, 'Image')
+            old_image = getattr(builtins, 'Image', None)
+            builtins.Image = PILImage
+            try:
+                trace("Injected PIL.Image into builtins, retrying predict_single_image(use_hybrid=True)")
                 try:
-                    print("🔧 Injected PIL.Image into builtins and retrying predict_single_image(use_hybrid=True)")
+                    result = model.predict_single_image(tmp_path, use_hybrid=True)
+                    trace("Raw result after injection: %r", result)
+                except Exception as e2:
+                    logger.warning("Retry after injecting Image failed: %s", e2)
+            finally:
+                if had_image:
+                    builtins.Image = old_image
+                else:
                     try:
-                        result = model.predict_single_image(tmp_path, use_hybrid=True)
-                        print(f"✅ Raw result after injection: type={type(result)}, value={result}")
-                        if isinstance(result, dict):
-                            print(f"   keys: {list(result.keys())}")
-                    except Exception as e2:
-                        print(f"⚠️ Retry after injecting Image failed: {e2}")
-                finally:
-                    if had_image:
-                        builtins.Image = old_image
-                    else:
-                        try:
-                            delattr(builtins, 'Image')
-                        except Exception:
-                            pass
+                        delattr(builtins, 'Image')
+                    except Exception:
+                        pass
 
         # Final fallback: try without use_hybrid if earlier attempts reported failure or no usable result
         need_fallback = result is None or (isinstance(result, dict) and result.get('success') is False)
         if need_fallback:
             try:
-                print("🔁 Fallback: calling predict_single_image(tmp_path) without use_hybrid")
                 result = model.predict_single_image(tmp_path)
-                print(f"✅ Raw result (no use_hybrid): type={type(result)}, value={result}")
-                if isinstance(result, dict):
-                    print(f"   keys: {list(result.keys())}")
+                trace("Raw result (no use_hybrid): %r", result)
             except Exception as e3:
-                print(f"❌ Fallback without use_hybrid failed: {e3}")
+                logger.warning("Fallback without use_hybrid failed: %s", e3)
+
+        return result
+    finally:
+        if tmp_path and os.path.exists(tmp_path):
+            try:
+                os.unlink(tmp_path)
+            except Exception:
+                pass
+
+def _predict_dark_raw(model, img):
+    """
+    Score a preprocessed 224x224 PIL image with the deployable dark model.
+    Uses the in-memory `predict_array` entry point unless the temp-file path is forced
+    with settings.ADSCAN_DARK_TEMPFILE_FALLBACK or the model does not provide it.
+    """
+    if hasattr(model, 'predict_array') and not getattr(settings, 'ADSCAN_DARK_TEMPFILE_FALLBACK', False):
+        try:
+            return model.predict_array(fitted_to_array(img), use_hybrid=True)
+        except Exception as e:
+            logger.warning("predict_array failed, using temp-file fallback: %s", e)
+    return _predict_dark_from_tempfile(model, img)
+
+# ============================================================
+# FIXED dark-model wrapper (non-destructive retries, robust parsing)
+# ============================================================
+def predict_ad_dark_fixed(image_file):
+    """
+    Safer wrapper around the deployable dark-skin model with enhanced debug logging.
+    """
+    try:
+        # Preprocess exactly like Colab (or reuse the cached result for identical bytes)
+        result = _cached_dark_raw(image_file)
 
         # Robust probability extraction (same as before), but log chosen value
         prob = 0.5
@@ -443,7 +490,7 @@ def predict_ad_dark_fixed(image_file):
                 if key in result and result.get(key) is not None:
                     try:
                         prob = float(result.get(key))
-                        print(f"🔎 Extracted prob from key '{key}': {prob}")
+                        trace("Extracted prob from key %r: %s", key, prob)
                         break
                     except Exception:
                         continue
@@ -451,33 +498,20 @@ def predict_ad_dark_fixed(image_file):
         else:
             try:
                 prob = float(result)
-                print(f"🔎 Extracted prob from numeric result: {prob}")
+                trace("Extracted prob from numeric result: %s", prob)
             except Exception:
-                print("⚠️ Could not extract probability from raw result; using default 0.5")
+                logger.warning("Could not extract probability from raw dark result; using default 0.5")
 
-        OPTIMAL_THRESHOLD = 0.3
-        is_ad = prob >= OPTIMAL_THRESHOLD
-        label = "ad" if is_ad else "not_ad"
+        prediction = _dark_prediction(prob, result)
+        prediction["confidence_level"] = confidence_level
 
-        print(f"🎯 Final: label={label}, is_ad={is_ad}, prob={prob}, threshold={OPTIMAL_THRESHOLD}")
+        trace("predict_ad_dark_fixed final: label=%s is_ad=%s prob=%s threshold=%s",
+              prediction['label'], prediction['is_atopic_dermatitis'], prob, prediction['threshold_used'])
 
-        return {
-            "label": label,
-            "score": float(prob),
-            "confidence": float(prob),
-            "is_atopic_dermatitis": bool(is_ad),
-            "raw_probability": float(prob),
-            "model_used": "Dark Skin Optimized Model (Deployable)",
-            "confidence_level": confidence_level,
-            "threshold_used": OPTIMAL_THRESHOLD,
-            "success": False if (isinstance(result, dict) and result.get("success") is False) else True,
-            "raw_result": result
-        }
+        return prediction
 
     except Exception as e:
-        import traceback
-        print(f"❌ Critical error in predict_ad_dark_fixed: {e}")
-        print(traceback.format_exc())
+        logger.exception("Critical error in predict_ad_dark_fixed")
         return {
             "label": "not_ad",
             "score": 0.5,
@@ -490,59 +524,6 @@ def predict_ad_dark_fixed(image_file):
             "success": False,
             "error": str(e)
         }
-    finally:
-        if tmp_path and os.path.exists(tmp_path):
-            try:
-                os.unlink(tmp_path)
-            except Exception:
-                pass
-
-# ============================================================
-# MODEL VERIFICATION FUNCTION - ADD THIS
-# ============================================================
-def verify_models():
-    """Verify that models are loaded correctly and working"""
-    try:
-        print("🔍 Verifying model files and paths...")
-        
-        # Check if files exist
-        light_path = getattr(settings, 'MODEL_PATH_LIGHT', None)
-        dark_path = getattr(settings, 'MODEL_PATH_DARK', None)
-        
-        print(f"📁 Light model path: {light_path}")
-        print(f"📁 Dark model path: {dark_path}")
-        print(f"✅ Light model exists: {os.path.exists(light_path) if light_path else False}")
-        print(f"✅ Dark model exists: {os.path.exists(dark_path) if dark_path else False}")
-        
-        # Check which dark model we're using
-        if dark_path and 'deployable' in str(dark_path):
-            print("🎯 CORRECT: Using deployable_skin_model_final.pkl")
-        elif dark_path and 'hybrid' in str(dark_path):
-            print("❌ WRONG: Using hybrid_skin_model_final.pkl instead of deployable model!")
-        else:
-            print("⚠️  Unknown model file")
-            
-        # Test model loading
-        print("🧪 Testing model loading...")
-        light_model = get_ad_model_light()
-        dark_model = get_ad_model_dark()
-        
-        print(f"✅ Light model type: {type(light_model)}")
-        print(f"✅ Dark model type: {type(dark_model)}")
-        
-        # Test prediction with dummy data
-        dummy_img = np.random.random((224, 224, 3)).astype('float32')
-        
-        # Test light model
-        light_input = np.expand_dims(dummy_img, 0)
-        light_pred = light_model.predict(light_input, verbose=0)
-        print(f"✅ Light model test prediction: {light_pred[0][0]:.4f}")
-        
-        return True
-        
-    except Exception as e:
-        print(f"❌ Model verification failed: {e}")
-        return False
 
 # ============================================================
 # DEBUG ENDPOINT - ADD THIS
@@ -554,27 +535,18 @@ def debug_model_performance(request):
     try:
         image_file = request.FILES['image']
         
-        print("🧪 DEBUG: Testing both models on the same image...")
-        
-        # Test light model
-        light_result = predict_ad_light(image_file)
-        print(f"📊 Light model result: {light_result}")
+        trace("debug_model_performance: testing both models on the same image")
         
-        # Reset and test dark model
-        image_file.seek(0)
-        dark_result = predict_ad_dark(image_file) 
-        print(f"📊 Dark model result: {dark_result}")
+        # Both models in one call (shared backbone when the weights match)
+        both = predict_ad_both_batch([image_file])[0]
+        if isinstance(both, Exception):
+            raise both
+        light_result, dark_result = both["light"], both["dark"]
+        trace("debug_model_performance: light=%r dark=%r", light_result, dark_result)
         
-        # Compare preprocessing
-        image_file.seek(0)
-        img_light = Image.open(image_file).convert('RGB')
-        img_light = ImageOps.fit(img_light, (224, 224), Image.BILINEAR)
-        img_array_light = np.array(img_light)
-        
-        image_file.seek(0)
-        img_dark = Image.open(image_file).convert('RGB') 
-        img_dark = ImageOps.fit(img_dark, (224, 224), Image.BILINEAR)
-        img_array_dark = np.array(img_dark)
+        # Compare preprocessing (both models share users.preprocessing)
+        img_array_light = np.array(load_fitted_image(image_file))
+        img_array_dark = np.array(load_fitted_image(image_file))
         
         preprocessing_match = np.array_equal(img_array_light, img_array_dark)
         
@@ -582,6 +554,7 @@ def debug_model_performance(request):
             'preprocessing_consistent': preprocessing_match,
             'light_model_result': light_result,
             'dark_model_result': dark_result,
+            'shared_backbone': both['shared_backbone'],
             'differences': {
                 'label_differs': light_result['label'] != dark_result['label'],
                 'score_difference': abs(light_result['score'] - dark_result['score']),
@@ -598,28 +571,139 @@ def debug_model_performance(request):
     except Exception as e:
         return Response({'error': str(e)}, status=400)
 
-# ============================================================
-# Call model verification on startup
-# ============================================================
-print("🚀 Initializing skin analysis models...")
-verify_models()
+def _process_upload(user, images, model_type, tta=None):
+    """
+    Validate, save, thumbnail and score uploaded images (one batched forward pass).
+    Shared by AdScanImageUploadView and the async upload view (users/async_views.py).
+    Returns (response payload, HTTP status, [(AdScanImage id, prediction)] for
+    prediction_records, latency of the predict call in ms or None); the caller records.
+    """
+    logger = logging.getLogger(__name__)
+    results = []
+    errors = []
+    scored = []  # (AdScanImage id, prediction) for prediction_records
+    latency_ms = None
+    pending = []  # (idx, img, img_serializer) saved and waiting for the batched prediction
+    for idx, img in enumerate(images, start=1):
+        # validate with AdScanSerializer
+        with span("validate"):
+            ad_check = AdScanSerializer(data={'image': img})
+            valid = ad_check.is_valid()
+        if not valid:
+            errors.append({
+                "index": idx,
+                "filename": getattr(img, "name", f"image-{idx}"),
+                "error": "Invalid image",
+                "details": ad_check.errors
+            })
+            # skip this file, continue with others
+            continue
+
+        # save to AdScanImage (if desired)
+        img_serializer = AdScanImageSerializer(data={'image': img})
+        with span("validate"):
+            valid = img_serializer.is_valid()
+        if not valid:
+            errors.append({
+                "index": idx,
+                "filename": getattr(img, "name", f"image-{idx}"),
+                "error": "Failed to save image",
+                "details": img_serializer.errors
+            })
+            continue
+
+        try:
+            # attach user if serializer/model accepts it; otherwise save without user
+            with span("save"):
+                try:
+                    instance = img_serializer.save(user=user)
+                except TypeError:
+                    instance = img_serializer.save()
+        except Exception as e:
+            logger.exception("Saving image failed")
+            errors.append({
+                "index": idx,
+                "filename": getattr(img, "name", f"image-{idx}"),
+                "error": "Saving image failed",
+                "details": str(e)
+            })
+            continue
+
+        # thumbnail for the PDF report and history previews (best-effort)
+        try:
+            with span("thumbnail"):
+                attach_thumbnail(instance, source=img)
+        except Exception:
+            logger.exception("Thumbnail generation failed for %s", getattr(img, "name", f"image-{idx}"))
+
+        pending.append((idx, img, img_serializer))
+
+    # run prediction with selected model in one batch (dark uses the hybrid batch path)
+    if pending:
+        files = [img for _, img, _ in pending]
+        try:
+            with span("predict", model_type) as predict_span:
+                if model_type == 'both':
+                    predictions = predict_ad_both_batch(files, tta)
+                elif model_type == 'dark':
+                    predictions = predict_ad_dark_batch(files, tta)
+                else:
+                    predictions = predict_ad_light_batch(files, tta)
+        except Exception as e:
+            logger.exception("Prediction error")
+            predictions = [e] * len(files)
+
+        latency_ms = predict_span.duration * 1000
+
+        for (idx, img, img_serializer), prediction in zip(pending, predictions):
+            if isinstance(prediction, Exception):
+                errors.append({
+                    "index": idx,
+                    "filename": getattr(img, "name", f"image-{idx}"),
+                    "error": "Prediction failed",
+                    "details": str(prediction)
+                })
+                continue
+
+            results.append({
+                "index": idx,
+                "filename": getattr(img, "name", f"image-{idx}"),
+                "uploaded": img_serializer.data,
+                "prediction": prediction
+            })
+            scored.append((img_serializer.instance.id, prediction))
+
+    errors.sort(key=lambda e: e["index"])
+
+    response_payload = {
+        "results": results,
+        "errors": errors,
+        "model_used": {
+            'dark': "Dark Skin Optimized Model (Deployable)",
+            'both': "General + Dark Skin Optimized Models",
+        }.get(model_type, "General Model")
+    }
+    code = status.HTTP_207_MULTI_STATUS if errors else status.HTTP_201_CREATED
+    return response_payload, code, scored, latency_ms
 
 # ============================================================
 # Updated upload view with model selection (KEEP YOUR EXISTING CODE)
 # ============================================================
-class AdScanImageUploadView(APIView):
+class AdScanImageUploadView(StreamingUploadMixin, APIView):
     parser_classes = [MultiPartParser, FormParser]
     authentication_classes = [JWTAuthentication]
     permission_classes = [AllowAny]
 
     def post(self, request):
         logger = logging.getLogger(__name__)
-        logger.debug("AdScan upload - FILES: %s", request.FILES)
-        logger.debug("AdScan upload - DATA: %s", request.data)
+        with span("parse"):  # DRF parses the multipart body on first access
+            logger.debug("AdScan upload - FILES: %s", request.FILES)
+            logger.debug("AdScan upload - DATA: %s", request.data)
 
         # Get model selection from request (default to 'light')
-        model_type = request.data.get('model_type', 'light')  # 'light' or 'dark'
-        logger.debug(f"Using model type: {model_type}")
+        model_type = request.data.get('model_type', 'light')  # 'light', 'dark' or 'both'
+        tta = request.data.get('tta')  # 'off', 'auto' or 'always'; default settings.ADSCAN_TTA_MODE
+        logger.debug("Using model type: %s", model_type)
 
         # accept multiple files under 'images' or a single file under 'image'
         images = request.FILES.getlist('images')
@@ -633,84 +717,17 @@ class AdScanImageUploadView(APIView):
                     status=status.HTTP_400_BAD_REQUEST
                 )
 
-        results = []
-        errors = []
-        for idx, img in enumerate(images, start=1):
-            # validate with AdScanSerializer
-            ad_check = AdScanSerializer(data={'image': img})
-            if not ad_check.is_valid():
-                errors.append({
-                    "index": idx,
-                    "filename": getattr(img, "name", f"image-{idx}"),
-                    "error": "Invalid image",
-                    "details": ad_check.errors
-                })
-                # skip this file, continue with others
-                continue
-
-            # save to AdScanImage (if desired)
-            img_serializer = AdScanImageSerializer(data={'image': img})
-            if not img_serializer.is_valid():
-                errors.append({
-                    "index": idx,
-                    "filename": getattr(img, "name", f"image-{idx}"),
-                    "error": "Failed to save image",
-                    "details": img_serializer.errors
-                })
-                continue
-
-            try:
-                # attach user if serializer/model accepts it; otherwise save without user
-                try:
-                    instance = img_serializer.save(user=request.user)
-                except TypeError:
-                    instance = img_serializer.save()
-            except Exception as e:
-                logger.exception("Saving image failed")
-                errors.append({
-                    "index": idx,
-                    "filename": getattr(img, "name", f"image-{idx}"),
-                    "error": "Saving image failed",
-                    "details": str(e)
-                })
-                continue
-
-            # run prediction with selected model (use fixed wrapper for dark)
-            try:
-                if model_type == 'dark':
-                    prediction = predict_ad_dark_fixed(img)
-                else:
-                    prediction = predict_ad_light(img)
-            except Exception as e:
-                logger.exception("Prediction error")
-                errors.append({
-                    "index": idx,
-                    "filename": getattr(img, "name", f"image-{idx}"),
-                    "error": "Prediction failed",
-                    "details": str(e)
-                })
-                continue
-
-            results.append({
-                "index": idx,
-                "filename": getattr(img, "name", f"image-{idx}"),
-                "uploaded": img_serializer.data,
-                "prediction": prediction
-            })
+        payload, code, scored, latency_ms = _process_upload(request.user, images, model_type, tta)
 
-        response_payload = {
-            "results": results,
-            "errors": errors,
-            "model_used": "Dark Skin Optimized Model (Deployable)" if model_type == 'dark' else "General Model"
-        }
-        if errors:
-            return Response(response_payload, status=status.HTTP_207_MULTI_STATUS)
-        return Response(response_payload, status=status.HTTP_201_CREATED)
+        # one Prediction row per image and model, in a single bulk_create
+        with span("record"):
+            record_predictions(model_type, scored, latency_ms=latency_ms)
+        return Response(payload, status=code)
 
 # ============================================================
 # Single image API view (uses light model by default for backward compatibility)
 # ============================================================
-class AdScanAPIView(APIView):
+class AdScanAPIView(StreamingUploadMixin, APIView):
     parser_classes = [MultiPartParser, FormParser]
     permission_classes = [IsAuthenticated]
 
@@ -754,15 +771,7 @@ class LoginView(APIView):
         password = request.data.get('password')
         user = authenticate(username=username, password=password)
         if user:
-            code = str(random.randint(100000, 999999))
-            Email2FACode.objects.create(user=user, code=code)
-            send_mail(
-                'Your 2FA Code',
-                f'Your 2FA code is: {code}',
-                None,
-                [user.email],
-                fail_silently=False,
-            )
+            generate_2fa_code(user)  # queued in the mail outbox; login does not wait for SMTP
             # Ensure profile exists
             if not hasattr(user, 'profile'):
                 from .models import Profile
@@ -824,15 +833,7 @@ class Resend2FAView(APIView):
             user = User.objects.get(id=user_id)
             # Optionally delete old codes
             Email2FACode.objects.filter(user=user).delete()
-            code = str(random.randint(100000, 999999))
-            Email2FACode.objects.create(user=user, code=code)
-            send_mail(
-                'Your 2FA Code',
-                f'Your new 2FA code is: {code}',
-                None,
-                [user.email],
-                fail_silently=False,
-            )
+            generate_2fa_code(user, resend=True)
             return Response({'message': '2FA code resent.'}, status=status.HTTP_200_OK)
         except User.DoesNotExist:
             return Response({'detail': 'User not found.'}, status=status.HTTP_404_NOT_FOUND)
@@ -924,9 +925,10 @@ def admin_analytics(request):
     Admin analytics:
       - totals (users, scans, pdfs, images analyzed)
       - scans per day (last 30 days)
-      - model usage distribution
-      - average risk estimate (if available)
+      - model usage distribution (scans per model)
+      - average risk estimate per scan (if available)
       - recent scans (id, created_at, model_used, risk_estimate, has_pdf)
+      - per-model upload predictions (last 30 days) from the Prediction table
     """
     # only allow admins
     try:
@@ -939,68 +941,59 @@ def admin_analytics(request):
 
         total_users = User.objects.count()
         total_scans = Chat.objects.count()
-        total_pdfs = Chat.objects.filter(pdf_report__isnull=False).count()
-
-        # scans per day (last 30 days)
-        scans_qs = Chat.objects.filter(created_at__gte=since).order_by("created_at")
-        scans_per_day = {}
-        for c in scans_qs:
-            day = c.created_at.date().isoformat()
-            scans_per_day[day] = scans_per_day.get(day, 0) + 1
-
-        # aggregate model usage, images analyzed, average risk (best-effort parsing of messages meta)
-        model_usage = {}
-        images_analyzed = 0
-        risk_sum = 0.0
-        risk_count = 0
-
-        # limit scanned chats for aggregation to avoid heavy queries
-        for c in Chat.objects.all().order_by('-created_at')[:2000]:
-            msgs = c.messages or []
-            for m in msgs:
-                meta = m.get("meta") if isinstance(m, dict) else None
-                if not meta or not isinstance(meta, dict):
-                    continue
-                # images count
-                try:
-                    images_analyzed += int(meta.get("images", 0) or 0)
-                except Exception:
-                    pass
-                # model used
-                mu = meta.get("model_used")
-                if mu:
-                    model_usage[mu] = model_usage.get(mu, 0) + 1
-                # risk estimate
-                try:
-                    re = meta.get("risk_estimate")
-                    if re is not None:
-                        risk_sum += float(re)
-                        risk_count += 1
-                except Exception:
-                    pass
+        total_pdfs = Chat.objects.filter(pdf_report__isnull=False).exclude(pdf_report="").count()
+
+        # scans per day (last 30 days), grouped in the database
+        scans_per_day = {
+            row["day"].isoformat(): row["count"]
+            for row in Chat.objects.filter(created_at__gte=since)
+            .annotate(day=TruncDate("created_at"))
+            .values("day")
+            .annotate(count=Count("id"))
+            .order_by("day")
+        }
 
-        avg_risk = (risk_sum / risk_count) if risk_count else None
+        # model usage, images analyzed and average risk from the denormalized scan summary columns
+        # (filled by migration 0014 for older chats): one count and one risk value per scan,
+        # taken from its first model_used / risk_estimate
+        model_usage = {
+            row["model_used"]: row["count"]
+            for row in Chat.objects.exclude(model_used__isnull=True).exclude(model_used="")
+            .values("model_used")
+            .annotate(count=Count("id"))
+            .order_by()
+        }
+        totals = Chat.objects.aggregate(images_analyzed=Sum("images_count"), avg_risk=Avg("risk_estimate"))
+        images_analyzed = totals["images_analyzed"] or 0
+        avg_risk = totals["avg_risk"]
+
+        # per-model predictions recorded at upload time (last 30 days), grouped in the database
+        predictions = {
+            row["model_type"]: {
+                "count": row["count"],
+                "ad_rate": row["ad"] / row["count"] if row["count"] else None,
+                "avg_probability": row["avg_probability"],
+                "avg_latency_ms": row["avg_latency_ms"],
+            }
+            for row in Prediction.objects.filter(created_at__gte=since, source="upload")
+            .values("model_type")
+            .annotate(count=Count("id"), ad=Count("id", filter=Q(is_ad=True)),
+                      avg_probability=Avg("probability"), avg_latency_ms=Avg("latency_ms"))
+            .order_by()
+        }
 
         # recent scans (10)
-        recent = []
-        for c in Chat.objects.all().order_by('-created_at')[:10]:
-            model_used = None
-            risk = None
-            msgs = c.messages or []
-            for m in msgs:
-                meta = m.get("meta") if isinstance(m, dict) else None
-                if meta:
-                    if model_used is None and meta.get("model_used"):
-                        model_used = meta.get("model_used")
-                    if risk is None and meta.get("risk_estimate") is not None:
-                        risk = meta.get("risk_estimate")
-            recent.append({
-                "id": c.id,
-                "created_at": c.created_at,
-                "model_used": model_used,
-                "risk_estimate": risk,
-                "has_pdf": bool(c.pdf_report)
-            })
+        recent = [
+            {
+                "id": row["id"],
+                "created_at": row["created_at"],
+                "model_used": row["model_used"],
+                "risk_estimate": row["risk_estimate"],
+                "has_pdf": bool(row["pdf_report"])
+            }
+            for row in Chat.objects.order_by('-created_at')
+            .values("id", "created_at", "model_used", "risk_estimate", "pdf_report")[:10]
+        ]
 
         payload = {
             "totals": {
@@ -1012,7 +1005,8 @@ def admin_analytics(request):
             "scans_per_day": scans_per_day,
             "model_usage": model_usage,
             "average_risk_estimate": avg_risk,
-            "recent_scans": recent
+            "recent_scans": recent,
+            "predictions": predictions
         }
         return Response(payload)
     except Exception as e:
@@ -1052,10 +1046,6 @@ def universal_symptom_assessment(request):
         assessment = calculate_skin_tone_aware_score(symptom_answers, skin_tone, user_type, scan_results)
         report = generate_universal_report(assessment, symptom_answers, scan_results, user_type)
 
-        # Generate PDF with expanded data
-        pdf_buffer = generate_pdf_report(report, symptom_answers, scan_results, request.user, assessment)
-        pdf_file = ContentFile(pdf_buffer.getvalue(), name=f"assessment_{request.user.id}_{assessment['final_confidence']:.2f}.pdf")
-
         # Create a new Chat for this assessment (instead of get_or_create)
         chat = Chat.objects.create(user=request.user, messages=[])
 
@@ -1073,10 +1063,15 @@ def universal_symptom_assessment(request):
             }
         })
 
-        chat.pdf_report = pdf_file
         chat.save()
 
-        report['pdf_url'] = chat.pdf_report.url if chat.pdf_report else None
+        # PDF is rendered in the background; poll download-scan-pdf/<chat_id>/ for it
+        enqueue_pdf_report(chat, f"assessment_{request.user.id}_{assessment['final_confidence']:.2f}.pdf",
+                           report, symptom_answers, scan_results, assessment)
+
+        report['chat_id'] = chat.id
+        report['pdf_url'] = None
+        report['pdf_status'] = chat.pdf_status
         return Response(report, status=status.HTTP_200_OK)
     except Exception as e:
         logger.exception("universal_symptom_assessment failed")
@@ -1374,119 +1369,6 @@ def chat_view(request):
         "risk_estimate": float(risk_estimate)
     })
 
-def generate_pdf_report(report, symptom_answers, scan_results, user, assessment):
-    buffer = io.BytesIO()
-    c = canvas.Canvas(buffer, pagesize=letter)
-    width, height = letter
-    y_position = height - 50  # Starting Y position
-
-    # Helper to add text and handle page breaks
-    def add_text(text, font_size=12, bold=False, indent=0):
-        nonlocal y_position
-        if bold:
-            c.setFont("Helvetica-Bold", font_size)
-        else:
-            c.setFont("Helvetica", font_size)
-        lines = text.split('\n')
-        for line in lines:
-            if y_position < 100:  # New page if near bottom
-                c.showPage()
-                y_position = height - 50
-                c.setFont("Helvetica-Bold" if bold else "Helvetica", font_size)
-            c.drawString(100 + indent, y_position, line)
-            y_position -= font_size + 2
-
-    # Title
-    add_text(report.get('title', 'Assessment Report'), font_size=16, bold=True)
-    y_position -= 20
-
-    # Summary
-    add_text(f"Summary: {report.get('summary', 'N/A')}", font_size=12)
-    y_position -= 20
-
-    # Section 1: Scanned Images
-    add_text("1. Scanned Images", font_size=14, bold=True)
-    y_position -= 10
-    for i, res in enumerate(scan_results):
-        # Get image path from AdScanImage if available
-        img_path = None
-        if res.get('uploaded') and res['uploaded'].get('id'):
-            try:
-                ad_img = AdScanImage.objects.get(id=res['uploaded']['id'])
-                img_path = ad_img.image.path  # File path for embedding
-            except AdScanImage.DoesNotExist:
-                pass
-        if img_path:
-            try:
-                img = ImageReader(img_path)
-                c.drawImage(img, 100, y_position - 100, width=100, height=100)
-                y_position -= 120
-            except Exception as e:
-                add_text(f"Image {i+1}: Failed to embed ({str(e)})", indent=20)
-        else:
-            add_text(f"Image {i+1}: No image available", indent=20)
-        if y_position < 150:
-            c.showPage()
-            y_position = height - 50
-
-    # Section 2: Initial Scan Results
-    add_text("2. Initial Scan Results", font_size=14, bold=True)
-    y_position -= 10
-    for i, res in enumerate(scan_results):
-        pred = res.get('prediction', {})
-        add_text(f"Image {i+1}: {pred.get('label', 'N/A')} (Score: {pred.get('score', 0):.2f})", indent=20)
-        add_text(f"Model Used: {pred.get('model_used', 'N/A')}", indent=40)
-        y_position -= 10
-        if y_position < 100:
-            c.showPage()
-            y_position = height - 50
-
-    # Section 3: Form Questions and Answers
-    add_text("3. Form Questions and Answers", font_size=14, bold=True)
-    y_position -= 10
-    for q, a in symptom_answers.items():
-        add_text(f"{q}: {a}", indent=20)
-        if y_position < 100:
-            c.showPage()
-            y_position = height - 50
-
-    # Section 4: Assessment Details
-    add_text("4. Assessment Details", font_size=14, bold=True)
-    y_position -= 10
-    add_text(f"Assessment Level: {report.get('assessment_level', 'N/A')}", indent=20)
-    add_text(f"Final Confidence: {report.get('final_confidence', 0):.2f}", indent=20)
-    add_text(f"Skin Tone Considered: {assessment.get('skin_tone_considered', 'N/A')}", indent=20)
-    add_text(f"Images Analyzed: {assessment.get('images_analyzed', 0)}", indent=20)
-    add_text(f"User Type: {assessment.get('user_type', 'N/A')}", indent=20)
-    if 'breakdown' in assessment:
-        add_text("Breakdown:", indent=20)
-        for key, value in assessment['breakdown'].items():
-            add_text(f"{key}: {value}", indent=40)
-    if 'key_findings' in report:
-        add_text("Key Findings:", indent=20)
-        for finding in report['key_findings']:
-            add_text(f"- {finding}", indent=40)
-    if 'recommendations' in report:
-        add_text("Recommendations:", indent=20)
-        for rec in report['recommendations']:
-            add_text(f"- {rec}", indent=40)
-    if 'next_steps' in report:
-        add_text("Next Steps:", indent=20)
-        for step in report['next_steps']:
-            add_text(f"- {step}", indent=40)
-    y_position -= 20
-
-    # Section 5: Final Result
-    add_text("5. Final Result", font_size=14, bold=True)
-    y_position -= 10
-    add_text(f"Overall Confidence: {assessment.get('final_confidence', 0):.2f}", indent=20)
-    add_text(f"Urgency: {report.get('urgency', 'N/A')}", indent=20)
-    add_text(f"Timestamp: {report.get('timestamp', 'N/A')}", indent=20)
-
-    c.save()
-    buffer.seek(0)
-    return buffer
-
 # Add Chat views
 class ChatListCreateView(generics.ListCreateAPIView):
     serializer_class = ChatSerializer
@@ -1525,24 +1407,24 @@ def diagnose_model_issue(request):
         has_predict = hasattr(dark_model, 'predict_single_image')
 
         # simple preprocessing sample
-        image_file.seek(0)
-        img = Image.open(image_file).convert('RGB')
-        img = ImageOps.fit(img, (224, 224), Image.BILINEAR)
-        arr = np.array(img).astype('float32') / 255.0
+        img = load_fitted_image(image_file)
+        arr = fitted_to_array(img)
 
-        # write a temp file and try a best-effort call
+        # best-effort call: in-memory entry point first, temp file only for older models
         debug_path = None
         raw_result = None
         raw_error = None
         try:
-            with tempfile.NamedTemporaryFile(delete=False, suffix='.jpg') as tmp:
-                img.save(tmp.name, format='JPEG', quality=95)
-                debug_path = tmp.name
-            try:
+            if hasattr(dark_model, 'predict_array'):
+                raw_result = dark_model.predict_array(arr, use_hybrid=True)
+            else:
+                with tempfile.NamedTemporaryFile(delete=False, suffix='.jpg') as tmp:
+                    img.save(tmp.name, format='JPEG', quality=95)
+                    debug_path = tmp.name
                 if has_predict:
                     raw_result = dark_model.predict_single_image(debug_path, use_hybrid=True)
-            except Exception as e:
-                raw_error = str(e)
+        except Exception as e:
+            raw_error = str(e)
         finally:
             if debug_path and os.path.exists(debug_path):
                 try:
@@ -1565,26 +1447,27 @@ def diagnose_model_issue(request):
 # ============================================================
 # MODEL HEALTH CHECK endpoint (ensure this is present so urls.py can import it)
 # ============================================================
-@api_view(["GET"])
-@permission_classes([AllowAny])
-def model_health_check(request):
-    """Quick health check for both models."""
-    try:
-        light_model = get_ad_model_light()
-        dark_model = get_ad_model_dark()
-        dark_has_predict = hasattr(dark_model, 'predict_single_image')
+def _model_health():
+    """Load both models and run a tiny forward pass on each; shared with the async health view."""
+    light_model = get_ad_model_light()
+    dark_model = get_ad_model_dark()
+    dark_has_predict = hasattr(dark_model, 'predict_single_image')
 
-        # quick light model smoke test
-        try:
-            dummy = np.random.random((1, 224, 224, 3)).astype('float32')
-            _ = light_model.predict(dummy, verbose=0)
-            light_ok = True
-        except Exception:
-            light_ok = False
+    # quick light model smoke test
+    try:
+        dummy = np.random.random((1, 224, 224, 3)).astype('float32')
+        _ = light_model.predict(dummy, verbose=0)
+        light_ok = True
+    except Exception:
+        light_ok = False
 
-        # quick dark model smoke test (best-effort)
-        dark_ok = False
-        try:
+    # quick dark model smoke test (best-effort)
+    dark_ok = False
+    try:
+        if hasattr(dark_model, 'predict_array'):
+            res = dark_model.predict_array(np.ones((224, 224, 3), dtype='float32'))
+            dark_ok = res is not None
+        else:
             test_img = Image.new('RGB', (224, 224), color='white')
             with tempfile.NamedTemporaryFile(delete=False, suffix='.jpg') as tmp:
                 test_path = tmp.name
@@ -1600,14 +1483,22 @@ def model_health_check(request):
                     os.unlink(test_path)
                 except Exception:
                     pass
-        except Exception:
-            dark_ok = False
+    except Exception:
+        dark_ok = False
 
-        return Response({
-            "light_model": {"loaded": True, "working": light_ok, "type": str(type(light_model))},
-            "dark_model": {"loaded": True, "working": dark_ok, "type": str(type(dark_model)), "has_predict_single_image": dark_has_predict},
-            "overall_status": "healthy" if light_ok and dark_ok else "degraded"
-        })
+    return {
+        "light_model": {"loaded": True, "working": light_ok, "type": str(type(light_model))},
+        "dark_model": {"loaded": True, "working": dark_ok, "type": str(type(dark_model)), "has_predict_single_image": dark_has_predict},
+        "prediction_cache": prediction_cache.stats(),
+        "overall_status": "healthy" if light_ok and dark_ok else "degraded"
+    }
+
+@api_view(["GET"])
+@permission_classes([AllowAny])
+def model_health_check(request):
+    """Quick health check for both models."""
+    try:
+        return Response(_model_health())
     except Exception as e:
         return Response({"error": str(e)}, status=500)
 
@@ -1616,7 +1507,7 @@ def model_health_check(request):
 def save_adscan(request):
     """
     Create a new Chat entry for every saved scan so previous saves are retained.
-    Attaches a generated PDF (if generation succeeds) and returns the created Chat.
+    Queues its PDF report (see pdf_reports) and returns the created Chat with pdf_status 'pending'.
     """
     logger = logging.getLogger(__name__)
     try:
@@ -1644,19 +1535,18 @@ def save_adscan(request):
         })
 
         # Create a new Chat record (do not overwrite existing ones)
-        chat = Chat.objects.create(user=user, messages=messages)
+        with span("save_scan"):
+            chat = Chat.objects.create(user=user, messages=messages)
 
-        # Try to generate and attach PDF (best-effort)
+        # Queue the PDF (best-effort: the scan is saved even if queueing fails)
         try:
             symptom_answers = universal_report.get("symptom_answers", {})
-            pdf_buffer = generate_pdf_report(universal_report, symptom_answers, results, user, universal_report)
-            if pdf_buffer:
-                pdf_name = f"adscan_{user.id}_{int(time.time())}.pdf"
-                chat.pdf_report.save(pdf_name, ContentFile(pdf_buffer.getvalue()), save=False)
+            pdf_name = f"adscan_{user.id}_{int(time.time())}.pdf"
+            with span("pdf_enqueue"):
+                enqueue_pdf_report(chat, pdf_name, universal_report, symptom_answers, results, universal_report)
         except Exception as e:
-            logger.exception("PDF generation failed for save_adscan: %s", e)
+            logger.exception("PDF job could not be queued for save_adscan: %s", e)
 
-        chat.save()
         serializer = ChatSerializer(chat, context={"request": request})
         return Response({"message": "Scan saved successfully.", "chat": serializer.data}, status=status.HTTP_201_CREATED)
 
@@ -1664,16 +1554,39 @@ def save_adscan(request):
         logger.exception("save_adscan failed: %s", e)
         return Response({"error": "Failed to save scan."}, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
 
+class ScanHistoryPagination(CursorPagination):
+    """Keyset pagination on (created_at, id), backed by chat_user_created_idx."""
+    ordering = ('-created_at', '-id')
+    page_size = 20
+    page_size_query_param = 'page_size'
+    max_page_size = 100
+
+
 @api_view(["GET"])
 @permission_classes([IsAuthenticated])
 def get_scan_history(request):
     """
-    Get list of all saved scans for the current user
+    Get a page of saved scans for the current user, newest first.
+
+    Query params:
+    - cursor: opaque cursor from the previous page's `next` / `previous` link
+    - page_size: scans per page (default 20, max 100)
+    - fields: comma-separated subset of ScanHistorySerializer fields; `messages`
+      is only loaded when listed here
+
+    Response: {"next": url|null, "previous": url|null, "results": [...]}
     """
     try:
-        chats = Chat.objects.filter(user=request.user).order_by('-created_at')
-        serializer = ChatSerializer(chats, many=True, context={"request": request})
-        return Response(serializer.data)
+        fields = ScanHistorySerializer.parse_fields(request.query_params.get('fields'))
+    except ValidationError as e:
+        return Response(e.detail, status=status.HTTP_400_BAD_REQUEST)
+    try:
+        chats = (Chat.objects.filter(user=request.user)
+                 .only(*ScanHistorySerializer.columns_for(fields)))
+        paginator = ScanHistoryPagination()
+        page = paginator.paginate_queryset(chats, request)
+        serializer = ScanHistorySerializer(page, many=True, fields=fields, context={"request": request})
+        return paginator.get_paginated_response(serializer.data)
     except Exception as e:
         return Response({"error": str(e)}, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
 
@@ -1692,6 +1605,7 @@ def get_scan_details(request, chat_id):
             "created_at": chat.created_at,
             "messages": chat.messages,
             "has_pdf": bool(chat.pdf_report),
+            "pdf_status": chat.pdf_status,
             "pdf_url": chat.pdf_report.url if chat.pdf_report else None
         }
         
@@ -1705,12 +1619,19 @@ def get_scan_details(request, chat_id):
 @permission_classes([IsAuthenticated])
 def download_scan_pdf(request, chat_id):
     """
-    Download the PDF report for a specific scan
+    Download the PDF report for a specific scan.
+    Returns 202 {"status": "pending"} while the report is still being generated.
     """
     try:
         chat = Chat.objects.get(id=chat_id, user=request.user)
         
         if not chat.pdf_report:
+            if chat.pdf_status == 'pending':
+                return Response({"status": "pending", "message": "PDF report is still being generated"},
+                                status=status.HTTP_202_ACCEPTED)
+            if chat.pdf_status == 'failed':
+                return Response({"status": "failed", "error": "PDF generation failed for this scan"},
+                                status=status.HTTP_500_INTERNAL_SERVER_ERROR)
             return Response({"error": "No PDF available for this scan"}, status=status.HTTP_404_NOT_FOUND)
         
         # Return the PDF file
@@ -1749,18 +1670,11 @@ def user_dashboard(request):
     try:
         user = request.user
         total_scans = Chat.objects.filter(user=user).count()
-        pdf_reports = Chat.objects.filter(user=user, pdf_report__isnull=False).count()
+        pdf_reports = Chat.objects.filter(user=user, pdf_report__isnull=False).exclude(pdf_report="").count()
         chat_sessions = total_scans  # Chats represent saved scan sessions
 
-        # Best-effort recommendations count: look for messages meta keys that indicate recommendations
-        recommendations = 0
-        for c in Chat.objects.filter(user=user).only("messages"):
-            msgs = c.messages or []
-            for m in msgs:
-                if isinstance(m, dict):
-                    meta = m.get("meta") or {}
-                    if meta.get("recommendation") or meta.get("recommendation_pending") or meta.get("follow_up"):
-                        recommendations += 1
+        # Best-effort recommendations count: messages whose meta carries a recommendation flag
+        recommendations = Chat.objects.filter(user=user).aggregate(n=Sum("recommendations_count"))["n"] or 0
 
         recent_qs = Chat.objects.filter(user=user).order_by("-created_at")[:5]
         recent_serialized = ChatSerializer(recent_qs, many=True, context={"request": request}).data
@@ -8,6 +8,8 @@ const ChatHistory = () => {
   const [chats, setChats] = useState([]);
   const [selectedChat, setSelectedChat] = useState(null);
   const [loading, setLoading] = useState(true);
+  const [nextPage, setNextPage] = useState(null);
+  const [loadingMore, setLoadingMore] = useState(false);
   const sidebarWidth = sidebarCollapsed ? 60 : 220;
 
   useEffect(() => {
@@ -18,7 +20,8 @@ const ChatHistory = () => {
     try {
       // remove the extra "/api" here if your api instance already adds it as baseURL
       const response = await api.get('/scan-history/');
-      setChats(response.data);
+      setChats(response.data.results);
+      setNextPage(response.data.next);
     } catch (error) {
       console.error('Error fetching chats:', error);
       setChats([]);
@@ -27,12 +30,33 @@ const ChatHistory = () => {
     }
   };
 
+  // history is cursor-paginated; `next` is an absolute URL carrying the cursor
+  const fetchMoreChats = async () => {
+    if (!nextPage) return;
+    setLoadingMore(true);
+    try {
+      const response = await api.get(nextPage);
+      setChats(prev => [...prev, ...response.data.results]);
+      setNextPage(response.data.next);
+    } catch (error) {
+      console.error('Error fetching more chats:', error);
+    } finally {
+      setLoadingMore(false);
+    }
+  };
+
   const handleDownloadPdf = async (chatId) => {
     try {
       // matches backend: download-scan-pdf/<id>/
       const response = await api.get(`/download-scan-pdf/${chatId}/`, {
         responseType: 'blob'
       });
+
+      // 202: the report is still being generated in the background
+      if (response.status === 202) {
+        alert('Your PDF report is still being generated. Please try again in a moment.');
+        return;
+      }
       
       // Create blob and download
       const blob = new Blob([response.data], { type: 'application/pdf' });
@@ -79,22 +103,17 @@ const ChatHistory = () => {
     setSelectedChat(null);
   };
 
-  // Extract risk estimate from chat messages
+  // Risk estimate from the scan summary columns
   const getRiskEstimate = (chat) => {
-    const aiMessage = chat.messages.find(msg => msg.sender === 'ai');
-    if (aiMessage && aiMessage.meta && aiMessage.meta.risk_estimate !== undefined) {
-      return (aiMessage.meta.risk_estimate * 100).toFixed(0) + '%';
+    if (chat.risk_estimate !== null && chat.risk_estimate !== undefined) {
+      return (chat.risk_estimate * 100).toFixed(0) + '%';
     }
     return 'N/A';
   };
 
-  // Extract model used from chat messages
+  // Model used from the scan summary columns
   const getModelUsed = (chat) => {
-    const aiMessage = chat.messages.find(msg => msg.sender === 'ai');
-    if (aiMessage && aiMessage.meta && aiMessage.meta.model_used) {
-      return aiMessage.meta.model_used;
-    }
-    return 'Unknown Model';
+    return chat.model_used || 'Unknown Model';
   };
 
   if (loading) return <div>Loading...</div>;
@@ -193,34 +212,32 @@ const ChatHistory = () => {
                     </div>
                   </div>
                   
-                  <div style={{ marginBottom: 12 }}>
-                    {chat.messages.slice(0, 2).map((msg, idx) => (
-                      <div key={idx} style={{
-                        textAlign: msg.sender === "ai" ? "left" : "right",
-                        marginBottom: 6,
-                      }}>
-                        <span style={{
-                          display: "inline-block",
-                          background: msg.sender === "ai" ? "#e7f4ff" : "#d1fae5",
-                          color: "#333",
-                          borderRadius: 8,
-                          padding: "6px 12px",
-                          fontSize: 14,
-                          maxWidth: "70%",
-                        }}>
-                          <strong>{msg.sender === "ai" ? "AI: " : "You: "}</strong>
-                          {msg.text}
-                        </span>
-                      </div>
-                    ))}
-                    {chat.messages.length > 2 && (
-                      <div style={{ fontSize: 12, color: "#666", textAlign: 'center', marginTop: 8 }}>
-                        + {chat.messages.length - 2} more messages
-                      </div>
-                    )}
+                  <div style={{ fontSize: 14, color: "#555" }}>
+                    {chat.images_count} image{chat.images_count === 1 ? "" : "s"} analyzed
+                    {" | "}
+                    {chat.recommendations_count} recommendation{chat.recommendations_count === 1 ? "" : "s"}
+                  </div>
                   </div>
                 </div>
               ))}
+              {nextPage && (
+                <button
+                  onClick={fetchMoreChats}
+                  disabled={loadingMore}
+                  style={{
+                    alignSelf: "center",
+                    background: "#fff",
+                    color: "#1e90e8",
+                    border: "1px solid #1e90e8",
+                    borderRadius: 6,
+                    padding: "8px 20px",
+                    fontSize: 14,
+                    cursor: loadingMore ? "default" : "pointer",
+                  }}
+                >
+                  {loadingMore ? "Loading..." : "Load more"}
+                </button>
+              )}
             </div>
           )}
         </div>